@@ -8,10 +8,10 @@ import tempfile
 import datetime
 from bson import ObjectId
 from bson.errors import InvalidId
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_jwt_extended import (
     JWTManager, create_access_token, create_refresh_token,
-    jwt_required, get_jwt, get_jwt_identity
+    jwt_required, get_jwt, get_jwt_identity, decode_token
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient, ASCENDING, DESCENDING
@@ -30,15 +30,22 @@ import zipfile
 import tempfile
 from pathlib import Path
 from google.cloud import storage
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import subprocess
 
 # ---- Custom modules ----
-from policy_validator import compare_documents
+from policy_validator import compare_documents_detailed, warm_up_semantic_model
+from policy_validator import CorpusStore, CorpusNotFound, TfidfModelStore, USER_SCOPE
+from policy_validator import ingest, IngestError, IngestTooLarge, IngestUnsupported
 from tools_validator import run_validation
 from rule_validator import validate_file
+from embedding_cache import embedding_cache_stats
 from tool_validator_engine import (
-    create_task, list_tasks, get_task, delete_task, run_task, run_all_tasks
+    create_task, list_tasks, get_task, delete_task, run_task, run_all_tasks,
+    compiled_tools_stats, submit_run_all_job, get_job, cancel_job,
+    reload_environment, environment_stats, get_profile, tool_timing_stats,
+    sandbox_stats, result_cache_stats, task_summary, task_results, forget_task_run, rebuild_task_stats,
+    reset_golden, import_tasks_jsonl, export_tasks_jsonl, validate_task, TaskValidationError
 )
 from db_sanity_engine import (
     run_sanity_check, list_sanity_reports, get_sanity_summary,run_sanity_from_zip,delete_sanity_report, get_sanity_report
@@ -46,7 +53,6 @@ from db_sanity_engine import (
 
 
 # ---- Custom Modules ----
-from policy_validator import compare_documents
 from tools_validator import run_validation
 from rule_validator import validate_file
 from api_sanity_check import sanity_bp
@@ -129,6 +135,11 @@ db.reports.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
 db.tasks.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
 db.audit_logs.create_index([("actor_user_id", ASCENDING), ("at", DESCENDING)])
 
+# Named document libraries for one-to-many comparisons, and the TF-IDF
+# models fitted on them (per corpus, plus one per user across all corpora)
+tfidf_models = TfidfModelStore(db.tfidf_models, db.corpora, db.corpus_docs)
+corpus_store = CorpusStore(db.corpora, db.corpus_docs, tfidf_models)
+
 
 # ---------------------------------------------------------------
 # Helper Functions
@@ -369,6 +380,20 @@ def end_session():
 #     next_cursor = str(docs[-1]["_id"]) if len(docs) == 20 else None
 #     return jsonify({"items": mongo_to_json(docs), "next_cursor": next_cursor}), 200
 
+def read_upload(f):
+    """Uploaded .txt/.md/.docx/.pdf -> (text, ingest metadata with per-stage timings).
+
+    Other extensions raise IngestUnsupported rather than being read as text.
+    """
+    return ingest(f.stream, f.filename or "", strict=True)
+
+
+def ingest_error_response(e):
+    if isinstance(e, IngestUnsupported):
+        return jsonify({"error": str(e)}), 415
+    return jsonify({"error": str(e)}), 413 if isinstance(e, IngestTooLarge) else 400
+
+
 @app.post("/reports")
 @jwt_required()
 def create_report():
@@ -384,8 +409,11 @@ def create_report():
         if not f1 or not f2:
             return jsonify({"error": "file1 and file2 required"}), 400
 
-        doc1 = f1.read().decode(errors="ignore")
-        doc2 = f2.read().decode(errors="ignore")
+        try:
+            doc1, ingest1 = read_upload(f1)
+            doc2, ingest2 = read_upload(f2)
+        except IngestError as e:
+            return ingest_error_response(e)
         title = request.form.get("title")
         tags = (request.form.get("tags") or "").split(",") if request.form.get("tags") else []
         in_meta = {
@@ -393,8 +421,11 @@ def create_report():
             "doc1_name": f1.filename,
             "doc2_name": f2.filename,
             "doc1_chars": len(doc1),
-            "doc2_chars": len(doc2)
+            "doc2_chars": len(doc2),
+            "doc1_ingest": ingest1,
+            "doc2_ingest": ingest2,
         }
+        project = request.form.get("project")
 
     else:
         data = request.get_json() or {}
@@ -403,30 +434,42 @@ def create_report():
         title = data.get("title")
         tags = data.get("tags") or []
         session_id = data.get("session_id") or session_id
+        project = data.get("project")
 
         if not doc1 or not doc2:
             return jsonify({"error": "doc1 and doc2 required"}), 400
 
         in_meta = {"source": "text", "doc1_chars": len(doc1), "doc2_chars": len(doc2)}
 
+    # IDF from the project's corpus (or all of the user's corpora) when it's
+    # big enough to mean something; otherwise TF-IDF fits the two documents
+    scope = project or USER_SCOPE
+    try:
+        tfidf_model = tfidf_models.usable(oid(uid), scope)
+    except Exception as e:
+        logger.exception("Error loading TF-IDF model: %s", e)
+        tfidf_model = None
+    in_meta["tfidf_model"] = (
+        {"scope": scope, "version": tfidf_model.version, "documents": tfidf_model.n_docs}
+        if tfidf_model is not None else None
+    )
+
     # ✅ FIXED: remove asyncio.run()
     print("[REPORT] Starting comparison...")
-    results = compare_documents(doc1, doc2)
-    print("[REPORT] Comparison complete.")
+    comparison = compare_documents_detailed(doc1, doc2, tfidf_model=tfidf_model)
+    print(f"[REPORT] Comparison complete in {comparison['timings_ms']['total']}ms.")
 
     doc = {
         "user_id": oid(uid),
         "session_id": oid(session_id) if session_id else None,
         "title": title or "Untitled report",
         "inputs": in_meta,
-        "results": {
-            "jaccard": results.get("Jaccard Similarity"),
-            "tfidf": results.get("TF-IDF Cosine Similarity"),
-            "semantic": results.get("Semantic Similarity"),
-            "llm": results.get("LLM Embedding Similarity")
-        },
+        "results": comparison["scores"],
+        "timings_ms": comparison["timings_ms"],
+        "errors": comparison["errors"],
         "tags": tags,
-        "status": "completed",
+        # partial: at least one scorer failed or timed out; the rest are still reported
+        "status": "partial" if comparison["errors"] else "completed",
         "report_type": "comparison",
         "created_at": now()
     }
@@ -452,13 +495,226 @@ def get_report(rid):
 @jwt_required()
 def delete_report(rid):
     uid = get_jwt_identity()
-    res = db.reports.delete_one({"_id": oid(rid), "user_id": oid(uid)})
-    if res.deleted_count == 0:
+    doc = db.reports.find_one_and_delete(
+        {"_id": oid(rid), "user_id": oid(uid)},
+        projection={"report_type": 1, "task_id": 1, "user_id": 1, "status": 1},
+    )
+    if doc is None:
         return jsonify({"error": "Report not found or unauthorized"}), 404
+    forget_task_run(doc)
     log_action(uid, "DELETE_REPORT", rid)
     return jsonify({"message": "Report deleted"}), 200
 
 
+# ---------------------------------------------------------------
+# Corpora (one document vs. a named library)
+# ---------------------------------------------------------------
+
+@app.get("/corpora")
+@jwt_required()
+def api_list_corpora():
+    uid = get_jwt_identity()
+    return jsonify({"items": mongo_to_json(corpus_store.list_corpora(oid(uid)))}), 200
+
+
+@app.get("/corpora/<name>/documents")
+@jwt_required()
+def api_corpus_documents(name):
+    uid = get_jwt_identity()
+    try:
+        return jsonify({"items": mongo_to_json(corpus_store.documents_of(oid(uid), name))}), 200
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.post("/corpora/<name>/documents")
+@jwt_required()
+def api_add_corpus_documents(name):
+    """Add documents (multipart `files`, or JSON {"documents": [{"title", "text"}]}); features are computed once here."""
+    uid = get_jwt_identity()
+    if (request.content_type or "").startswith("multipart/form-data"):
+        items = []
+        try:
+            for f in request.files.getlist("files"):
+                text, _ = read_upload(f)
+                items.append({"title": f.filename, "text": text})
+        except IngestError as e:
+            return ingest_error_response(e)
+    else:
+        items = (request.get_json() or {}).get("documents") or []
+    items = [i for i in items if isinstance(i, dict) and isinstance(i.get("text"), str)]
+    if not items:
+        return jsonify({"error": "at least one document with text is required"}), 400
+    try:
+        result = corpus_store.add_documents(oid(uid), name, items)
+        log_action(uid, "ADD_CORPUS_DOCUMENTS", meta={"corpus": name, "count": len(result["added"])})
+        return jsonify(mongo_to_json(result)), 201
+    except Exception as e:
+        logger.exception("Error adding corpus documents: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.delete("/corpora/<name>/documents/<doc_id>")
+@jwt_required()
+def api_remove_corpus_document(name, doc_id):
+    uid = get_jwt_identity()
+    try:
+        if not corpus_store.remove_document(oid(uid), name, doc_id):
+            return jsonify({"error": "Document not found"}), 404
+        return jsonify({"message": "Document removed"}), 200
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except InvalidId:
+        return jsonify({"error": "Invalid document id"}), 400
+
+
+@app.delete("/corpora/<name>")
+@jwt_required()
+def api_delete_corpus(name):
+    uid = get_jwt_identity()
+    try:
+        corpus_store.delete(oid(uid), name)
+        log_action(uid, "DELETE_CORPUS", meta={"corpus": name})
+        return jsonify({"message": "Corpus deleted"}), 200
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.post("/corpora/<name>/compare")
+@jwt_required()
+def api_compare_with_corpus(name):
+    """Rank a corpus against one document (multipart `file` or JSON `doc`); stored as a report."""
+    uid = get_jwt_identity()
+    if (request.content_type or "").startswith("multipart/form-data"):
+        f = request.files.get("file")
+        if not f:
+            return jsonify({"error": "file required"}), 400
+        try:
+            doc, doc_ingest = read_upload(f)
+        except IngestError as e:
+            return ingest_error_response(e)
+        data = request.form
+        in_meta = {"source": "upload", "doc_name": f.filename, "doc_chars": len(doc), "doc_ingest": doc_ingest}
+        tags = (data.get("tags") or "").split(",") if data.get("tags") else []
+    else:
+        data = request.get_json() or {}
+        doc = data.get("doc") or ""
+        if not doc:
+            return jsonify({"error": "doc required"}), 400
+        in_meta = {"source": "text", "doc_chars": len(doc)}
+        tags = data.get("tags") or []
+
+    try:
+        k = int(data.get("k", 10))
+    except (TypeError, ValueError):
+        return jsonify({"error": "k must be an integer"}), 400
+
+    try:
+        result = corpus_store.compare(oid(uid), name, doc, k=k, rank_by=data.get("rank_by") or "combined")
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error comparing against corpus: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    report = {
+        "user_id": oid(uid),
+        "title": data.get("title") or f"Compared with {name}",
+        "inputs": dict(in_meta, corpus=result["corpus"]),
+        "results": {"rank_by": result["rank_by"], "matches": result["matches"]},
+        "timings_ms": result["timings_ms"],
+        "errors": result["errors"],
+        "tags": tags,
+        "status": "partial" if result["errors"] else "completed",
+        "report_type": "corpus_comparison",
+        "created_at": now()
+    }
+    res = db.reports.insert_one(report)
+    log_action(uid, "CREATE_REPORT", res.inserted_id, {"corpus": name})
+    report["_id"] = str(res.inserted_id)
+    return jsonify(mongo_to_json(report)), 201
+
+
+def _threshold_arg(value, default=0.8):
+    threshold = float(default if value in (None, "") else value)
+    if not 0.0 <= threshold <= 1.0:
+        raise ValueError("threshold must be between 0 and 1")
+    return threshold
+
+
+@app.post("/corpora/<name>/near_duplicates")
+@jwt_required()
+def api_corpus_near_duplicates(name):
+    """Corpus documents whose Jaccard with the given one is above `threshold` (MinHash/LSH)."""
+    uid = get_jwt_identity()
+    if (request.content_type or "").startswith("multipart/form-data"):
+        f = request.files.get("file")
+        if not f:
+            return jsonify({"error": "file required"}), 400
+        try:
+            doc, _ = read_upload(f)
+        except IngestError as e:
+            return ingest_error_response(e)
+        data = request.form
+    else:
+        data = request.get_json() or {}
+        doc = data.get("doc")
+        if not isinstance(doc, str):
+            return jsonify({"error": "doc required"}), 400
+    verify = str(data.get("verify", "true")).lower() != "false"
+    try:
+        threshold = _threshold_arg(data.get("threshold"))
+        return jsonify(mongo_to_json(
+            corpus_store.near_duplicates(oid(uid), name, doc, threshold=threshold, verify=verify)
+        )), 200
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error finding near duplicates: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/tfidf/refit")
+@jwt_required()
+def api_refit_tfidf():
+    """Refit a TF-IDF model now ({"project": corpus name}; default: all of the user's corpora)."""
+    uid = get_jwt_identity()
+    scope = (request.get_json(silent=True) or {}).get("project") or USER_SCOPE
+    try:
+        model = tfidf_models.refit(oid(uid), scope)
+        if model is None:
+            return jsonify({"error": "Nothing to refit (unknown project or a concurrent update)"}), 409
+        return jsonify({"scope": scope, "version": model.version,
+                        "documents": model.n_docs, "terms": len(model)}), 200
+    except Exception as e:
+        logger.exception("Error refitting TF-IDF model: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/corpora/<name>/duplicates")
+@jwt_required()
+def api_corpus_duplicates(name):
+    """All near-duplicate pairs inside a corpus (?threshold=0.8&verify=true)."""
+    uid = get_jwt_identity()
+    verify = request.args.get("verify", "true").lower() != "false"
+    try:
+        threshold = _threshold_arg(request.args.get("threshold"))
+        return jsonify(mongo_to_json(
+            corpus_store.duplicates(oid(uid), name, threshold=threshold, verify=verify)
+        )), 200
+    except CorpusNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error finding duplicates: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
 def serialize_mongo_doc(doc):
     """Recursively converts ObjectId and datetime objects to strings."""
     if isinstance(doc, list):
@@ -800,11 +1056,48 @@ def api_create_task():
         task = create_task(uid, env, interface_num, actions, title)
         log_action(uid, "CREATE_TASK", task["_id"])
         return jsonify(task), 201
+    except TaskValidationError as e:
+        return jsonify({"error": str(e), "details": e.errors}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         logger.exception("Error creating task: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+@app.post("/tasks/import")
+@jwt_required()
+def api_import_tasks():
+    """Bulk-create tasks from JSONL (multipart 'file' or raw request body).
+
+    Lines are validated against the env's tool signatures; bad lines are
+    reported individually and the rest are still imported.
+    """
+    uid = get_jwt_identity()
+    try:
+        stream = request.files["file"].stream if "file" in request.files else request.stream
+        result = import_tasks_jsonl(uid, stream)
+        log_action(uid, "IMPORT_TASKS", None, {k: result[k] for k in ("lines", "inserted", "failed")})
+        return jsonify(result), 200 if result["inserted"] or not result["failed"] else 400
+    except Exception as e:
+        logger.exception("Error importing tasks: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/tasks/export")
+@jwt_required()
+def api_export_tasks():
+    """Stream the user's tasks (optionally ?env=) as JSONL."""
+    uid = get_jwt_identity()
+    env = request.args.get("env")
+    log_action(uid, "EXPORT_TASKS", None, {"env": env})
+    return Response(
+        stream_with_context(export_tasks_jsonl(uid, env)),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=tasks.jsonl"},
+    )
+
+
 @app.get("/tasks")
 @jwt_required()
 def api_list_tasks():
@@ -823,10 +1116,18 @@ def api_list_tasks():
 @app.post("/tasks/<tid>/run")
 @jwt_required()
 def api_run_task(tid):
-    """Run a single stored task."""
+    """Run a single stored task (tools run in the sandbox, under per-action
+    resource limits, unless ?backend=thread|process; ?profile=1 also records
+    a cProfile pstats blob, in-process; ?replay=1 diffs the outputs against
+    the task's golden run)."""
     uid = get_jwt_identity()
+    profile = request.args.get("profile", "").lower() in ("1", "true", "yes")
+    replay = request.args.get("replay", "").lower() in ("1", "true", "yes")
+    backend = request.args.get("backend") or None
+    if backend not in (None, "thread", "process", "sandbox"):
+        return jsonify({"error": "backend must be 'thread', 'process' or 'sandbox'"}), 400
     try:
-        report = run_task(uid, tid)
+        report = run_task(uid, tid, backend=backend, profile=profile, replay=replay)
         log_action(uid, "RUN_TASK", tid, {"status": report.get("status")})
         return jsonify(report), 200
     except Exception as e:
@@ -834,21 +1135,137 @@ def api_run_task(tid):
         return jsonify({"error": str(e)}), 500
 
 
+@app.delete("/tasks/<tid>/golden")
+@jwt_required()
+def api_reset_golden(tid):
+    """Drop a task's golden outputs; its next replay run records new ones."""
+    uid = get_jwt_identity()
+    try:
+        deleted = reset_golden(uid, tid)
+        log_action(uid, "RESET_TASK_GOLDEN", tid, {"deleted": deleted})
+        return jsonify({"message": "Golden reset" if deleted else "No golden recorded"}), 200
+    except FileNotFoundError:
+        return jsonify({"error": "Task not found"}), 404
+    except PermissionError:
+        return jsonify({"error": "Unauthorized access"}), 403
+    except Exception as e:
+        logger.exception("Error resetting task golden: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+def _emit_task_job_event(event, payload):
+    """Forward task job progress to the job owner's sockets only (room user:<uid>)."""
+    try:
+        socketio.emit(event, mongo_to_json(payload), to=f"user:{payload['uid']}")
+    except Exception:
+        logger.exception("Failed to emit %s", event)
+
+
 @app.post("/tasks/run_all")
 @jwt_required()
 def api_run_all_tasks():
-    """Run all tasks in parallel for the user (thread pool)."""
+    """
+    Queue a run of all the user's tasks and return the job id at once.
+    Progress streams over SocketIO (task_job_*); pass {"wait": true} for
+    the old blocking behaviour and {"replay": true} to diff every task
+    against its golden run.
+    """
     uid = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    backend = data.get("backend")
+    if backend not in (None, "thread", "process", "sandbox"):
+        return jsonify({"error": "backend must be 'thread', 'process' or 'sandbox'"}), 400
+    replay = bool(data.get("replay"))
     try:
+        if not data.get("wait"):
+            job = submit_run_all_job(
+                uid,
+                backend=backend,
+                replay=replay,
+                max_workers=data.get("max_workers"),
+                notify=_emit_task_job_event,
+                spawn=socketio.start_background_task,
+            )
+            log_action(uid, "RUN_ALL_TASKS", job["_id"], {"count": job["total"], "async": True})
+            return jsonify({
+                "message": "Run all queued",
+                "job_id": job["_id"],
+                "status": job["status"],
+                "total": job["total"],
+            }), 202
+
         # Parallel run_all_tasks
-        reports = run_all_tasks(uid)
-        log_action(uid, "RUN_ALL_TASKS", None, {"count": len(reports)})
-        return jsonify({"message": "All tasks executed", "reports": reports}), 200
+        before = compiled_tools_stats()
+        reports = run_all_tasks(uid, max_workers=data.get("max_workers"), backend=backend, replay=replay)
+        after = compiled_tools_stats()
+        tools_cache = {
+            "hits": after["hits"] - before["hits"],
+            "misses": after["misses"] - before["misses"],
+            "entries": after["entries"],
+        }
+        log_action(uid, "RUN_ALL_TASKS", None, {"count": len(reports), "tools_cache": tools_cache})
+        return jsonify({"message": "All tasks executed", "reports": reports, "tools_cache": tools_cache}), 200
     except Exception as e:
         logger.exception("Error running all tasks: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
+@app.get("/tasks/jobs/<job_id>")
+@jwt_required()
+def api_get_task_job(job_id):
+    """Poll a run_all job: status, counters and the per-task results so far."""
+    uid = get_jwt_identity()
+    try:
+        include_results = request.args.get("results", "true").lower() != "false"
+        job = get_job(uid, job_id, include_results=include_results)
+        return jsonify(mongo_to_json(job)), 200
+    except FileNotFoundError:
+        return jsonify({"error": "Job not found"}), 404
+    except PermissionError:
+        return jsonify({"error": "Unauthorized access"}), 403
+    except Exception as e:
+        logger.exception("Error fetching task job: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/tasks/jobs/<job_id>/cancel")
+@jwt_required()
+def api_cancel_task_job(job_id):
+    """Cancel a queued/running job; tasks already executing finish normally."""
+    uid = get_jwt_identity()
+    try:
+        job = cancel_job(uid, job_id)
+        log_action(uid, "CANCEL_TASK_JOB", job_id)
+        return jsonify(mongo_to_json(job)), 200
+    except FileNotFoundError:
+        return jsonify({"error": "Job not found"}), 404
+    except PermissionError:
+        return jsonify({"error": "Unauthorized access"}), 403
+    except Exception as e:
+        logger.exception("Error cancelling task job: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/tasks/reports/<rid>/profile")
+@jwt_required()
+def api_download_task_profile(rid):
+    """Download the pstats file of a profiled run (open with pstats/snakeviz)."""
+    uid = get_jwt_identity()
+    try:
+        blob = get_profile(uid, rid)
+        return send_file(
+            io.BytesIO(blob),
+            mimetype="application/octet-stream",
+            as_attachment=True,
+            download_name=f"task_run_{rid}.pstats",
+        )
+    except FileNotFoundError:
+        return jsonify({"error": "Profile not found"}), 404
+    except Exception as e:
+        logger.exception("Error fetching task profile: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
 @app.get("/tasks/summary")
 @jwt_required()
 def api_task_summary():
@@ -858,74 +1275,10 @@ def api_task_summary():
     """
     uid = get_jwt_identity()
     try:
-        # Step 1: Fetch all user tasks
-        all_tasks = list(db.tasks.find({"user_id": oid(uid)}))
-        total_tasks = len(all_tasks)
-
-        # Step 2: Get latest report per task (if exists)
-        pipeline = [
-            {"$match": {"user_id": oid(uid), "report_type": "task_run"}},
-            {"$sort": {"task_id": 1, "created_at": -1}},
-            {"$group": {
-                "_id": "$task_id",
-                "latest": {"$first": "$$ROOT"}
-            }},
-            {"$replaceRoot": {"newRoot": "$latest"}},
-        ]
-        latest_reports = list(db.reports.aggregate(pipeline))
-
-        # Convert to dict for quick lookup by task_id
-        latest_map = {str(r.get("task_id")): r for r in latest_reports}
-
-        # Step 3: Merge tasks + reports
-        summary_rows = []
-        passed = failed = not_run = 0
-
-        for t in all_tasks:
-            tid = str(t["_id"])
-            report = latest_map.get(tid)
-            if report:
-                status = report.get("status", "unknown").lower()
-                if status == "passed":
-                    passed += 1
-                elif status == "failed":
-                    failed += 1
-                else:
-                    not_run += 1
-                summary_rows.append({
-                    "id": tid,
-                    "title": t.get("title", f"Task {tid[:6]}"),
-                    "status": status,
-                    "created_at": report.get("created_at"),
-                    "task_id": tid,
-                    "error": report.get("error", ""),
-                })
-            else:
-                not_run += 1
-                summary_rows.append({
-                    "id": tid,
-                    "title": t.get("title", f"Task {tid[:6]}"),
-                    "status": "not_run",
-                    "created_at": t.get("created_at"),
-                    "task_id": tid,
-                    "error": "",
-                })
-
-        # Step 4: Compute rates
-        total_runs = passed + failed
-        pass_rate = round((passed / total_runs * 100), 1) if total_runs else 0.0
-
-        # Step 5: Final summary
-        summary = {
-            "total_tasks": total_tasks,
-            "passed": passed,
-            "failed": failed,
-            "not_run": not_run,
-            "pass_rate": f"{pass_rate}%",
-            "recent_runs": sorted(summary_rows, key=lambda x: x["created_at"] or datetime.min, reverse=True)
-        }
-
-        log_action(uid, "VIEW_TASK_SUMMARY", None, summary)
+        summary = task_summary(uid)
+        log_action(uid, "VIEW_TASK_SUMMARY", None, {
+            k: summary[k] for k in ("total_tasks", "passed", "failed", "not_run", "pass_rate")
+        })
         return jsonify(summary), 200
 
     except Exception as e:
@@ -936,49 +1289,24 @@ def api_task_summary():
 @app.get("/tasks/<tid>/results")
 @jwt_required()
 def api_single_task_results(tid):
-    """Fetch all recent run results and summary metrics for a specific task."""
+    """Fetch recent run results (without per-action payloads) and summary metrics for a task."""
     uid = get_jwt_identity()
     try:
-        pipeline = [
-            {"$match": {"user_id": oid(uid), "task_id": oid(tid), "report_type": "task_run"}},
-            {"$sort": {"created_at": -1}},
-            {"$limit": 50},
-        ]
-        reports = list(db.reports.aggregate(pipeline))
-
-        if not reports:
+        data = task_results(uid, tid)
+        if not data["results"]:
             return jsonify({
                 "task_id": tid,
-                "summary": {
-                    "total_runs": 0,
-                    "passed": 0,
-                    "failed": 0,
-                    "pass_rate": "0.0%",
-                },
+                "summary": data["summary"],
                 "results": [],
                 "message": "No results found for this task"
             }), 200
 
-        passed = sum(1 for r in reports if r.get("status") == "passed")
-        failed = sum(1 for r in reports if r.get("status") == "failed")
-        total_runs = passed + failed
-        pass_rate = round((passed / total_runs) * 100, 1) if total_runs else 0.0
-
-        # 🔧 Serialize results cleanly
-        results = [mongo_to_json(r) for r in reports]
-
-        summary = {
-            "total_runs": total_runs,
-            "passed": passed,
-            "failed": failed,
-            "pass_rate": f"{pass_rate}%",
-        }
-
-        log_action(uid, "VIEW_TASK_RESULTS", tid, summary)
+        log_action(uid, "VIEW_TASK_RESULTS", tid, data["summary"])
         return jsonify({
             "task_id": tid,
-            "summary": summary,
-            "results": results
+            "summary": data["summary"],
+            "tool_timings": tool_timing_stats(uid, tid),
+            "results": [mongo_to_json(r) for r in data["results"]]
         }), 200
 
     except Exception as e:
@@ -1000,6 +1328,67 @@ def list_envs():
         logger.exception("Error listing environments: %s", e)
         return jsonify({"error": str(e)}), 500
     
+@app.post("/envs/<env>/reload")
+@jwt_required()
+def api_reload_env(env):
+    """Re-scan an environment's data/tool files (only changed files are re-parsed)."""
+    uid = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    interface = data.get("interface_num")
+    try:
+        stats = reload_environment(
+            env, str(interface) if interface is not None else None, force=bool(data.get("force"))
+        )
+        log_action(uid, "RELOAD_ENV", None, {"env": env, "interface_num": interface})
+        return jsonify({"env": env, "reloaded": stats}), 200
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        logger.exception("Error reloading environment: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.post("/tasks/stats/rebuild")
+@jwt_required()
+def api_rebuild_task_stats():
+    """Recount the caller's per-task run counters from their stored reports (repair)."""
+    uid = get_jwt_identity()
+    try:
+        tasks = rebuild_task_stats(uid)
+        log_action(uid, "REBUILD_TASK_STATS", None, {"tasks": tasks})
+        return jsonify({"message": "Task stats rebuilt", "tasks": tasks}), 200
+    except Exception as e:
+        logger.exception("Error rebuilding task stats: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/envs/stats")
+@jwt_required()
+def api_env_stats():
+    """Load time and cache counters for every environment loaded by this worker."""
+    try:
+        return jsonify({
+            "envs": environment_stats(),
+            "tools_cache": compiled_tools_stats(),
+            "sandboxes": sandbox_stats(),
+            "result_cache": result_cache_stats(),
+        }), 200
+    except Exception as e:
+        logger.exception("Error fetching environment stats: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.get("/embeddings/cache/stats")
+@jwt_required()
+def api_embedding_cache_stats():
+    """Hit rates and size of the shared OpenAI embedding cache (this worker's counters)."""
+    try:
+        return jsonify(embedding_cache_stats()), 200
+    except Exception as e:
+        logger.exception("Error fetching embedding cache stats: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
 @app.get("/tasks/<tid>")
 @jwt_required()
 def api_get_task(tid):
@@ -1034,6 +1423,13 @@ def api_update_task(tid):
         return jsonify({"error": "No valid fields provided"}), 400
 
     try:
+        if updates.keys() & {"env", "interface_num", "actions"}:
+            current = db.tasks.find_one({"_id": oid(tid), "user_id": oid(uid)})
+            if current is None:
+                return jsonify({"error": "Task not found or unauthorized"}), 404
+            merged = dict(current, **updates)
+            validate_task(merged.get("env"), merged.get("interface_num", "1"), merged.get("actions", []))
+
         res = db.tasks.update_one(
             {"_id": oid(tid), "user_id": oid(uid)},
             {"$set": updates}
@@ -1044,6 +1440,10 @@ def api_update_task(tid):
         log_action(uid, "UPDATE_TASK", tid, {"updates": updates})
         task = db.tasks.find_one({"_id": oid(tid)})
         return jsonify(mongo_to_json(task)), 200
+    except TaskValidationError as e:
+        return jsonify({"error": str(e), "details": e.errors}), 400
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         logger.exception("Error updating task: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -1068,40 +1468,6 @@ def api_delete_task(tid):
         return jsonify({"error": str(e)}), 500
 
 
-@app.get("/tasks/<tid>/results")
-@jwt_required()
-def api_task_results(tid):
-    """Return all reports for a specific task ID."""
-    uid = get_jwt_identity()
-    try:
-        pipeline = [
-            {"$match": {"user_id": oid(uid), "task_id": oid(tid)}},
-            {"$sort": {"created_at": -1}},
-        ]
-        reports = list(db.reports.aggregate(pipeline))
-
-        if not reports:
-            return jsonify({"message": "No reports found for this task"}), 200
-
-        passed = sum(1 for r in reports if r.get("status") == "passed")
-        failed = sum(1 for r in reports if r.get("status") == "failed")
-        total = len(reports)
-        pass_rate = round((passed / total * 100), 1) if total else 0.0
-
-        result = {
-            "task_id": tid,
-            "total_runs": total,
-            "passed": passed,
-            "failed": failed,
-            "pass_rate": pass_rate,
-            "reports": mongo_to_json(reports),
-        }
-
-        return jsonify(result), 200
-    except Exception as e:
-        logger.exception("Error fetching task results: %s", e)
-        return jsonify({"error": str(e)}), 500
-
 # -------------------- Unit Test Generator -----------------------------------------
 
 # ============================================================
@@ -1132,6 +1498,28 @@ socketio = SocketIO(
     ping_interval=25,
 )
 
+
+@socketio.on("connect")
+def socket_connect(auth=None):
+    """Put sockets that present an access token in their user's room.
+
+    The token comes from the client's `auth` payload ({"token": ...}) or a
+    ?token= query parameter; per-user events (task_job_*) only go to that room.
+    """
+    token = (auth or {}).get("token") if isinstance(auth, dict) else None
+    token = token or request.args.get("token")
+    if not token:
+        return
+    try:
+        claims = decode_token(token.removeprefix("Bearer ").strip())
+        join_room(f"user:{claims[app.config.get('JWT_IDENTITY_CLAIM', 'sub')]}")
+    except Exception as e:
+        logger.warning("Socket connected with an invalid token: %s", e)
+
+
+# Start (or find) the shared semantic inference service without blocking boot
+warm_up_semantic_model()
+
 # ---------- Storage / Paths ----------
 LOCAL_STORAGE_DIR = Path("local_storage")
 LOGS_DIR = Path("logs")
@@ -0,0 +1,17 @@
+from .store import EmbeddingCache, cache_key, normalize_text
+
+# Shared by every embedding call site in the process
+embedding_cache = EmbeddingCache()
+
+
+def embedding_cache_stats():
+    return embedding_cache.stats()
+
+
+__all__ = [
+    "EmbeddingCache",
+    "cache_key",
+    "normalize_text",
+    "embedding_cache",
+    "embedding_cache_stats",
+]
@@ -0,0 +1,240 @@
+import os
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from cachetools import LRUCache
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "docdiff_embeddings.sqlite3")
+)
+# On-disk budget; least recently used vectors are evicted past it
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# In-memory LRU in front of the disk store
+EMBEDDING_CACHE_MEMORY_MB = float(os.getenv("EMBEDDING_CACHE_MEMORY_MB", "64"))
+# last_used is only rewritten when older than this, so hot reads don't write
+TOUCH_INTERVAL_S = 60
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form used for the cache key."""
+    return " ".join((text or "").split())
+
+
+def cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}|{digest}"
+
+
+class EmbeddingCache:
+    """(model, sha256 of normalized text) -> float16 vector.
+
+    Vectors live in a local SQLite file shared by every worker process on
+    the host, with a byte-sized LRU in front of it per process. The file is
+    kept under EMBEDDING_CACHE_MAX_MB by dropping least recently used rows.
+    Vectors are returned as float32; the float16 round trip changes cosine
+    similarities by well under 1e-3.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+                 memory_bytes: int = int(EMBEDDING_CACHE_MEMORY_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._memory = LRUCache(maxsize=max(1, memory_bytes), getsizeof=lambda v: v.nbytes)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._disk_error = None
+        try:
+            self._init_db()
+        except sqlite3.Error as e:
+            # memory-only; a broken disk cache must never break embeddings
+            self._disk_error = str(e)
+            print(f"[WARN] Embedding cache disk store unavailable ({path}): {e}")
+
+    # ----- disk ----- #
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _init_db(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+                " vector BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self._disk_error or not keys:
+            return {}
+        found, stale = {}, []
+        now = time.time()
+        try:
+            conn = self._conn()
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, blob, last_used in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float16)
+                    if now - last_used > TOUCH_INTERVAL_S:
+                        stale.append((now, key))
+            if stale:
+                with conn:
+                    conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", stale)
+        except sqlite3.Error as e:
+            print(f"[WARN] Embedding cache read failed: {e}")
+        return found
+
+    def _disk_put(self, rows: List[tuple]):
+        if self._disk_error or not rows:
+            return
+        try:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, size, created, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"[WARN] Embedding cache write failed: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # trim to 90% so eviction doesn't run on every subsequent write
+        excess = total - int(self.max_bytes * 0.9)
+        victims, freed = [], 0
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        with conn:
+            conn.executemany("DELETE FROM embeddings WHERE key=?", victims)
+        with self._lock:
+            self._counts["evictions"] += len(victims)
+
+    # ----- public ----- #
+    def get_many(self, model: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """Cached vectors by position in `texts` (float32); misses are absent."""
+        keys = [cache_key(model, t) for t in texts]
+        out, missing = {}, {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    out[i] = vec
+                    self._counts["memory_hits"] += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        found = self._disk_get(list(missing))
+        with self._lock:
+            for key, positions in missing.items():
+                vec = found.get(key)
+                if vec is None:
+                    self._counts["misses"] += len(positions)
+                    continue
+                self._remember(key, vec)
+                self._counts["disk_hits"] += len(positions)
+                for i in positions:
+                    out[i] = vec
+        return {i: v.astype(np.float32) for i, v in out.items()}
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if vector is None:
+                    continue
+                vec = np.asarray(vector, dtype=np.float16)
+                key = cache_key(model, text)
+                self._remember(key, vec)
+                blob = vec.tobytes()
+                rows.append((key, model, vec.shape[0], blob, len(blob), now, now))
+            self._counts["stores"] += len(rows)
+        self._disk_put(rows)
+
+    def _remember(self, key, vec):
+        try:
+            self._memory[key] = vec
+        except ValueError:
+            pass  # a single vector larger than the whole memory budget
+
+    def embed(self, model: str, texts: Sequence[str],
+              fetch: Callable[[List[str]], Sequence[Optional[Sequence[float]]]]) -> List[Optional[np.ndarray]]:
+        """Vectors for `texts`, calling `fetch` only for the ones not cached.
+
+        `fetch` gets the missing texts (deduplicated) and returns one vector
+        per text, or None for a text it could not embed; None is returned
+        as-is and never cached.
+        """
+        texts = list(texts)
+        result: List[Optional[np.ndarray]] = [None] * len(texts)
+        for i, vec in self.get_many(model, texts).items():
+            result[i] = vec
+
+        pending: Dict[str, List[int]] = {}
+        for i, vec in enumerate(result):
+            if vec is None:
+                pending.setdefault(cache_key(model, texts[i]), []).append(i)
+        if not pending:
+            return result
+
+        todo = [texts[positions[0]] for positions in pending.values()]
+        fetched = list(fetch(todo))
+        self.put_many(model, todo, fetched)
+        for positions, vector in zip(pending.values(), fetched):
+            if vector is None:
+                continue
+            # same float16 round trip as a later cache hit, so results don't
+            # depend on whether the vector came from the cache
+            vec = np.asarray(vector, dtype=np.float16).astype(np.float32)
+            for i in positions:
+                result[i] = vec
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            memory = {"entries": len(self._memory), "bytes": int(self._memory.currsize),
+                      "max_bytes": int(self._memory.maxsize)}
+        lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+        counts["hit_rate"] = round((counts["memory_hits"] + counts["disk_hits"]) / lookups, 4) if lookups else None
+        disk = {"path": self.path, "max_bytes": self.max_bytes, "error": self._disk_error}
+        if not self._disk_error:
+            try:
+                entries, size = self._conn().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings"
+                ).fetchone()
+                disk.update(entries=entries, bytes=size)
+            except sqlite3.Error as e:
+                disk["error"] = str(e)
+        return dict(counts, memory=memory, disk=disk)
@@ -0,0 +1,416 @@
+import os
+import time
+import warnings
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+from cachetools import LRUCache
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from scipy import sparse
+
+from .lexical_similarity_validator import tokenize
+from . import minhash
+from .tf_idf import clean_text
+from .tfidf_model import TfidfModel, USER_SCOPE
+from . import semantic_similarity, llm_embeddings
+from .pipeline import SCORERS, _get_thread_pool
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+# Built corpus indexes kept per worker (keyed by corpus id + version)
+CORPUS_INDEX_CACHE_SIZE = int(os.getenv("CORPUS_INDEX_CACHE_SIZE", "8"))
+CORPUS_MAX_TOP_K = int(os.getenv("CORPUS_MAX_TOP_K", "100"))
+# Candidates whose MinHash estimate is within this much below the threshold
+# still get an exact check, so estimation noise doesn't drop true matches
+MINHASH_VERIFY_SLACK = float(os.getenv("MINHASH_VERIFY_SLACK", "0.1"))
+METRICS = [s.name for s in SCORERS]  # jaccard, tfidf, semantic, llm
+RANK_BY = ("combined",) + tuple(METRICS)
+
+
+class CorpusNotFound(LookupError):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _vector_bytes(vec):
+    return None if vec is None else np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def _vector(blob):
+    return None if blob is None else np.frombuffer(blob, dtype=np.float32)
+
+
+def _embed_all(docs):
+    """MiniLM and OpenAI document embeddings for `docs`, computed concurrently.
+
+    A backend that fails leaves None for every document and reports why.
+    """
+    pool = _get_thread_pool()
+    futures = {
+        "semantic": pool.submit(semantic_similarity.document_embeddings, docs),
+        "llm": pool.submit(llm_embeddings.document_embeddings, docs),
+    }
+    out, errors = {}, {}
+    for name, future in futures.items():
+        try:
+            out[name] = future.result()
+        except Exception as e:
+            print(f"[WARN] Corpus {name} embeddings failed: {e}")
+            out[name] = [None] * len(docs)
+            errors[name] = str(e)
+    return out, errors
+
+
+def document_features(texts):
+    """Everything a corpus keeps per document, for a batch of raw texts."""
+    embeddings, errors = _embed_all(texts)
+    features = []
+    for i, text in enumerate(texts):
+        tokens = tokenize(text)
+        features.append({
+            "chars": len(text),
+            "clean_text": clean_text(text),
+            "tokens": sorted(tokens),
+            "minhash": minhash.signature(tokens),
+            "semantic": embeddings["semantic"][i],
+            "llm": embeddings["llm"][i],
+        })
+    return features, errors
+
+
+def _unit_rows(vectors, dim=None):
+    """Row-normalized matrix plus a mask of rows that had a vector."""
+    present = np.array([v is not None and np.any(v) for v in vectors], dtype=bool)
+    if dim is None:
+        dim = next((len(v) for v, ok in zip(vectors, present) if ok), 0)
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, v in enumerate(vectors):
+        if present[i] and len(v) == dim:
+            matrix[i] = v / np.linalg.norm(v)
+        else:
+            present[i] = False
+    return matrix, present
+
+
+class CorpusIndex:
+    """In-memory scoring matrices for one version of a corpus.
+
+    TF-IDF uses the corpus-fitted model, token sets become one sparse
+    binary matrix, and both embedding types are stacked unit rows, so a
+    query against N documents is four matrix-vector products.
+    """
+
+    def __init__(self, docs, tfidf_model=None):
+        self.ids = [d["_id"] for d in docs]
+        self.titles = [d.get("title") for d in docs]
+        n = len(docs)
+
+        clean = [d.get("clean_text") or "" for d in docs]
+        # the persisted corpus-fitted model when there is one; otherwise fit here
+        self.tfidf_model = tfidf_model if tfidf_model is not None else TfidfModel.fit(clean)
+        self.tfidf = self.tfidf_model.transform(clean)[:, :len(self.tfidf_model)].tocsr()
+        self.has_clean = np.array([bool(c) for c in clean], dtype=bool)
+
+        self.vocab = {}
+        rows, cols = [], []
+        for i, d in enumerate(docs):
+            for token in d.get("tokens") or []:
+                rows.append(i)
+                cols.append(self.vocab.setdefault(token, len(self.vocab)))
+        self.tokens = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, len(self.vocab))
+        )
+        self.token_counts = np.asarray(self.tokens.sum(axis=1)).ravel()
+
+        self.signatures = np.vstack(
+            [minhash.from_bytes(d["minhash"]) for d in docs]
+        ) if docs else np.zeros((0, minhash.NUM_PERM), dtype=np.uint32)
+
+        self.semantic, self.has_semantic = _unit_rows([_vector(d.get("semantic")) for d in docs])
+        self.llm, self.has_llm = _unit_rows([_vector(d.get("llm")) for d in docs])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _jaccard(self, tokens):
+        if not len(self):
+            return np.zeros(0, dtype=np.float32)
+        known = [self.vocab[t] for t in tokens if t in self.vocab]
+        inter = np.asarray(self.tokens[:, known].sum(axis=1)).ravel() if known else np.zeros(len(self))
+        union = self.token_counts + len(tokens) - inter
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(union > 0, inter / union, 1.0)  # both empty → identical
+        return scores.astype(np.float32)
+
+    def _tfidf(self, clean):
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self.tfidf_model) or not clean:
+            return scores
+        # terms the corpus never saw still count in the query's norm, then drop out
+        q = self.tfidf_model.transform([clean])[:, :self.tfidf.shape[1]]
+        scores = np.asarray((self.tfidf @ q.T).todense()).ravel().astype(np.float32)
+        scores[~self.has_clean] = 0.0
+        return scores
+
+    @staticmethod
+    def _cosine(matrix, present, vec):
+        scores = np.full(len(present), np.nan, dtype=np.float32)
+        if vec is None or not np.any(vec) or matrix.shape[1] != len(vec):
+            return scores
+        scores[present] = matrix[present] @ (vec / np.linalg.norm(vec))
+        return scores
+
+    def score(self, query):
+        """All four metrics against every document; NaN where one is unavailable."""
+        return {
+            "jaccard": self._jaccard(query["tokens"]),
+            "tfidf": self._tfidf(query["clean_text"]),
+            "semantic": self._cosine(self.semantic, self.has_semantic, query["semantic"]),
+            "llm": self._cosine(self.llm, self.has_llm, query["llm"]),
+        }
+
+    def exact_jaccard_pair(self, i, j):
+        inter = self.tokens[i].multiply(self.tokens[j]).sum()
+        union = self.token_counts[i] + self.token_counts[j] - inter
+        return 1.0 if union == 0 else float(inter / union)
+
+    def duplicate_pairs(self, threshold=0.8, verify=True):
+        """Document pairs at or above `threshold` Jaccard, found through LSH buckets."""
+        floor = threshold - MINHASH_VERIFY_SLACK if verify else threshold
+        pairs = []
+        for i, j in minhash.candidate_pairs(self.signatures):
+            approx = minhash.approx_jaccard(self.signatures[i], self.signatures[j])
+            if approx < floor:
+                continue
+            exact = self.exact_jaccard_pair(i, j) if verify else None
+            if verify and exact < threshold:
+                continue
+            pairs.append({
+                "documents": [
+                    {"document_id": self.ids[i], "title": self.titles[i]},
+                    {"document_id": self.ids[j], "title": self.titles[j]},
+                ],
+                "approx_jaccard": round(approx, 4),
+                "jaccard": None if exact is None else round(exact, 6),
+            })
+        pairs.sort(key=lambda p: -(p["jaccard"] if p["jaccard"] is not None else p["approx_jaccard"]))
+        return pairs
+
+    def top_k(self, query, k=10, rank_by="combined"):
+        scores = self.score(query)
+        if rank_by == "combined":
+            stacked = np.vstack([scores[m] for m in METRICS])
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN column → NaN
+                key = np.nanmean(stacked, axis=0)
+        else:
+            key = scores[rank_by]
+        key = np.nan_to_num(key, nan=-np.inf)
+
+        k = max(0, min(k, len(self)))
+        if not k:
+            return []
+        top = np.argpartition(-key, k - 1)[:k] if k < len(self) else np.arange(len(self))
+        top = top[np.argsort(-key[top], kind="stable")]
+        return [{
+            "document_id": self.ids[i],
+            "title": self.titles[i],
+            "rank": rank + 1,
+            "scores": {m: (None if np.isnan(scores[m][i]) else round(float(scores[m][i]), 6)) for m in METRICS},
+            "rank_score": None if not np.isfinite(key[i]) else round(float(key[i]), 6),
+        } for rank, i in enumerate(top)]
+
+
+class CorpusStore:
+    """Named per-user document libraries with precomputed comparison features.
+
+    Features are computed once when a document is added and stored with
+    it; each worker builds a CorpusIndex from them on first use and keeps
+    it until the corpus version changes.
+    """
+
+    def __init__(self, corpora, documents, tfidf_models=None):
+        self.corpora = corpora
+        self.documents = documents
+        self.tfidf_models = tfidf_models
+        self.corpora.create_index([("user_id", ASCENDING), ("name", ASCENDING)], unique=True)
+        self.documents.create_index([("corpus_id", ASCENDING), ("_id", ASCENDING)])
+        self.documents.create_index([("corpus_id", ASCENDING), ("lsh_bands", ASCENDING)])
+        self._indexes = LRUCache(maxsize=max(1, CORPUS_INDEX_CACHE_SIZE))
+        self._lock = threading.Lock()
+
+    def _corpus(self, user_id, name):
+        corpus = self.corpora.find_one({"user_id": user_id, "name": name})
+        if corpus is None:
+            raise CorpusNotFound(f"Corpus '{name}' not found")
+        return corpus
+
+    def list_corpora(self, user_id):
+        return list(self.corpora.find({"user_id": user_id}).sort("name", ASCENDING))
+
+    def documents_of(self, user_id, name):
+        corpus = self._corpus(user_id, name)
+        return list(self.documents.find(
+            {"corpus_id": corpus["_id"]}, {"title": 1, "chars": 1, "created_at": 1}
+        ).sort("_id", ASCENDING))
+
+    def add_documents(self, user_id, name, items):
+        """Add [{"title", "text"}] to a corpus (created on first use)."""
+        features, errors = document_features([item["text"] for item in items])
+        corpus = self.corpora.find_one_and_update(
+            {"user_id": user_id, "name": name},
+            {"$setOnInsert": {"created_at": _now(), "version": 0, "documents": 0, "minhash": True}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        now = _now()
+        docs = [{
+            "corpus_id": corpus["_id"],
+            "user_id": user_id,
+            "title": item.get("title") or f"Document {i + 1}",
+            "chars": f["chars"],
+            "clean_text": f["clean_text"],
+            "tokens": f["tokens"],
+            "semantic": _vector_bytes(f["semantic"]),
+            "llm": _vector_bytes(f["llm"]),
+            "minhash": minhash.to_bytes(f["minhash"]),
+            "lsh_bands": minhash.band_keys(f["minhash"]),
+            "created_at": now,
+        } for i, (item, f) in enumerate(zip(items, features))]
+        ids = self.documents.insert_many(docs).inserted_ids if docs else []
+        if self.tfidf_models is not None and docs:
+            self.tfidf_models.update(user_id, [USER_SCOPE, name], added=[d["clean_text"] for d in docs])
+        self.corpora.update_one({"_id": corpus["_id"]}, {
+            "$inc": {"version": 1, "documents": len(ids)}, "$set": {"updated_at": now},
+        })
+        return {"corpus_id": corpus["_id"], "added": [str(i) for i in ids], "errors": errors}
+
+    def remove_document(self, user_id, name, doc_id):
+        corpus = self._corpus(user_id, name)
+        removed = self.documents.find_one_and_delete(
+            {"_id": ObjectId(doc_id), "corpus_id": corpus["_id"]}, projection={"clean_text": 1}
+        )
+        if removed is None:
+            return False
+        if self.tfidf_models is not None:
+            self.tfidf_models.update(user_id, [USER_SCOPE, name], removed=[removed.get("clean_text") or ""])
+        self.corpora.update_one({"_id": corpus["_id"]}, {
+            "$inc": {"version": 1, "documents": -1}, "$set": {"updated_at": _now()},
+        })
+        return True
+
+    def delete(self, user_id, name):
+        corpus = self._corpus(user_id, name)
+        self.documents.delete_many({"corpus_id": corpus["_id"]})
+        self.corpora.delete_one({"_id": corpus["_id"]})
+        if self.tfidf_models is not None:
+            self.tfidf_models.drop(user_id, name)
+            self.tfidf_models.refit_in_background(user_id, USER_SCOPE)
+
+    def _backfill_minhash(self, corpus):
+        """Signatures for documents stored before MinHash existed (from their tokens)."""
+        if corpus.get("minhash"):
+            return
+        ops = []
+        for d in self.documents.find({"corpus_id": corpus["_id"], "minhash": {"$exists": False}}, {"tokens": 1}):
+            sig = minhash.signature(d.get("tokens") or [])
+            ops.append(UpdateOne({"_id": d["_id"]}, {"$set": {
+                "minhash": minhash.to_bytes(sig), "lsh_bands": minhash.band_keys(sig),
+            }}))
+        if ops:
+            self.documents.bulk_write(ops, ordered=False)
+        self.corpora.update_one({"_id": corpus["_id"]}, {"$set": {"minhash": True}})
+
+    def index(self, user_id, name):
+        corpus = self._corpus(user_id, name)
+        model = None
+        if self.tfidf_models is not None:
+            # corpora from before fitted models existed get theirs on first use
+            model = self.tfidf_models.get(user_id, name)
+            if model is None:
+                model = self.tfidf_models.refit(user_id, name)
+        key = (corpus["_id"], corpus.get("version", 0), model.version if model is not None else None)
+        with self._lock:
+            index = self._indexes.get(key)
+        if index is None:
+            self._backfill_minhash(corpus)
+            docs = list(self.documents.find(
+                {"corpus_id": corpus["_id"]},
+                {"title": 1, "clean_text": 1, "tokens": 1, "semantic": 1, "llm": 1, "minhash": 1},
+            ).sort("_id", ASCENDING))
+            index = CorpusIndex(docs, model)
+            with self._lock:
+                self._indexes[key] = index
+        return corpus, index
+
+    def compare(self, user_id, name, text, k=10, rank_by="combined"):
+        """Rank a corpus against one document; every metric in one pass."""
+        if rank_by not in RANK_BY:
+            raise ValueError(f"rank_by must be one of {', '.join(RANK_BY)}")
+        timings = {}
+        started = time.perf_counter()
+        corpus, index = self.index(user_id, name)
+        timings["index"] = round((time.perf_counter() - started) * 1000, 2)
+
+        step = time.perf_counter()
+        features, errors = document_features([text])
+        timings["features"] = round((time.perf_counter() - step) * 1000, 2)
+
+        step = time.perf_counter()
+        matches = index.top_k(features[0], k=max(1, min(k, CORPUS_MAX_TOP_K)), rank_by=rank_by)
+        timings["scoring"] = round((time.perf_counter() - step) * 1000, 2)
+        timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+        return {
+            "corpus": {"id": corpus["_id"], "name": name, "version": corpus.get("version", 0),
+                       "documents": len(index)},
+            "rank_by": rank_by,
+            "matches": matches,
+            "timings_ms": timings,
+            "errors": errors,
+        }
+
+    def near_duplicates(self, user_id, name, text, threshold=0.8, verify=True, limit=50):
+        """Stored documents whose Jaccard with `text` is at least `threshold`.
+
+        Only documents sharing an LSH band with the query are read, and
+        only their signatures (plus tokens when `verify` asks for an exact
+        Jaccard check of each hit).
+        """
+        corpus = self._corpus(user_id, name)
+        self._backfill_minhash(corpus)
+        tokens = tokenize(text)
+        sig = minhash.signature(tokens)
+        projection = {"title": 1, "minhash": 1}
+        if verify:
+            projection["tokens"] = 1
+        candidates = list(self.documents.find(
+            {"corpus_id": corpus["_id"], "lsh_bands": {"$in": minhash.band_keys(sig)}}, projection
+        ))
+
+        floor = threshold - MINHASH_VERIFY_SLACK if verify else threshold
+        matches = []
+        for d in candidates:
+            approx = minhash.approx_jaccard(sig, minhash.from_bytes(d["minhash"]))
+            if approx < floor:
+                continue
+            exact = minhash.exact_jaccard(tokens, d.get("tokens") or []) if verify else None
+            if verify and exact < threshold:
+                continue
+            matches.append({
+                "document_id": d["_id"],
+                "title": d.get("title"),
+                "approx_jaccard": round(approx, 4),
+                "jaccard": None if exact is None else round(exact, 6),
+            })
+        matches.sort(key=lambda m: -(m["jaccard"] if m["jaccard"] is not None else m["approx_jaccard"]))
+        return {"candidates": len(candidates), "matches": matches[:limit]}
+
+    def duplicates(self, user_id, name, threshold=0.8, verify=True):
+        """Every near-duplicate pair inside a corpus, without comparing all pairs."""
+        corpus, index = self.index(user_id, name)
+        return {"documents": len(index), "pairs": index.duplicate_pairs(threshold, verify)}
@@ -0,0 +1,375 @@
+"""
+Local SentenceTransformer inference service.
+
+One process loads the model once and serves every gunicorn worker over a
+Unix socket; concurrent encode requests are merged into micro-batches.
+Run standalone with `python inference_service.py`, or let the first
+client that needs it start it (see InferenceClient).
+
+This file is deliberately self-contained (stdlib + numpy, the model
+libraries imported lazily) so starting the service never imports the
+policy_validator package.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+import socketserver
+from concurrent.futures import Future
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process backend is available
+    fcntl = None
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+MODEL_NAME = os.getenv("SEMANTIC_MODEL", "all-MiniLM-L6-v2")
+SOCKET_PATH = os.getenv(
+    "INFERENCE_SOCKET", os.path.join(tempfile.gettempdir(), "docdiff_inference.sock")
+)
+# Texts per forward pass, and how long the first request waits for company
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+# How long a client waits for a service it started to come up (model load)
+INFERENCE_START_TIMEOUT = float(os.getenv("INFERENCE_START_TIMEOUT", "180"))
+INFERENCE_REQUEST_TIMEOUT = float(os.getenv("INFERENCE_REQUEST_TIMEOUT", "120"))
+# Intra-op threads for torch; 1 kept the old Windows CPU hang away
+SEMANTIC_TORCH_THREADS = int(os.getenv(
+    "SEMANTIC_TORCH_THREADS", "1" if os.name == "nt" else str(min(4, os.cpu_count() or 1))
+))
+
+# -------------------------------------------------------
+# Model helpers (shared with the in-process backend)
+# -------------------------------------------------------
+def load_model(name: str = MODEL_NAME):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(max(1, SEMANTIC_TORCH_THREADS))
+    print(f"[INIT] Loading SentenceTransformer model '{name}'...")
+    model = SentenceTransformer(name)
+    _ = model.encode(["warmup"])  # optional warmup
+    print("[INIT] Transformer model ready.")
+    return model
+
+
+class _ModelGuards:
+    """Locks for one model's HF fast tokenizer, which is not thread-safe.
+
+    encode() sets truncation/padding on the tokenizer, and a Rust fast
+    tokenizer used from two threads at once raises "Already borrowed".
+    Splitting gets its own copy of the tokenizer so it never waits on a
+    forward pass; each copy is used by one thread at a time.
+    """
+
+    def __init__(self, model):
+        self.encode_lock = threading.Lock()
+        self.split_lock = threading.Lock()
+        self.split_tokenizer = copy.deepcopy(model.tokenizer)
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def _guards_for(model) -> _ModelGuards:
+    with _guards_lock:
+        guards = _guards.get(id(model))
+        if guards is None:
+            guards = _guards[id(model)] = _ModelGuards(model)
+        return guards
+
+
+def split_windows(model, text: str, overlap: int):
+    """
+    Split text into windows that fit the model's max_seq_length.
+    Returns (window texts, word-piece count of each window).
+    """
+    size = model.max_seq_length - 2  # room for [CLS]/[SEP]
+    step = max(1, size - max(0, min(overlap, size - 1)))
+    guards = _guards_for(model)
+    windows, lengths = [], []
+    with guards.split_lock:
+        tokenizer = guards.split_tokenizer
+        ids = tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"]
+        for start in range(0, max(len(ids), 1), step):
+            piece = ids[start:start + size]
+            window = tokenizer.decode(piece).strip()
+            if window:
+                windows.append(window)
+                lengths.append(len(piece))
+            if start + size >= len(ids):
+                break
+    return windows, lengths
+
+
+def encode(model, texts, batch_size: int = INFERENCE_MAX_BATCH) -> np.ndarray:
+    import torch
+
+    with _guards_for(model).encode_lock, torch.inference_mode():
+        emb = model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True,
+                           show_progress_bar=False)
+    return np.asarray(emb, dtype=np.float32)
+
+# -------------------------------------------------------
+# Wire format: >I header length, JSON header, then header["payload"] raw bytes
+# -------------------------------------------------------
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ConnectionError("inference service connection closed")
+        buf += part
+    return bytes(buf)
+
+
+def send_frame(sock, header: dict, payload: bytes = b""):
+    header = dict(header, payload=len(payload))
+    raw = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(raw)) + raw + payload)
+
+
+def recv_frame(sock):
+    (size,) = struct.unpack(">I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, size))
+    payload = _recv_exact(sock, header["payload"]) if header.get("payload") else b""
+    return header, payload
+
+# -------------------------------------------------------
+# Server
+# -------------------------------------------------------
+class MicroBatcher:
+    """Merges concurrent encode requests into one forward pass.
+
+    The first request waits at most INFERENCE_MAX_WAIT_MS for others to
+    arrive, so a lone request pays almost nothing and a burst from several
+    workers becomes a single batch.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = INFERENCE_MAX_BATCH,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0}
+        threading.Thread(target=self._loop, name="microbatcher", daemon=True).start()
+
+    def submit(self, texts) -> Future:
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            count = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            texts = [t for item_texts, _ in batch for t in item_texts]
+            self.stats["requests"] += len(batch)
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += 1
+            try:
+                emb = self.encode_fn(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for item_texts, future in batch:
+                future.set_result(emb[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header, _ = recv_frame(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            try:
+                op = header.get("op")
+                if op == "encode":
+                    emb = server.batcher.submit(header.get("texts") or []).result()
+                    send_frame(self.request, {"ok": True, "shape": list(emb.shape)}, emb.tobytes())
+                elif op == "split":
+                    overlap = int(header.get("overlap", 0))
+                    splits = [split_windows(server.model, doc, overlap) for doc in header.get("docs") or []]
+                    send_frame(self.request, {"ok": True, "windows": [w for w, _ in splits],
+                                              "lengths": [n for _, n in splits]})
+                elif op == "ping":
+                    send_frame(self.request, {"ok": True, "model": MODEL_NAME, "pid": os.getpid(),
+                                              "stats": server.batcher.stats})
+                else:
+                    send_frame(self.request, {"ok": False, "error": f"unknown op {op!r}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                send_frame(self.request, {"ok": False, "error": str(e)})
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path: str = SOCKET_PATH):
+            self.model = load_model()
+            self.batcher = MicroBatcher(lambda texts: encode(self.model, texts))
+            if os.path.exists(path):
+                os.unlink(path)  # stale socket from a previous run; callers hold the start lock
+            super().__init__(path, _Handler)
+            os.chmod(path, 0o600)
+
+
+def serve(path: str = SOCKET_PATH):
+    server = InferenceServer(path)
+    print(f"[INIT] Inference service listening on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+# -------------------------------------------------------
+# Client
+# -------------------------------------------------------
+class InferenceError(RuntimeError):
+    pass
+
+
+class InferenceClient:
+    """Talks to the service, starting it on first use if nobody has.
+
+    A file lock makes sure only one of the gunicorn workers spawns it; the
+    others wait for the socket to come up. One connection per thread.
+    """
+
+    def __init__(self, path: str = SOCKET_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(INFERENCE_REQUEST_TIMEOUT)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _wait_until_up(self, deadline, proc=None):
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise InferenceError(f"inference service exited with code {proc.returncode}; "
+                                     f"see {self.path}.log")
+            try:
+                self._connect().close()
+                return True
+            except OSError:
+                time.sleep(0.25)
+        return False
+
+    def ensure_running(self, timeout: float = INFERENCE_START_TIMEOUT):
+        if fcntl is None:
+            raise InferenceError("the inference service needs Unix sockets; use SEMANTIC_BACKEND=local")
+        deadline = time.monotonic() + timeout
+        with open(self.path + ".lock", "w") as lock:
+            # non-blocking lock + sleep, so an eventlet worker yields while
+            # another worker is busy starting the service
+            while True:
+                try:
+                    self._connect().close()
+                    return
+                except OSError:
+                    pass
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise InferenceError(f"inference service did not start within {timeout:g}s")
+                    time.sleep(0.25)
+            try:
+                try:
+                    self._connect().close()  # started between our check and the lock
+                    return
+                except OSError:
+                    pass
+                with open(self.path + ".log", "ab") as log:
+                    proc = subprocess.Popen(
+                        [sys.executable, os.path.abspath(__file__), self.path],
+                        stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                        start_new_session=True,
+                    )
+                if not self._wait_until_up(deadline, proc):
+                    raise InferenceError(f"inference service did not start within {timeout:g}s")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _request(self, header):
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    try:
+                        sock = self._connect()
+                    except OSError:
+                        self.ensure_running()
+                        sock = self._connect()
+                    self._local.sock = sock
+                send_frame(sock, header)
+                reply, payload = recv_frame(sock)
+                break
+            except (ConnectionError, OSError):
+                # service restarted or the connection went stale; retry once
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if not reply.get("ok"):
+            raise InferenceError(reply.get("error", "inference request failed"))
+        return reply, payload
+
+    def encode(self, texts) -> np.ndarray:
+        reply, payload = self._request({"op": "encode", "texts": list(texts)})
+        return np.frombuffer(payload, dtype=np.float32).reshape(reply["shape"])
+
+    def split(self, docs, overlap: int):
+        reply, _ = self._request({"op": "split", "docs": list(docs), "overlap": overlap})
+        return list(zip(reply["windows"], reply["lengths"]))
+
+    def ping(self) -> dict:
+        reply, _ = self._request({"op": "ping"})
+        return reply
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH)
@@ -0,0 +1,470 @@
+import os
+import re
+import time
+import codecs
+import signal
+import shutil
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+from xml.etree.ElementTree import iterparse
+
+import chardet
+
+try:
+    import pypdfium2 as pdfium
+    _PDFIUM_AVAILABLE = True
+except ImportError:
+    pdfium = None
+    _PDFIUM_AVAILABLE = False
+
+try:
+    import pdfplumber
+    _PDFPLUMBER_AVAILABLE = True
+except ImportError:
+    pdfplumber = None
+    _PDFPLUMBER_AVAILABLE = False
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+INGEST_MAX_BYTES = int(float(os.getenv("INGEST_MAX_MB", "50")) * 1024 * 1024)
+# Encoding detection only looks at this much of a text file
+INGEST_DETECT_BYTES = int(os.getenv("INGEST_DETECT_BYTES", str(64 * 1024)))
+INGEST_CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", str(1024 * 1024)))
+# Uploads above this spill from memory to a temp file while being read
+INGEST_SPOOL_BYTES = int(os.getenv("INGEST_SPOOL_BYTES", str(4 * 1024 * 1024)))
+# A DOCX whose document.xml inflates past this is refused (zip bombs)
+INGEST_MAX_XML_BYTES = int(os.getenv("INGEST_MAX_XML_BYTES", str(20 * INGEST_MAX_BYTES)))
+# Pages per PDF extraction task
+INGEST_PDF_PAGES_PER_TASK = int(os.getenv("INGEST_PDF_PAGES_PER_TASK", "8"))
+# Whole-PDF extraction deadline; gunicorn runs with --timeout 0, so nothing else bounds it
+INGEST_PDF_TIMEOUT = float(os.getenv("INGEST_PDF_TIMEOUT", "120"))
+# Warm PDF worker processes per app process, shared by all uploads
+INGEST_PDF_PROCESSES = int(os.getenv("INGEST_PDF_PROCESSES", "2"))
+# Children start from a clean interpreter, not a copy of the threaded app process
+START_METHOD = os.getenv("INGEST_PDF_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+TEXT_EXTENSIONS = (".txt", ".md")
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + (".docx", ".pdf")
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class IngestError(ValueError):
+    """An upload that can't be turned into text."""
+
+
+class IngestTooLarge(IngestError):
+    pass
+
+
+class IngestUnsupported(IngestError):
+    pass
+
+
+# -------------------------------------------------------
+# One-pass normalization
+# -------------------------------------------------------
+# control characters other than tab/newline, plus BOM / zero-width no-break space
+_DROP = {c: None for c in list(range(0, 9)) + [11, 12] + list(range(14, 32)) + [127, 0xFEFF]}
+_CRLF = re.compile(r"\r\n?")
+
+
+class _Normalizer:
+    """Newlines to \\n, control characters dropped, chunk by chunk.
+
+    A trailing \\r is held back until the next chunk so a \\r\\n split
+    across chunks still becomes one newline.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self._pending_cr = False
+        self.chars = 0
+
+    def feed(self, text: str):
+        if self._pending_cr:
+            text = "\r" + text
+            self._pending_cr = False
+        if text.endswith("\r"):
+            text, self._pending_cr = text[:-1], True
+        text = _CRLF.sub("\n", text).translate(_DROP)
+        if text:
+            self.parts.append(text)
+            self.chars += len(text)
+
+    def result(self) -> str:
+        if self._pending_cr:
+            self.parts.append("\n")
+        return "".join(self.parts).strip()
+
+
+# -------------------------------------------------------
+# Plain text / Markdown
+# -------------------------------------------------------
+_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def detect_encoding(prefix: bytes, complete: bool = False) -> str:
+    """Encoding from a bounded prefix: BOM, then strict UTF-8, then chardet.
+
+    `complete` says the prefix is the whole file, so a trailing partial
+    UTF-8 sequence is an error rather than a cut.
+    """
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    try:
+        # a multi-byte character may be cut at the end of the prefix
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=complete)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    detected = chardet.detect(prefix)
+    encoding = detected.get("encoding") or "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+
+def _extract_text(stream, meta, timings):
+    started = time.perf_counter()
+    prefix = stream.read(INGEST_DETECT_BYTES)
+    encoding = detect_encoding(prefix, complete=len(prefix) < INGEST_DETECT_BYTES)
+    meta["encoding"] = encoding
+    timings["detect"] = _ms(started)
+
+    started = time.perf_counter()
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
+    normalizer = _Normalizer()
+    normalizer.feed(decoder.decode(prefix))
+    for chunk in iter(lambda: stream.read(INGEST_CHUNK_BYTES), b""):
+        normalizer.feed(decoder.decode(chunk))
+    normalizer.feed(decoder.decode(b"", final=True))
+    text = normalizer.result()
+    timings["extract"] = _ms(started)  # decode + normalize, one pass
+    return text
+
+
+# -------------------------------------------------------
+# Microsoft Word (.docx)
+# -------------------------------------------------------
+def iter_docx_paragraphs(stream):
+    """Paragraph texts straight from word/document.xml, parsed incrementally.
+
+    Never builds the whole document tree: each element is cleared once
+    read. Covers body, table and text-box paragraphs.
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+        info = archive.getinfo("word/document.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise IngestError(f"❌ Error reading DOCX file: {e}")
+    if info.file_size > INGEST_MAX_XML_BYTES:
+        raise IngestTooLarge("DOCX content is too large to process")
+
+    stack = []  # text pieces of each open (possibly nested) paragraph
+    with archive.open(info) as xml:
+        for event, elem in iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == f"{_W}p":
+                    stack.append([])
+                continue
+            if tag == f"{_W}t" and stack:
+                stack[-1].append(elem.text or "")
+            elif tag == f"{_W}tab" and stack:
+                stack[-1].append("\t")
+            elif tag in (f"{_W}br", f"{_W}cr") and stack:
+                stack[-1].append("\n")
+            elif tag == f"{_W}p" and stack:
+                text = "".join(stack.pop()).strip()
+                if text:
+                    yield text
+            if not stack or tag == f"{_W}p":
+                elem.clear()
+
+
+def _extract_docx(stream, meta, timings):
+    started = time.perf_counter()
+    normalizer = _Normalizer()
+    paragraphs = 0
+    for paragraph in iter_docx_paragraphs(stream):
+        if paragraphs:
+            normalizer.feed("\n")
+        normalizer.feed(paragraph)
+        paragraphs += 1
+    meta["paragraphs"] = paragraphs
+    timings["extract"] = _ms(started)
+    return normalizer.result()
+
+
+# -------------------------------------------------------
+# PDF
+# -------------------------------------------------------
+def _pdf_page_count(path):
+    """Runs in a worker process, like extract_pdf_pages."""
+    if _PDFIUM_AVAILABLE:
+        doc = pdfium.PdfDocument(path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages(path, start, stop):
+    """Text of pages [start, stop); runs in a worker process (neither PDF library is thread-safe)."""
+    texts = []
+    if _PDFIUM_AVAILABLE:
+        doc = pdfium.PdfDocument(path)
+        try:
+            for i in range(start, stop):
+                page = doc[i]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            doc.close()
+    else:
+        with pdfplumber.open(path, pages=list(range(start + 1, stop + 1))) as pdf:
+            texts = [page.extract_text() or "" for page in pdf.pages]
+    return texts
+
+
+def _pdf_worker_main(conn):
+    """Serve ("count", args) / ("pages", args) requests until the pipe closes."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = _pdf_page_count(*args) if op == "count" else extract_pdf_pages(*args)
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _PdfWorker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_pdf_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # set when a reply is outstanding or the process died; never reused then
+        self.lost = False
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=1)
+        except Exception:
+            pass
+        self.conn.close()
+
+
+class _PdfWorkers:
+    """Warm PDF worker processes, each serving one upload at a time.
+
+    A ProcessPoolExecutor breaks every pending future when one of its
+    workers dies, so a PDF that overruns its deadline would fail the other
+    uploads sharing the pool. Here a timed-out upload kills only the
+    workers it holds; the next upload starts replacements.
+    """
+
+    def __init__(self, size):
+        self._ctx = multiprocessing.get_context(START_METHOD)
+        self._slots = threading.BoundedSemaphore(max(1, size))
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """An idle (or new) worker; None if no slot frees up within `timeout` (0: don't wait)."""
+        if not self._slots.acquire(timeout=timeout):
+            return None
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        try:
+            return _PdfWorker(self._ctx)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, worker):
+        try:
+            if worker.lost or not worker.process.is_alive():
+                worker.kill()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+        finally:
+            self._slots.release()
+
+
+_pdf_workers = _PdfWorkers(INGEST_PDF_PROCESSES)
+
+
+def _run_on_workers(workers, jobs, deadline):
+    """Run (op, args) jobs across `workers`, one at a time each; results in job order."""
+    results = [None] * len(jobs)
+    pending = list(enumerate(jobs))[::-1]
+    free = list(workers)
+    busy = {}  # conn -> (worker, job index)
+    try:
+        while pending or busy:
+            while pending and free:
+                worker = free.pop()
+                index, job = pending.pop()
+                busy[worker.conn] = (worker, index)
+                worker.conn.send(job)
+            remaining = deadline - time.monotonic()
+            ready = wait_connections(list(busy), timeout=remaining) if remaining > 0 else []
+            if not ready:
+                raise IngestError(f"❌ PDF extraction timed out after {INGEST_PDF_TIMEOUT:g}s")
+            for conn in ready:
+                worker, index = busy[conn]
+                status, value = conn.recv()
+                del busy[conn]
+                if status != "ok":
+                    raise IngestError(f"❌ Error reading PDF file: {value}")
+                results[index] = value
+                free.append(worker)
+    except (EOFError, OSError) as e:
+        raise IngestError(f"❌ Error reading PDF file: worker process died ({e})")
+    finally:
+        # workers still owing a reply are killed on release
+        for worker, _ in busy.values():
+            worker.lost = True
+    return results
+
+
+def _extract_pdf(path, meta, timings):
+    if not (_PDFIUM_AVAILABLE or _PDFPLUMBER_AVAILABLE):
+        raise IngestError("PDF support needs pypdfium2 or pdfplumber installed")
+
+    # Every PDF library call runs in a worker: neither library is thread-safe,
+    # and a pathological file must not hang or crash the request thread
+    started = time.perf_counter()
+    deadline = time.monotonic() + INGEST_PDF_TIMEOUT
+    worker = _pdf_workers.acquire(timeout=INGEST_PDF_TIMEOUT)
+    if worker is None:
+        raise IngestError(f"❌ PDF extraction timed out after {INGEST_PDF_TIMEOUT:g}s waiting for a worker")
+    workers = [worker]
+    try:
+        [pages] = _run_on_workers(workers, [("count", (path,))], deadline)
+        meta["pages"] = pages
+        meta["pdf_backend"] = "pypdfium2" if _PDFIUM_AVAILABLE else "pdfplumber"
+
+        ranges = [(s, min(s + INGEST_PDF_PAGES_PER_TASK, pages))
+                  for s in range(0, pages, max(1, INGEST_PDF_PAGES_PER_TASK))]
+        # page ranges spread over whatever other workers are free right now;
+        # waiting for more could deadlock two uploads holding one each
+        while len(workers) < min(len(ranges), INGEST_PDF_PROCESSES):
+            extra = _pdf_workers.acquire(timeout=0)
+            if extra is None:
+                break
+            workers.append(extra)
+        results = _run_on_workers(workers, [("pages", (path, s, e)) for s, e in ranges], deadline)
+    finally:
+        for worker in workers:
+            _pdf_workers.release(worker)
+    timings["extract"] = _ms(started)
+
+    started = time.perf_counter()
+    normalizer = _Normalizer()
+    for page_texts in results:
+        for text in page_texts:
+            normalizer.feed(text)
+            normalizer.feed("\n")
+    text = normalizer.result()
+    timings["normalize"] = _ms(started)
+    return text
+
+
+# -------------------------------------------------------
+# Entry points
+# -------------------------------------------------------
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def _spool(stream, max_bytes):
+    """Copy an upload into a (memory, then disk) temp file, enforcing the size cap."""
+    spooled = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_BYTES)
+    size = 0
+    for chunk in iter(lambda: stream.read(INGEST_CHUNK_BYTES), b""):
+        size += len(chunk)
+        if size > max_bytes:
+            spooled.close()
+            raise IngestTooLarge(f"File exceeds the {round(max_bytes / (1024 * 1024), 2):g} MB upload limit")
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, size
+
+
+def ingest(stream, filename: str = "", max_bytes: int = INGEST_MAX_BYTES, strict: bool = False):
+    """Read an uploaded (or opened) binary stream into normalized text.
+
+    Returns (text, meta); meta has the format, size, encoding/pages and
+    per-stage timings in ms. Files without a known extension are read
+    as text unless `strict`, which raises IngestUnsupported instead.
+    """
+    started = time.perf_counter()
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        if strict:
+            raise IngestUnsupported(f"⚠️ Unsupported file format: {ext or '(none)'}; "
+                                    f"expected one of {', '.join(SUPPORTED_EXTENSIONS)}")
+        ext = ".txt"
+    meta = {"name": filename, "format": ext.lstrip(".")}
+    timings = {}
+
+    step = time.perf_counter()
+    spooled, size = _spool(stream, max_bytes)
+    meta["bytes"] = size
+    timings["read"] = _ms(step)
+    try:
+        if ext in TEXT_EXTENSIONS:
+            text = _extract_text(spooled, meta, timings)
+        elif ext == ".docx":
+            text = _extract_docx(spooled, meta, timings)
+        else:
+            # worker processes need a path, not this process's file object
+            with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+                shutil.copyfileobj(spooled, tmp, INGEST_CHUNK_BYTES)
+                tmp.flush()
+                text = _extract_pdf(tmp.name, meta, timings)
+    finally:
+        spooled.close()
+
+    meta["chars"] = len(text)
+    timings["total"] = _ms(started)
+    meta["timings_ms"] = timings
+    return text, meta
+
+
+def ingest_path(file_path: str, max_bytes: int = INGEST_MAX_BYTES):
+    """ingest() for a file on disk; unknown extensions are rejected."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"❌ File not found: {file_path}")
+    with open(file_path, "rb") as f:
+        return ingest(f, os.path.basename(file_path), max_bytes=max_bytes, strict=True)
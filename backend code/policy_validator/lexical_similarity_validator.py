@@ -1,12 +1,16 @@
 import re
 
+_WORD = re.compile(r"\b\w+\b")
+
+
+def tokenize(text: str) -> set:
+    """Lowercased word set used by Jaccard similarity."""
+    return set(_WORD.findall(text.lower()))  # keep only word characters
+
+
 def jaccard_similarity(doc1: str, doc2: str) -> float:
     """Compute Jaccard similarity between two text documents."""
     # Normalize and tokenize
-    tokenize = lambda text: set(
-        re.findall(r"\b\w+\b", text.lower())  # keep only word characters
-    )
-
     words1, words2 = tokenize(doc1), tokenize(doc2)
 
     # Handle edge case where both documents are empty
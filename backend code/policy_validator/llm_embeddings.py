@@ -1,11 +1,16 @@
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APIStatusError, APITimeoutError
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import tiktoken
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import time
 
+from embedding_cache import embedding_cache
+
 # -------------------------------------------------------
 # Load environment + initialize OpenAI client
 # -------------------------------------------------------
@@ -15,23 +20,229 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("❌ Missing OPENAI_API_KEY in .env file")
 
-client = OpenAI(api_key=api_key)
+# Retries are driven by the rate-limit headers below, not the client's own backoff
+client = OpenAI(api_key=api_key, max_retries=0)
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
+EMBEDDING_MODEL = "text-embedding-3-large"
+# Per-request limits of the embeddings endpoint are 2048 inputs / 300k tokens
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "100000"))
+EMBED_BATCH_INPUTS = int(os.getenv("EMBED_BATCH_INPUTS", "2048"))
+# Batches in flight at once, across every comparison in this process
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", "4"))
+# Account limits the client-side limiter paces against
+EMBED_RPM = int(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+EMBED_MAX_ATTEMPTS = int(os.getenv("EMBED_MAX_ATTEMPTS", "5"))
+
 # -------------------------------------------------------
 # Text Chunking Helper
 # -------------------------------------------------------
+def chunk_tokens(text: str, max_tokens: int = 800):
+    """
+    Token-id chunks of at most max_tokens; sent to the API as-is, so the
+    text is tokenized once and never decoded back.
+    """
+    tokens = tokenizer.encode(text)
+    chunks = [tokens[i:i + max_tokens] for i in range(0, len(tokens), max_tokens)]
+    return [c for c in chunks if c]
+
+
 def chunk_text(text: str, max_tokens: int = 800):
     """
     Splits long text into chunks under max_tokens for embeddings.
     """
-    tokens = tokenizer.encode(text)
-    chunks = []
-    for i in range(0, len(tokens), max_tokens):
-        chunk = tokenizer.decode(tokens[i:i + max_tokens])
-        chunks.append(chunk.strip())
+    chunks = [tokenizer.decode(c).strip() for c in chunk_tokens(text, max_tokens)]
     return [c for c in chunks if c]
 
+# -------------------------------------------------------
+# Rate limiting
+# -------------------------------------------------------
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def _parse_reset(value):
+    """'6m0s' / '1.5s' / '120ms' (x-ratelimit-reset-*) -> seconds."""
+    if not value:
+        return None
+    scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * scale[unit] for n, unit in parts)
+
+
+def _retry_after(headers):
+    """Seconds the server asked us to wait, from a 429/5xx response's headers."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    seconds = _parse_reset(headers.get("retry-after"))
+    if seconds is not None:
+        return seconds
+    return max(filter(None, [
+        _parse_reset(headers.get("x-ratelimit-reset-requests")),
+        _parse_reset(headers.get("x-ratelimit-reset-tokens")),
+    ]), default=None)
+
+
+class RateLimiter:
+    """Requests- and tokens-per-minute buckets shared by every embedding call.
+
+    Paces batches before they are sent, and pauses everyone when a
+    response says the account's quota is spent.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm, self.tpm = max(1, rpm), max(1, tpm)
+        self._requests, self._tokens = float(self.rpm), float(self.tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    self._paused_until - now,
+                    (1 - self._requests) * 60 / self.rpm,
+                    (tokens - self._tokens) * 60 / self.tpm,
+                    0.01,
+                )
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers):
+        """Honour x-ratelimit-remaining-* / reset-* from a successful response."""
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+                reset = _parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.pause(reset)
+
+
+rate_limiter = RateLimiter(EMBED_RPM, EMBED_TPM)
+_inflight = threading.BoundedSemaphore(max(1, EMBED_MAX_INFLIGHT))
+
+# -------------------------------------------------------
+# Batched embedding requests
+# -------------------------------------------------------
+def _token_batches(chunks):
+    """Index batches of chunks within the per-request token/input budget."""
+    batches, current, current_tokens = [], [], 0
+    for i, chunk in enumerate(chunks):
+        if current and (current_tokens + len(chunk) > EMBED_BATCH_TOKENS or len(current) >= EMBED_BATCH_INPUTS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += len(chunk)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _embed_batch(model, inputs):
+    """One embeddings request, retried on 429/5xx/connection errors.
+
+    Returns one vector per input, or None for each input if every attempt failed.
+    """
+    tokens = sum(len(x) for x in inputs)
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        rate_limiter.acquire(tokens)
+        try:
+            with _inflight:
+                raw = client.embeddings.with_raw_response.create(model=model, input=inputs)
+            rate_limiter.observe(raw.headers)
+            response = raw.parse()
+            vectors = [None] * len(inputs)
+            for item in response.data:
+                vectors[item.index] = item.embedding
+            return vectors
+        except APIStatusError as e:
+            if e.status_code != 429 and e.status_code < 500:
+                print(f"[FAIL] Embedding batch rejected ({len(inputs)} chunks): {e}")
+                break
+            wait = _retry_after(e.response.headers) or 2 ** attempt
+            if e.status_code == 429:
+                rate_limiter.pause(wait)  # the quota is shared, so everyone waits
+            print(f"[WARN] Embedding batch failed ({e.status_code}), retrying in {wait:.2f}s")
+            time.sleep(wait)
+        except (APIConnectionError, APITimeoutError) as e:
+            print(f"[WARN] Embedding batch failed: {e}, retrying in {2 ** attempt}s")
+            time.sleep(2 ** attempt)
+    print(f"[FAIL] Skipping {len(inputs)} chunks after retries.")
+    return [None] * len(inputs)
+
+
+def embed_token_chunks(chunks, model: str = EMBEDDING_MODEL):
+    """
+    One vector (or None) per token-id chunk: cached chunks are read from the
+    embedding cache, the rest go out in token-budgeted batches, several at once.
+    """
+    # cl100k ids identify the chunk as well as its text does, without decoding it
+    keys = ["cl100k:" + " ".join(map(str, c)) for c in chunks]
+    by_key = dict(zip(keys, chunks))
+
+    def fetch(missing_keys):
+        inputs = [by_key[k] for k in missing_keys]
+        batches = _token_batches(inputs)
+        vectors = [None] * len(inputs)
+        with ThreadPoolExecutor(max_workers=max(1, min(EMBED_MAX_INFLIGHT, len(batches))),
+                                thread_name_prefix="embed") as pool:
+            results = pool.map(lambda b: _embed_batch(model, [inputs[i] for i in b]), batches)
+            for batch, batch_vectors in zip(batches, results):
+                for i, vec in zip(batch, batch_vectors):
+                    vectors[i] = vec
+        return vectors
+
+    return embedding_cache.embed(model, keys, fetch)
+
+
+def _mean_embedding(vectors):
+    embeddings = [e for e in vectors if e is not None]
+    if not embeddings:
+        return None
+    return np.mean(embeddings, axis=0)
+
+
+def document_embeddings(docs):
+    """
+    Mean chunk embedding per document (None if nothing could be embedded);
+    the chunks of every document share the same batches.
+    """
+    chunked = [chunk_tokens(doc) for doc in docs]
+    vectors = embed_token_chunks([c for chunks in chunked for c in chunks])
+    out, offset = [], 0
+    for chunks in chunked:
+        out.append(_mean_embedding(vectors[offset:offset + len(chunks)]))
+        offset += len(chunks)
+    return out
+
 # -------------------------------------------------------
 # Embedding Similarity with OpenAI (LLM-based)
 # -------------------------------------------------------
@@ -40,32 +251,10 @@ def llm_embedding_similarity(doc1: str, doc2: str) -> float:
     Compute similarity between two documents using OpenAI embeddings.
     Handles long documents by averaging per-chunk embeddings.
     """
-
-    model = "text-embedding-3-large"
-
-    def get_embeddings(chunks):
-        embeddings = []
-        for idx, chunk in enumerate(chunks):
-            for attempt in range(3):  # Retry on transient errors
-                try:
-                    response = client.embeddings.create(model=model, input=chunk)
-                    emb = np.array(response.data[0].embedding, dtype=np.float32)
-                    embeddings.append(emb)
-                    break
-                except Exception as e:
-                    print(f"[WARN] Embedding failed (chunk {idx+1}/{len(chunks)}): {e}")
-                    time.sleep(2 ** attempt)  # exponential backoff
-            else:
-                print(f"[FAIL] Skipping chunk {idx+1} after retries.")
-        if not embeddings:
-            return np.zeros(1536, dtype=np.float32)  # fallback vector
-        return np.mean(embeddings, axis=0)
-
-    chunks1 = chunk_text(doc1)
-    chunks2 = chunk_text(doc2)
-
-    emb1 = get_embeddings(chunks1)
-    emb2 = get_embeddings(chunks2)
+    # Both documents share batches, so short pairs are a single request
+    emb1, emb2 = document_embeddings([doc1, doc2])
+    if emb1 is None or emb2 is None:
+        return 0.0
 
     # Handle zero vectors gracefully
     if not np.any(emb1) or not np.any(emb2):
@@ -0,0 +1,95 @@
+import os
+import hashlib
+from collections import defaultdict
+
+import numpy as np
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+# bands * rows permutations; with 32 x 4 the LSH S-curve crosses 50%
+# candidate probability near Jaccard (1/32) ** (1/4) ≈ 0.42
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", "32"))
+MINHASH_ROWS = int(os.getenv("MINHASH_ROWS", "4"))
+NUM_PERM = MINHASH_BANDS * MINHASH_ROWS
+
+_PRIME = (1 << 31) - 1  # Mersenne prime; a * h < 2**62 stays inside uint64
+_EMPTY = np.uint32(_PRIME)  # larger than any real value, so empty sets only match empty sets
+# Fixed seed: signatures are stored, so every process must draw the same permutations
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+
+def _token_hashes(tokens) -> np.ndarray:
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=4).digest(), "little") for t in tokens),
+        dtype=np.uint64, count=len(tokens),
+    ) % _PRIME
+
+
+def signature(tokens) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32) of a token set."""
+    tokens = list(tokens)
+    if not tokens:
+        return np.full(NUM_PERM, _EMPTY, dtype=np.uint32)
+    h = _token_hashes(tokens)
+    # (permutations x tokens) in one shot; chunked so huge documents stay bounded
+    sig = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    for start in range(0, len(h), 4096):
+        part = h[start:start + 4096]
+        sig = np.minimum(sig, ((np.outer(_A, part) + _B[:, None]) % _PRIME).min(axis=1))
+    return sig.astype(np.uint32)
+
+
+def band_keys(sig: np.ndarray):
+    """One bucket key per LSH band; two signatures sharing any key are candidates."""
+    return [
+        f"{b}:{hashlib.blake2b(sig[b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS].tobytes(), digest_size=8).hexdigest()}"
+        for b in range(MINHASH_BANDS)
+    ]
+
+
+def to_bytes(sig: np.ndarray) -> bytes:
+    return np.asarray(sig, dtype=np.uint32).tobytes()
+
+
+def from_bytes(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.uint32)
+
+
+def approx_jaccard(sig1: np.ndarray, sig2: np.ndarray) -> float:
+    """Estimated Jaccard: the share of permutations whose minimum agrees."""
+    return float(np.mean(sig1 == sig2))
+
+
+def approx_jaccard_many(query: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard of one signature against a (n x NUM_PERM) matrix."""
+    if not len(signatures):
+        return np.zeros(0, dtype=np.float32)
+    return (signatures == query).mean(axis=1).astype(np.float32)
+
+
+def exact_jaccard(tokens1, tokens2) -> float:
+    """Exact set Jaccard, same edge cases as jaccard_similarity."""
+    a, b = set(tokens1), set(tokens2)
+    if not a and not b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def candidate_pairs(signatures: np.ndarray):
+    """Index pairs sharing at least one LSH band bucket (each pair once)."""
+    pairs = set()
+    for b in range(MINHASH_BANDS):
+        buckets = defaultdict(list)
+        band = signatures[:, b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS]
+        for i, row in enumerate(band):
+            buckets[row.tobytes()].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
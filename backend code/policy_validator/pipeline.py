@@ -0,0 +1,141 @@
+import os
+import time
+import atexit
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .lexical_similarity_validator import jaccard_similarity
+from .tf_idf import tfidf_cosine_similarity
+from .semantic_similarity import semantic_similarity_check
+from .llm_embeddings import llm_embedding_similarity
+
+# -------------------------------------------------------
+# Executors (created once, shared by every comparison)
+# -------------------------------------------------------
+SCORER_THREADS = int(os.getenv("SCORER_THREADS", "8"))
+# Timed-out runs of one scorer still holding a thread; beyond this the
+# scorer is skipped until one of them finishes
+SCORER_MAX_STRAGGLERS = int(os.getenv("SCORER_MAX_STRAGGLERS", "1"))
+
+
+class Scorer:
+    """One similarity metric and how long it may take."""
+
+    def __init__(self, name, label, fn, timeout):
+        self.name = name          # key in the report's results
+        self.label = label        # key in compare_documents' legacy dict
+        self.fn = fn
+        self.timeout = float(os.getenv(f"SCORER_TIMEOUT_{name.upper()}", timeout))
+
+
+# Every scorer runs on the thread pool. Jaccard and TF-IDF hold the GIL but
+# finish well under a second even on 50 MB documents, less than pickling
+# both documents to a worker process would cost; MiniLM waits on the
+# inference service (or torch, which releases the GIL) and the LLM scorer
+# on the network.
+SCORERS = [
+    Scorer("jaccard", "Jaccard Similarity", jaccard_similarity, 30),
+    Scorer("tfidf", "TF-IDF Cosine Similarity", tfidf_cosine_similarity, 60),
+    Scorer("semantic", "Semantic Similarity", semantic_similarity_check, 120),
+    Scorer("llm", "LLM Embedding Similarity", llm_embedding_similarity, 180),
+]
+
+_thread_pool = None
+_pools_lock = threading.Lock()
+# scorer name -> timed-out runs still occupying a thread
+_stragglers = Counter()
+
+
+def _get_thread_pool():
+    global _thread_pool
+    with _pools_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=max(1, SCORER_THREADS),
+                                              thread_name_prefix="scorer")
+        return _thread_pool
+
+
+@atexit.register
+def shutdown_scorers():
+    global _thread_pool
+    with _pools_lock:
+        pool, _thread_pool = _thread_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _track_straggler(name, future):
+    with _pools_lock:
+        _stragglers[name] += 1
+
+    def done(_):
+        with _pools_lock:
+            _stragglers[name] -= 1
+
+    future.add_done_callback(done)
+
+
+def _timed(fn, doc1, doc2, kwargs=None):
+    """Runs on the scorer thread, so the timing excludes queueing."""
+    started = time.perf_counter()
+    value = fn(doc1, doc2, **(kwargs or {}))
+    return value, round((time.perf_counter() - started) * 1000, 2)
+
+
+# -------------------------------------------------------
+# Pipeline
+# -------------------------------------------------------
+def run_scorers(doc1: str, doc2: str, scorers=None, options=None) -> dict:
+    """Run every scorer concurrently; latency is the slowest one, not the sum.
+
+    `options` maps a scorer name to extra keyword arguments for it.
+
+    Returns {"scores", "timings_ms", "errors"}. A scorer that raises or
+    overruns its timeout gets a None score and an error message while the
+    others still report. A thread can't be stopped, so a timed-out scorer
+    keeps running in the background and its result is discarded; while
+    SCORER_MAX_STRAGGLERS of its runs are still going, that scorer is
+    skipped, so runaways can't take over the shared threads.
+    """
+    scorers = scorers or SCORERS
+    options = options or {}
+    started = time.perf_counter()
+    futures = {}
+    errors = {}
+
+    pool = _get_thread_pool()
+    for scorer in scorers:
+        with _pools_lock:
+            stragglers = _stragglers[scorer.name]
+        if stragglers >= max(1, SCORER_MAX_STRAGGLERS):
+            errors[scorer.name] = f"skipped: {stragglers} timed-out run(s) still running"
+            continue
+        try:
+            futures[scorer.name] = (scorer, pool.submit(
+                _timed, scorer.fn, doc1, doc2, options.get(scorer.name)
+            ))
+        except Exception as e:
+            errors[scorer.name] = f"could not start: {e}"
+
+    scores = {s.name: None for s in scorers}
+    timings = {}
+    for name, (scorer, future) in futures.items():
+        remaining = scorer.timeout - (time.perf_counter() - started)
+        done, _ = wait([future], timeout=max(0.0, remaining))
+        if not done:
+            if not future.cancel():
+                _track_straggler(name, future)
+            errors[name] = f"timed out after {scorer.timeout:g}s"
+            timings[name] = round((time.perf_counter() - started) * 1000, 2)
+            continue
+        try:
+            value, ms = future.result()
+            scores[name] = float(value) if value is not None else None
+            timings[name] = ms
+        except Exception as e:
+            print(f"[WARN] Scorer '{name}' failed: {e}")
+            errors[name] = str(e)
+
+    timings["total"] = round((time.perf_counter() - started) * 1000, 2)
+    return {"scores": scores, "timings_ms": timings, "errors": errors}
@@ -1,16 +1,122 @@
-from sentence_transformers import SentenceTransformer, util
-import torch
+import os
+import threading
+
+import numpy as np
+
+from . import inference_service
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+# "service": one shared inference process for every worker (started on
+# first use); "local": load the model lazily inside this process
+SEMANTIC_BACKEND = os.getenv("SEMANTIC_BACKEND", "local" if os.name == "nt" else "service")
+# "chunked" scores whole documents window by window; "whole" is the old
+# single encode, which MiniLM truncates at max_seq_length word-pieces
+SEMANTIC_MODE = os.getenv("SEMANTIC_MODE", "chunked")
+# "mean": cosine of the length-weighted mean window embeddings
+# "maxsim": each window's best match in the other document, averaged both ways
+SEMANTIC_AGGREGATION = os.getenv("SEMANTIC_AGGREGATION", "mean")
+# Word-pieces shared by consecutive windows, so a sentence cut at a window
+# edge still appears whole in one of them
+SEMANTIC_WINDOW_OVERLAP = int(os.getenv("SEMANTIC_WINDOW_OVERLAP", "32"))
+
+_model = None
+_model_lock = threading.Lock()
+_client = inference_service.InferenceClient()
+
+
+def get_model():
+    """The in-process model, loaded on first use (local backend only)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = inference_service.load_model()
+    return _model
+
+
+def encode(texts) -> np.ndarray:
+    if SEMANTIC_BACKEND == "service":
+        return _client.encode(texts)
+    return inference_service.encode(get_model(), texts)
+
+
+def split_windows(docs, overlap: int = SEMANTIC_WINDOW_OVERLAP):
+    """[(windows, word-piece lengths)] for each document."""
+    if SEMANTIC_BACKEND == "service":
+        return _client.split(docs, overlap)
+    model = get_model()
+    return [inference_service.split_windows(model, doc, overlap) for doc in docs]
+
+
+def warm_up_in_background():
+    """Start the shared service (or nothing, for the local backend) without blocking."""
+    if SEMANTIC_BACKEND != "service":
+        return
+
+    def run():
+        try:
+            _client.ensure_running()
+        except Exception as e:
+            print(f"[WARN] Semantic inference service warm-up failed: {e}")
+
+    threading.Thread(target=run, name="semantic-warmup", daemon=True).start()
+
+
+def _cosine(a, b) -> float:
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a, b) / denom) if denom else 0.0
+
+
+def _mean_similarity(emb1, emb2, len1, len2):
+    w1 = np.asarray(len1, dtype=np.float32)[:, None]
+    w2 = np.asarray(len2, dtype=np.float32)[:, None]
+    return _cosine((emb1 * w1).sum(axis=0) / w1.sum(), (emb2 * w2).sum(axis=0) / w2.sum())
+
+
+def _maxsim_similarity(emb1, emb2):
+    a = emb1 / np.maximum(np.linalg.norm(emb1, axis=1, keepdims=True), 1e-12)
+    b = emb2 / np.maximum(np.linalg.norm(emb2, axis=1, keepdims=True), 1e-12)
+    sims = a @ b.T  # windows1 x windows2 alignment matrix
+    return float((sims.max(axis=1).mean() + sims.max(axis=0).mean()) / 2)
+
+
+def document_embeddings(docs):
+    """
+    One length-weighted mean window embedding per document (None for an
+    empty one); every window of every document goes through one encode.
+    """
+    splits = split_windows(docs)
+    windows = [w for doc_windows, _ in splits for w in doc_windows]
+    if not windows:
+        return [None] * len(splits)
+    emb = encode(windows)
+    out, offset = [], 0
+    for doc_windows, lengths in splits:
+        if not doc_windows:
+            out.append(None)
+            continue
+        w = np.asarray(lengths, dtype=np.float32)[:, None]
+        out.append((emb[offset:offset + len(doc_windows)] * w).sum(axis=0) / w.sum())
+        offset += len(doc_windows)
+    return out
 
-# ✅ Load model ONCE when the module is imported
-torch.set_num_threads(1)  # prevent CPU thread hang on Windows
-print("[INIT] Loading SentenceTransformer model globally...")
-model = SentenceTransformer("all-MiniLM-L6-v2")
-_ = model.encode(["warmup"], convert_to_tensor=True)  # optional warmup
-print("[INIT] Transformer model ready.")
 
 def semantic_similarity_check(doc1: str, doc2: str) -> float:
     """Compute semantic similarity between two documents using MiniLM."""
-    emb1 = model.encode(doc1, convert_to_tensor=True)
-    emb2 = model.encode(doc2, convert_to_tensor=True)
-    similarity = util.pytorch_cos_sim(emb1, emb2)
-    return float(similarity.item())
+    if SEMANTIC_MODE == "whole":
+        emb = encode([doc1, doc2])
+        return _cosine(emb[0], emb[1])
+
+    (windows1, len1), (windows2, len2) = split_windows([doc1, doc2])
+    if not windows1 or not windows2:
+        return 0.0
+
+    # One batched forward pass over both documents' windows
+    emb = encode(list(windows1) + list(windows2))
+    emb1, emb2 = emb[:len(windows1)], emb[len(windows1):]
+
+    if SEMANTIC_AGGREGATION == "maxsim":
+        return _maxsim_similarity(emb1, emb2)
+    return _mean_similarity(emb1, emb2, len1, len2)
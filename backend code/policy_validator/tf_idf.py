@@ -2,18 +2,25 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import re
 
-def tfidf_cosine_similarity(doc1: str, doc2: str) -> float:
+_NON_ALPHA = re.compile(r"[^a-z\s]")
+_SPACES = re.compile(r"\s+")
+
+
+# Basic cleanup: lowercase + remove punctuation/numbers
+def clean_text(text: str) -> str:
+    text = text.lower()
+    text = _NON_ALPHA.sub(" ", text)
+    text = _SPACES.sub(" ", text)
+    return text.strip()
+
+
+def tfidf_cosine_similarity(doc1: str, doc2: str, model=None) -> float:
     """
     Compute cosine similarity between two documents using TF-IDF.
     Cleans text, removes noise, and handles empty or short docs gracefully.
+    With a corpus-fitted TfidfModel this is a transform + sparse dot
+    product against its IDF instead of a fit on just the two documents.
     """
-    # Basic cleanup: lowercase + remove punctuation/numbers
-    def clean_text(text: str) -> str:
-        text = text.lower()
-        text = re.sub(r"[^a-z\s]", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        return text.strip()
-
     doc1_clean = clean_text(doc1)
     doc2_clean = clean_text(doc2)
 
@@ -21,6 +28,9 @@ def tfidf_cosine_similarity(doc1: str, doc2: str) -> float:
     if not doc1_clean or not doc2_clean:
         return 0.0
 
+    if model is not None:
+        return model.similarity(doc1_clean, doc2_clean)
+
     # Use sublinear TF scaling for better discrimination on long docs
     vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True)
     tfidf = vectorizer.fit_transform([doc1_clean, doc2_clean])
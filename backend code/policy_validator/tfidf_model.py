@@ -0,0 +1,295 @@
+import os
+import zlib
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+from cachetools import LRUCache
+from pymongo import ASCENDING
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .tf_idf import clean_text
+
+# -------------------------------------------------------
+# Config
+# -------------------------------------------------------
+# Below this many fitted documents IDF says little; callers fall back to
+# the two-document fit
+TFIDF_MIN_DOCS = int(os.getenv("TFIDF_MIN_DOCS", "5"))
+# A background refit runs after this many incremental updates...
+TFIDF_REFIT_EVERY = int(os.getenv("TFIDF_REFIT_EVERY", "200"))
+# ...or when the last refit is older than this and anything changed since
+TFIDF_REFIT_SECONDS = float(os.getenv("TFIDF_REFIT_SECONDS", str(24 * 3600)))
+TFIDF_MODEL_CACHE_SIZE = int(os.getenv("TFIDF_MODEL_CACHE_SIZE", "32"))
+# Scope of the model fitted on all of a user's corpora: stored as a null
+# scope, so no corpus name (any string, "*" included) can collide with it
+USER_SCOPE = None
+# What USER_SCOPE used to be stored as
+_LEGACY_USER_SCOPE = "*"
+
+# Same token pattern and stop words as the pairwise TfidfVectorizer
+_analyze = TfidfVectorizer(stop_words="english").build_analyzer()
+
+
+def term_counts(text: str, cleaned: bool = False) -> Counter:
+    return Counter(_analyze(text if cleaned else clean_text(text)))
+
+
+class TfidfModel:
+    """Vocabulary + document frequencies, the only state TF-IDF needs.
+
+    Uses the same weighting as the pairwise scorer (smooth IDF, sublinear
+    TF, l2-normalized rows). Document frequencies instead of IDF are kept
+    so documents can be added or removed without a refit.
+    """
+
+    def __init__(self, terms=None, df=None, n_docs=0, version=0, meta=None):
+        self.terms = list(terms or [])
+        self.index = {t: i for i, t in enumerate(self.terms)}
+        self.df = np.zeros(len(self.terms), dtype=np.int64) if df is None else np.asarray(df, dtype=np.int64)
+        self.n_docs = int(n_docs)
+        self.version = version
+        self.meta = meta or {}
+        self._idf = None
+
+    @classmethod
+    def fit(cls, clean_texts):
+        model = cls()
+        model.partial_fit(clean_texts)
+        return model
+
+    def __len__(self):
+        return len(self.terms)
+
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None or len(self._idf) != len(self.terms):
+            self._idf = (np.log((1 + self.n_docs) / (1 + self.df)) + 1).astype(np.float32)
+        return self._idf
+
+    def partial_fit(self, clean_texts, remove: bool = False):
+        """Fold documents into (or, with remove=True, out of) the frequencies."""
+        sign = -1 if remove else 1
+        df = self.df.tolist()
+        for text in clean_texts:
+            for term in term_counts(text, cleaned=True):
+                i = self.index.get(term)
+                if i is None:
+                    if remove:
+                        continue
+                    i = self.index[term] = len(self.terms)
+                    self.terms.append(term)
+                    df.append(0)
+                df[i] = max(0, df[i] + sign)
+            self.n_docs = max(0, self.n_docs + sign)
+        self.df = np.asarray(df, dtype=np.int64)
+        self._idf = None
+        return self
+
+    def transform(self, clean_texts) -> sparse.csr_matrix:
+        """l2-normalized TF-IDF rows.
+
+        Terms the model has never seen get the IDF of a df=0 term in extra
+        columns past len(self), so they still count in each row's norm;
+        slice to [:, :len(self)] to score against fitted rows.
+        """
+        idf = self.idf
+        oov_idf = np.float32(np.log(1 + self.n_docs) + 1)
+        extra = {}
+        data, indices, indptr = [], [], [0]
+        for text in clean_texts:
+            counts = term_counts(text, cleaned=True)
+            row_idx, row_val = [], []
+            for term, count in counts.items():
+                i = self.index.get(term)
+                if i is None:
+                    i = len(self.terms) + extra.setdefault(term, len(extra))
+                    weight = oov_idf
+                else:
+                    weight = idf[i]
+                row_idx.append(i)
+                row_val.append((1 + np.log(count)) * weight)
+            vals = np.asarray(row_val, dtype=np.float32)
+            norm = np.linalg.norm(vals)
+            if norm:
+                vals /= norm
+            data.append(vals)
+            indices.extend(row_idx)
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0, dtype=np.float32), indices, indptr),
+            shape=(len(indptr) - 1, len(self.terms) + len(extra)),
+        )
+
+    def similarity(self, clean1: str, clean2: str) -> float:
+        rows = self.transform([clean1, clean2])
+        return float(rows[0].multiply(rows[1]).sum())
+
+    # ----- storage ----- #
+    def to_fields(self) -> dict:
+        """Compact form: zlib'd newline-joined terms + uint32 frequencies."""
+        return {
+            "terms": zlib.compress("\n".join(self.terms).encode("utf-8"), 6),
+            "df": zlib.compress(self.df.astype(np.uint32).tobytes(), 6),
+            "n_docs": self.n_docs,
+            "n_terms": len(self.terms),
+        }
+
+    @classmethod
+    def from_doc(cls, doc):
+        raw = zlib.decompress(doc["terms"]).decode("utf-8")
+        terms = raw.split("\n") if raw else []
+        df = np.frombuffer(zlib.decompress(doc["df"]), dtype=np.uint32).astype(np.int64)
+        meta = {k: doc.get(k) for k in ("scope", "refitted_at", "updates_since_refit")}
+        return cls(terms, df, doc.get("n_docs", 0), doc.get("version", 0), meta)
+
+
+class TfidfModelStore:
+    """Fitted TF-IDF models per (user, scope), persisted in Mongo.
+
+    Scope is a corpus name (a project) or USER_SCOPE (None) for everything
+    the user has stored. Corpus changes update the frequencies in place; a
+    full refit from the stored documents runs in the background every
+    TFIDF_REFIT_EVERY updates or TFIDF_REFIT_SECONDS, dropping terms that
+    no longer occur. Writes are optimistic on the model's version, so
+    workers never overwrite each other's updates.
+    """
+
+    def __init__(self, collection, corpora, documents):
+        self.collection = collection
+        self.corpora = corpora
+        self.documents = documents
+        self.collection.create_index([("user_id", ASCENDING), ("scope", ASCENDING)], unique=True)
+        # A "*" corpus used to share its model with the user-wide one; the
+        # stored document was the user-wide model, so it keeps that role
+        self.collection.update_many({"scope": _LEGACY_USER_SCOPE}, {"$set": {"scope": USER_SCOPE}})
+        self._cache = LRUCache(maxsize=max(1, TFIDF_MODEL_CACHE_SIZE))
+        self._lock = threading.Lock()
+        self._refitting = set()
+
+    def get(self, user_id, scope=USER_SCOPE):
+        doc = self.collection.find_one({"user_id": user_id, "scope": scope},
+                                       {"version": 1, "refitted_at": 1, "updates_since_refit": 1})
+        if doc is None:
+            return None
+        key = (user_id, scope, doc["version"])
+        with self._lock:
+            model = self._cache.get(key)
+        if model is None:
+            full = self.collection.find_one({"_id": doc["_id"], "version": doc["version"]})
+            if full is None:  # replaced between the two reads
+                return self.get(user_id, scope)
+            model = TfidfModel.from_doc(full)
+            with self._lock:
+                self._cache[key] = model
+        self._maybe_refit(user_id, scope, doc)
+        return model
+
+    def usable(self, user_id, scope=USER_SCOPE):
+        """The model if it has seen enough documents to be worth using."""
+        model = self.get(user_id, scope)
+        return model if model is not None and model.n_docs >= TFIDF_MIN_DOCS else None
+
+    def _save(self, user_id, scope, model, expected_version, refit=False):
+        """Write `model` if the stored version is still `expected_version`; True on success."""
+        now = datetime.now(timezone.utc)
+        version = (expected_version or 0) + 1
+        fields = dict(model.to_fields(), user_id=user_id, scope=scope, version=version, updated_at=now)
+        if refit:
+            fields.update(refitted_at=now, updates_since_refit=0)
+        if expected_version is None:
+            fields.setdefault("refitted_at", now)
+            fields.setdefault("updates_since_refit", 0)
+            try:
+                self.collection.insert_one(fields)
+            except Exception:  # another worker created it first
+                return False
+            model.version = version
+            return True
+        update = {"$set": fields}
+        if not refit:
+            update["$inc"] = {"updates_since_refit": 1}
+        res = self.collection.update_one({"user_id": user_id, "scope": scope, "version": expected_version}, update)
+        if res.modified_count != 1:
+            return False
+        model.version = version
+        return True
+
+    def update(self, user_id, scopes, added=(), removed=()):
+        """Fold added/removed documents' clean text into each scope's model."""
+        for scope in scopes:
+            for _ in range(5):
+                current = self.collection.find_one({"user_id": user_id, "scope": scope})
+                model = TfidfModel.from_doc(current) if current else TfidfModel()
+                model.partial_fit(added)
+                model.partial_fit(removed, remove=True)
+                if self._save(user_id, scope, model, current["version"] if current else None):
+                    break
+            else:
+                print(f"[WARN] TF-IDF model {scope!r} kept changing under us; leaving it to the next refit")
+            doc = self.collection.find_one({"user_id": user_id, "scope": scope},
+                                           {"version": 1, "refitted_at": 1, "updates_since_refit": 1})
+            if doc:
+                self._maybe_refit(user_id, scope, doc)
+
+    def drop(self, user_id, scope):
+        self.collection.delete_one({"user_id": user_id, "scope": scope})
+
+    # ----- refits ----- #
+    def _source_texts(self, user_id, scope):
+        query = {"user_id": user_id}
+        if scope != USER_SCOPE:
+            corpus = self.corpora.find_one({"user_id": user_id, "name": scope}, {"_id": 1})
+            if corpus is None:
+                return None
+            query = {"corpus_id": corpus["_id"]}
+        return (d.get("clean_text") or "" for d in self.documents.find(query, {"clean_text": 1}))
+
+    def refit(self, user_id, scope=USER_SCOPE):
+        """Rebuild a model from the stored corpus documents."""
+        current = self.collection.find_one({"user_id": user_id, "scope": scope}, {"version": 1})
+        texts = self._source_texts(user_id, scope)
+        if texts is None:
+            self.drop(user_id, scope)
+            return None
+        started = time.perf_counter()
+        model = TfidfModel.fit(texts)
+        keep = model.df > 0
+        model = TfidfModel([t for t, k in zip(model.terms, keep) if k], model.df[keep], model.n_docs)
+        if not self._save(user_id, scope, model, current["version"] if current else None, refit=True):
+            return None  # changed meanwhile; the next trigger refits again
+        print(f"[TFIDF] Refitted {scope!r} for {user_id}: {model.n_docs} docs, {len(model)} terms "
+              f"in {round((time.perf_counter() - started) * 1000, 1)}ms")
+        return model
+
+    def _maybe_refit(self, user_id, scope, doc):
+        updates = doc.get("updates_since_refit") or 0
+        refitted = doc.get("refitted_at")
+        if refitted is not None and refitted.tzinfo is None:
+            refitted = refitted.replace(tzinfo=timezone.utc)
+        stale = refitted is not None and updates and \
+            (datetime.now(timezone.utc) - refitted).total_seconds() > TFIDF_REFIT_SECONDS
+        if updates < TFIDF_REFIT_EVERY and not stale:
+            return
+        self.refit_in_background(user_id, scope)
+
+    def refit_in_background(self, user_id, scope=USER_SCOPE):
+        key = (user_id, scope)
+        with self._lock:
+            if key in self._refitting:
+                return
+            self._refitting.add(key)
+
+        def run():
+            try:
+                self.refit(user_id, scope)
+            except Exception as e:
+                print(f"[WARN] TF-IDF refit of {scope!r} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refitting.discard(key)
+
+        threading.Thread(target=run, name="tfidf-refit", daemon=True).start()
@@ -1,17 +1,48 @@
-from .task_runner import (
-    create_task,
-    list_tasks,
-    get_task,
-    delete_task,
-    run_task,
-    run_all_tasks
-)
+"""Task CRUD and runs for tool environments.
 
-__all__ = [
-    "create_task",
-    "list_tasks",
-    "get_task",
-    "delete_task",
-    "run_task",
-    "run_all_tasks"
-]
+Exports load on first access: pool and sandbox workers import submodules of
+this package and must not pull in task_runner, which connects to Mongo,
+builds indexes and starts the report writer at import time.
+"""
+import importlib
+
+_EXPORTS = {
+    "create_task": "task_runner",
+    "list_tasks": "task_runner",
+    "get_task": "task_runner",
+    "delete_task": "task_runner",
+    "run_task": "task_runner",
+    "run_all_tasks": "task_runner",
+    "get_profile": "task_runner",
+    "tool_timing_stats": "task_runner",
+    "task_summary": "task_runner",
+    "task_results": "task_runner",
+    "task_stats_for": "task_runner",
+    "forget_task_run": "task_runner",
+    "rebuild_task_stats": "task_runner",
+    "reset_golden": "task_runner",
+    "validate_task": "task_runner",
+    "TaskValidationError": "signatures",
+    "compiled_tools_stats": "running_tasks",
+    "reload_environment": "running_tasks",
+    "environment_stats": "running_tasks",
+    "result_cache_stats": "running_tasks",
+    "submit_run_all_job": "jobs",
+    "get_job": "jobs",
+    "cancel_job": "jobs",
+    "sandbox_stats": "sandbox",
+    "import_tasks_jsonl": "task_io",
+    "export_tasks_jsonl": "task_io",
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = list(_EXPORTS)
@@ -0,0 +1,254 @@
+import os
+import time
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import yaml
+
+from .lazy_tables import LazyTables, TableLoader
+from .signatures import SignatureIndex
+
+# Seconds between directory re-scans for a given env (0 = stat on every access)
+ENV_RECHECK_INTERVAL = float(os.getenv("ENV_RECHECK_INTERVAL", "2"))
+
+# GET/SET tool classification, next to the interface_N folders (same file
+# the API sanity checker reads)
+TOOL_KINDS_FILENAME = "get_set_APIs.yaml"
+
+
+class _FileEntry:
+    """Parsed content of one data/tool file plus what it was parsed from."""
+    __slots__ = ("mtime_ns", "size", "sha256", "value")
+
+    def __init__(self, mtime_ns, size, sha256, value):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha256 = sha256
+        self.value = value
+
+
+class _EnvState:
+    def __init__(self, env_dir: str, interface: str):
+        self.env_dir = env_dir
+        self.interface = interface
+        self.data_dir = os.path.join(env_dir, "data")
+        self.tools_dir = os.path.join(env_dir, "tools", f"interface_{interface}")
+        self.tables: Dict[str, _FileEntry] = {}
+        self.tools: Dict[str, _FileEntry] = {}
+        self.kinds: Dict[str, _FileEntry] = {}
+        self.env_data: Optional[Dict[str, Any]] = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {
+            "loads": 0,
+            "reloads": 0,
+            "files_parsed": 0,
+            "files_reused": 0,
+            "last_load_ms": 0.0,
+            "total_load_ms": 0.0,
+            "last_loaded_at": None,
+        }
+
+
+class EnvRegistry:
+    """Tracks every env data/tool file by mtime and content hash.
+
+    A rescan only stats files; anything whose mtime/size moved is re-hashed,
+    and only files whose hash actually changed are re-parsed. The registry
+    is per process, so each gunicorn worker picks changes up on its own.
+    """
+
+    def __init__(self, parse_tool: Callable[[str], Tuple[Dict, str, list]],
+                 recheck_interval: float = ENV_RECHECK_INTERVAL):
+        self.parse_tool = parse_tool
+        self.recheck_interval = recheck_interval
+        self._envs: Dict[Tuple[str, str], _EnvState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, env_dir: str, interface: str) -> _EnvState:
+        key = (env_dir, str(interface))
+        with self._lock:
+            state = self._envs.get(key)
+            if state is None:
+                state = self._envs[key] = _EnvState(env_dir, str(interface))
+            return state
+
+    def get(self, env_dir: str, interface: str) -> Dict[str, Any]:
+        """Return the env's parsed data and tools, refreshing changed files."""
+        state = self._state(env_dir, interface)
+        with state.lock:
+            fresh = time.monotonic() - state.checked_at < self.recheck_interval
+            if state.env_data is None or not fresh:
+                self._refresh(state)
+            return state.env_data
+
+    def reload(self, env_dir: str, interface: Optional[str] = None, force: bool = False):
+        """Rescan now (optionally discarding everything parsed so far)."""
+        with self._lock:
+            states = [s for (d, i), s in self._envs.items()
+                      if d == env_dir and (interface is None or i == str(interface))]
+        if interface is not None and not states:
+            states = [self._state(env_dir, interface)]
+        for state in states:
+            with state.lock:
+                if force:
+                    state.tables.clear()
+                    state.tools.clear()
+                    state.kinds.clear()
+                self._refresh(state)
+                state.stats["reloads"] += 1
+        return [self._stats_for(s) for s in states]
+
+    def stats(self):
+        with self._lock:
+            states = list(self._envs.values())
+        return [self._stats_for(s) for s in states]
+
+    @staticmethod
+    def _stats_for(state: _EnvState):
+        env_data = state.env_data or {}
+        data = env_data.get("data")
+        return dict(
+            state.stats,
+            env_dir=state.env_dir,
+            interface=state.interface,
+            tables=len(state.tables),
+            tables_loaded=data.loaded_tables() if data is not None else {},
+            tools=len(state.tools),
+            tools_hash=env_data.get("tools_hash"),
+            data_version=env_data.get("data_version"),
+        )
+
+    # ----------------------------- SCANNING ----------------------------- #
+
+    def _refresh(self, state: _EnvState):
+        if not os.path.exists(state.env_dir):
+            raise FileNotFoundError(f"Environment not found: {state.env_dir}")
+        if not os.path.exists(state.tools_dir):
+            raise FileNotFoundError(f"Tools directory not found: {state.tools_dir}")
+
+        started = time.perf_counter()
+        counters = {"parsed": 0, "reused": 0}
+        # tables are only registered here; they are parsed on first use
+        tables_changed = self._sync(
+            state.tables, state.data_dir,
+            lambda name: name.endswith(".json"),
+            TableLoader, counters,
+        )
+        tools_changed = self._sync(
+            state.tools, state.tools_dir,
+            lambda name: name.endswith(".py") and not name.startswith("__"),
+            lambda path, digest: self.parse_tool(path), counters,
+        )
+        kinds_changed = self._sync(
+            state.kinds, os.path.dirname(state.tools_dir),
+            lambda name: name == TOOL_KINDS_FILENAME,
+            lambda path, digest: _load_tool_kinds(path), counters,
+        )
+        state.checked_at = time.monotonic()
+
+        if state.env_data is None or tables_changed or tools_changed or kinds_changed:
+            state.env_data = self._build(state)
+            elapsed = (time.perf_counter() - started) * 1000
+            state.stats["loads"] += 1
+            state.stats["last_load_ms"] = round(elapsed, 2)
+            state.stats["total_load_ms"] = round(state.stats["total_load_ms"] + elapsed, 2)
+            state.stats["last_loaded_at"] = time.time()
+        state.stats["files_parsed"] += counters["parsed"]
+        state.stats["files_reused"] += counters["reused"]
+
+    @staticmethod
+    def _sync(entries: Dict[str, _FileEntry], folder: str, accept, parse, counters) -> bool:
+        """Bring `entries` in line with `folder`; returns True if anything changed."""
+        changed = False
+        seen = set()
+        if os.path.exists(folder):
+            for item in os.scandir(folder):
+                if not item.is_file() or not accept(item.name):
+                    continue
+                seen.add(item.name)
+                st = item.stat()
+                entry = entries.get(item.name)
+                if entry and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                    counters["reused"] += 1
+                    continue
+
+                with open(item.path, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256").hexdigest()
+                if entry and entry.sha256 == digest:
+                    # touched but identical: keep the parsed value
+                    entry.mtime_ns, entry.size = st.st_mtime_ns, st.st_size
+                    counters["reused"] += 1
+                    continue
+
+                entries[item.name] = _FileEntry(
+                    st.st_mtime_ns, st.st_size, digest, parse(item.path, digest)
+                )
+                counters["parsed"] += 1
+                changed = True
+
+        for name in [n for n in entries if n not in seen]:
+            del entries[name]
+            changed = True
+        return changed
+
+    @staticmethod
+    def _build(state: _EnvState) -> Dict[str, Any]:
+        data = LazyTables({name.split(".")[0]: entry.value for name, entry in state.tables.items()})
+
+        kinds_entry = state.kinds.get(TOOL_KINDS_FILENAME)
+        kinds = (kinds_entry.value if kinds_entry else {}).get(f"interface_{state.interface}", {})
+
+        invoke_methods, functions_info, imports_set, tool_kinds = [], [], set(), {}
+        invoke_sources = []
+        for name in sorted(state.tools):
+            info, invoke, imports = state.tools[name].value
+            if info and invoke:
+                imports_set.update(imports)
+                invoke_methods.append(invoke.replace("invoke", info["name"] + "_invoke"))
+                invoke_sources.append(invoke)
+                functions_info.append(info)
+                # the YAML lists file stems; tools are called by get_info() name
+                kind = kinds.get(name[:-3].lower()) or kinds.get(info["name"].lower())
+                if kind:
+                    tool_kinds[info["name"]] = kind
+
+        return {
+            "data": data,
+            "imports": list(imports_set),
+            "invoke_methods": invoke_methods,
+            "functions_info": functions_info,
+            "signatures": SignatureIndex(functions_info, invoke_sources),
+            "tool_kinds": tool_kinds,
+            "tools_hash": _combined_hash(state.tools),
+            "data_version": _combined_hash(state.tables),
+        }
+
+
+def _load_tool_kinds(path: str) -> Dict[str, Dict[str, str]]:
+    """`interface_N -> {api_name: "get"|"set"}` from a get_set_APIs.yaml file."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError):
+        return {}  # unclassified tools are simply never memoized
+    kinds = {}
+    for iface, buckets in raw.items() if isinstance(raw, dict) else ():
+        if not isinstance(buckets, dict):
+            continue
+        iface_kinds = kinds[str(iface)] = {}
+        for kind in ("set", "get"):
+            for api in buckets.get(kind) or []:
+                if isinstance(api, str) and api.strip():
+                    # listed as both: treat as SET
+                    iface_kinds.setdefault(api.strip().lower(), kind)
+    return kinds
+
+
+def _combined_hash(entries: Dict[str, _FileEntry]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(entries):
+        digest.update(name.encode("utf-8"))
+        digest.update(entries[name].sha256.encode("ascii"))
+    return digest.hexdigest()
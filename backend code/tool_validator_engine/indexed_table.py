@@ -0,0 +1,149 @@
+from collections.abc import Hashable
+from typing import Any, Dict, List, Set
+
+_MISSING = object()
+
+
+class IndexedTable(dict):
+    """A plain dict of `{key: row}` that can keep secondary indexes on row fields.
+
+    Tools that don't know about indexes use it exactly like the dict they
+    always got. Tools can opt in with::
+
+        table = data["trades"]
+        if hasattr(table, "lookup"):
+            trades = table.lookup("fund_id", fund_id)   # O(1) after first use
+
+    An index is built on its first lookup and is maintained on every
+    insert/replace/delete through the mapping. Editing an indexed field
+    in place on a row (`row["fund_id"] = x`) bypasses the table: lookups
+    never return the row for its old value, but it is only found under the
+    new one after `reindex(key)` (or assigning the row back).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # field -> value -> set of row keys; built lazily
+        self._indexes: Dict[str, Dict[Any, Set[Any]]] = {}
+
+    # ----------------------------- QUERIES ----------------------------- #
+
+    def index(self, field: str) -> Dict[Any, Set[Any]]:
+        idx = self._indexes.get(field)
+        if idx is None:
+            idx = {}
+            for key, row in self.items():
+                self._add(idx, field, key, row)
+            self._indexes[field] = idx
+        return idx
+
+    def keys_where(self, field: str, value: Any) -> Set[Any]:
+        """Row keys whose `field` equals `value`."""
+        return {key for key in self.index(field).get(value, ()) if self._matches(key, field, value)}
+
+    def lookup(self, field: str, value: Any) -> List[Any]:
+        """Rows whose `field` equals `value`."""
+        bucket = self.index(field).get(value, ())
+        return [self[key] for key in bucket if self._matches(key, field, value)]
+
+    def lookup_one(self, field: str, value: Any, default=None):
+        for key in self.index(field).get(value, ()):
+            if self._matches(key, field, value):
+                return self[key]
+        return default
+
+    def reindex(self, key=_MISSING):
+        """Refresh indexes for one row (after an in-place edit) or drop them all."""
+        if key is _MISSING:
+            self._indexes.clear()
+            return
+        for field, idx in self._indexes.items():
+            for bucket in idx.values():
+                bucket.discard(key)
+            if key in self:
+                self._add(idx, field, key, dict.__getitem__(self, key))
+
+    @property
+    def indexed_fields(self) -> List[str]:
+        return list(self._indexes)
+
+    # ----------------------------- WRITES ----------------------------- #
+
+    def __setitem__(self, key, row):
+        if self._indexes:
+            self._unindex(key)
+        super().__setitem__(key, row)
+        for field, idx in self._indexes.items():
+            self._add(idx, field, key, row)
+
+    def __delitem__(self, key):
+        if self._indexes:
+            self._unindex(key)
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        if self._indexes and key in self:
+            self._unindex(key)
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, row = super().popitem()
+        for field, idx in self._indexes.items():
+            self._discard(idx, field, key, row)
+        return key, row
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, row in dict(*args, **kwargs).items():
+            self[key] = row
+
+    def clear(self):
+        super().clear()
+        for idx in self._indexes.values():
+            idx.clear()
+
+    def copy(self):
+        return IndexedTable(self)
+
+    def __reduce__(self):
+        # indexes are rebuilt lazily on the other side
+        return IndexedTable, (dict(self),)
+
+    # ----------------------------- INTERNALS ----------------------------- #
+
+    @staticmethod
+    def _value(row, field):
+        value = row.get(field, _MISSING) if isinstance(row, dict) else _MISSING
+        if value is _MISSING or not isinstance(value, Hashable):
+            return _MISSING  # rows without a hashable value for the field aren't indexed
+        return value
+
+    def _matches(self, key, field, value):
+        # filters out rows whose indexed field was edited in place
+        row = dict.get(self, key, _MISSING)
+        return row is not _MISSING and self._value(row, field) == value
+
+    def _add(self, idx, field, key, row):
+        value = self._value(row, field)
+        if value is not _MISSING:
+            idx.setdefault(value, set()).add(key)
+
+    def _discard(self, idx, field, key, row):
+        value = self._value(row, field)
+        if value is not _MISSING:
+            bucket = idx.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del idx[value]
+
+    def _unindex(self, key):
+        row = dict.get(self, key, _MISSING)
+        if row is _MISSING:
+            return
+        for field, idx in self._indexes.items():
+            self._discard(idx, field, key, row)
@@ -0,0 +1,173 @@
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pymongo import ASCENDING, DESCENDING
+
+from .task_runner import db, oid, now, run_task, flush_reports
+from .running_tasks import compiled_tools_stats
+
+# Max tasks executing at once for a single user, across all of their jobs
+JOB_CONCURRENCY = max(1, int(os.getenv("TASK_JOB_CONCURRENCY", "4")))
+
+db.task_jobs.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+
+_user_slots = {}
+_user_slots_lock = threading.Lock()
+_cancelled = set()
+
+
+def _slots_for(user_id):
+    with _user_slots_lock:
+        slots = _user_slots.get(str(user_id))
+        if slots is None:
+            slots = threading.BoundedSemaphore(JOB_CONCURRENCY)
+            _user_slots[str(user_id)] = slots
+        return slots
+
+
+def _serialize_job(job):
+    job = dict(job)
+    job["_id"] = str(job["_id"])
+    job["user_id"] = str(job["user_id"])
+    return job
+
+
+# ----------------------------- API ----------------------------- #
+
+def submit_run_all_job(user_id, backend=None, max_workers=None, notify=None, spawn=None, replay=False):
+    """Queue a run of every task the user owns and return the job immediately.
+
+    `notify(event, payload)` receives per-task progress events and `spawn(fn, *args)`
+    starts the background worker (defaults to a daemon thread).
+    """
+    task_ids = [str(t["_id"]) for t in db.tasks.find({"user_id": oid(user_id)}, {"_id": 1})]
+    job = {
+        "user_id": oid(user_id),
+        "status": "queued",
+        "backend": backend,
+        "replay": bool(replay),
+        "total": len(task_ids),
+        "completed": 0,
+        "passed": 0,
+        "failed": 0,
+        "results": [],
+        "cancel_requested": False,
+        "created_at": now(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    res = db.task_jobs.insert_one(job)
+    job_id = str(res.inserted_id)
+
+    args = (job_id, str(user_id), task_ids, backend, max_workers, notify, replay)
+    if spawn:
+        spawn(_run_job, *args)
+    else:
+        threading.Thread(target=_run_job, args=args, daemon=True).start()
+    return _serialize_job(job)
+
+
+def get_job(user_id, job_id, include_results=True):
+    projection = None if include_results else {"results": 0}
+    job = db.task_jobs.find_one({"_id": oid(job_id)}, projection)
+    if not job:
+        raise FileNotFoundError("Job not found")
+    if str(job["user_id"]) != str(user_id):
+        raise PermissionError("Forbidden")
+    return _serialize_job(job)
+
+
+def cancel_job(user_id, job_id):
+    """Flag a job for cancellation; tasks already running are allowed to finish."""
+    job = get_job(user_id, job_id, include_results=False)
+    if job["status"] in ("completed", "cancelled", "failed"):
+        return job
+    _cancelled.add(job_id)
+    db.task_jobs.update_one({"_id": oid(job_id)}, {"$set": {"cancel_requested": True}})
+    job["cancel_requested"] = True
+    return job
+
+
+# ----------------------------- WORKER ----------------------------- #
+
+def _is_cancelled(job_id):
+    if job_id in _cancelled:
+        return True
+    # the cancel request may have landed on another gunicorn worker
+    job = db.task_jobs.find_one({"_id": oid(job_id)}, {"cancel_requested": 1})
+    return bool(job and job.get("cancel_requested"))
+
+
+def _run_job(job_id, user_id, task_ids, backend, max_workers, notify, replay=False):
+    notify = notify or (lambda event, payload: None)
+    slots = _slots_for(user_id)
+    workers = max(1, min(int(max_workers or JOB_CONCURRENCY), JOB_CONCURRENCY, len(task_ids) or 1))
+    before = compiled_tools_stats()
+
+    db.task_jobs.update_one({"_id": oid(job_id)}, {"$set": {"status": "running", "started_at": now()}})
+    notify("task_job_started", {"uid": user_id, "job_id": job_id, "total": len(task_ids)})
+
+    def run_one(task_id):
+        with slots:
+            if _is_cancelled(job_id):
+                return None
+            return run_task(user_id, task_id, backend=backend, flush=False, replay=replay)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(run_one, tid): tid for tid in task_ids}
+            for fut in as_completed(futures):
+                task_id = futures[fut]
+                try:
+                    report = fut.result()
+                except Exception as e:
+                    report = {"status": "failed", "error": str(e)}
+                if report is None:
+                    continue  # skipped after cancellation
+
+                status = report.get("status")
+                record = {"task_id": task_id, "report_id": report.get("_id"), "status": status}
+                db.task_jobs.update_one(
+                    {"_id": oid(job_id)},
+                    {
+                        "$inc": {"completed": 1, "passed" if status == "passed" else "failed": 1},
+                        "$push": {"results": record},
+                    },
+                )
+                notify("task_job_progress", dict(record, uid=user_id, job_id=job_id))
+
+        flush_reports()
+        after = compiled_tools_stats()
+        final = "cancelled" if _is_cancelled(job_id) else "completed"
+        db.task_jobs.update_one(
+            {"_id": oid(job_id)},
+            {"$set": {
+                "status": final,
+                "finished_at": now(),
+                "tools_cache": {
+                    "hits": after["hits"] - before["hits"],
+                    "misses": after["misses"] - before["misses"],
+                },
+            }},
+        )
+        job = db.task_jobs.find_one({"_id": oid(job_id)}, {"results": 0})
+        notify("task_job_done", {
+            "uid": user_id,
+            "job_id": job_id,
+            "status": final,
+            "completed": job.get("completed"),
+            "passed": job.get("passed"),
+            "failed": job.get("failed"),
+        })
+
+    except Exception as e:
+        db.task_jobs.update_one(
+            {"_id": oid(job_id)},
+            {"$set": {"status": "failed", "finished_at": now(),
+                      "error": str(e), "trace": traceback.format_exc()}},
+        )
+        notify("task_job_error", {"uid": user_id, "job_id": job_id, "error": str(e)})
+    finally:
+        _cancelled.discard(job_id)
@@ -0,0 +1,86 @@
+import os
+import json
+import mmap
+import time
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict
+
+from .indexed_table import IndexedTable
+
+# Optional fast JSON: fall back to the stdlib parser if it is missing
+try:
+    import orjson  # type: ignore
+    _ORJSON_AVAILABLE = True
+except Exception:
+    orjson = None  # type: ignore
+    _ORJSON_AVAILABLE = False
+
+
+def _read_mapped(path: str) -> Any:
+    """Parse a JSON file straight from a read-only memory map (no extra copy)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return orjson.loads(f.read())  # mmap can't map empty files; raises like json.load
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return orjson.loads(memoryview(mm))
+
+
+class TableLoader:
+    """Parses one env table the first time it is asked for, then keeps it."""
+
+    def __init__(self, path: str, sha256: str):
+        self.path = path
+        self.sha256 = sha256
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.load_ms = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> Any:
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                value = self._parse()
+                # shared by every run's read-only lookups, so indexes are built once
+                self._value = IndexedTable(value) if type(value) is dict else value
+                self.load_ms = round((time.perf_counter() - started) * 1000, 2)
+                self._loaded = True
+        return self._value
+
+    def _parse(self) -> Any:
+        if not _ORJSON_AVAILABLE:
+            with open(self.path, "r") as jf:
+                return json.load(jf)
+        return _read_mapped(self.path)
+
+
+class LazyTables(Mapping):
+    """Read-only table mapping that materializes each table on first access."""
+
+    def __init__(self, loaders: Dict[str, TableLoader]):
+        self._loaders = loaders
+
+    def __getitem__(self, name):
+        return self._loaders[name].load()
+
+    def __contains__(self, name):
+        return name in self._loaders
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def loaded_tables(self):
+        return {name: loader.load_ms for name, loader in self._loaders.items() if loader.loaded}
+
+    def __repr__(self):
+        return f"LazyTables(tables={len(self)}, loaded={sorted(self.loaded_tables())})"
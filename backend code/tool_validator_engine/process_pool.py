@@ -0,0 +1,141 @@
+import os
+import atexit
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Optional, Tuple
+
+from .running_tasks import env_interface, run_actions, snapshot_env
+
+# forkserver/spawn children start from a clean interpreter instead of a copy of
+# a threaded (eventlet-patched) app process, so they can't inherit held locks;
+# the price is one import of this package per worker
+START_METHOD = os.getenv("TASK_POOL_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+# One pool per app process, shared by every env; gunicorn runs several of these
+DEFAULT_WORKERS = int(os.getenv("TASK_POOL_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# Most recently used (env, interface) pairs a new pool's workers parse before their first task
+WARM_ENVS = int(os.getenv("TASK_POOL_WARM_ENVS", "4"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# Insertion order doubles as recency: a used pair is moved to the end
+_recent_envs: Dict[Tuple[str, str], None] = {}
+
+
+########################## WORKER SIDE #########################################
+
+def _warm_worker(envs):
+    """Pool initializer: parse envs and compile their Tools before the first task."""
+    for env, interface in envs:
+        try:
+            env_interface(env, interface)
+        except Exception:
+            pass  # the task itself reports the error
+
+
+def _run_in_worker(env: str, interface: str, task_id: str, actions: list, profile: bool = False):
+    """Run one task inside a worker; returns a compact picklable record."""
+    try:
+        # the worker's env registry parses an env once, then only re-parses
+        # files that changed
+        env_data = snapshot_env(env_interface(env, interface))
+        outcomes, success, profile_blob = run_actions(env_data, actions, profile=profile)
+        return task_id, outcomes, success, None, profile_blob
+    except Exception as e:
+        return task_id, [], False, {"error": str(e), "trace": traceback.format_exc()}, None
+
+
+########################## PARENT SIDE #########################################
+
+def get_pool(env: str = None, interface: str = None) -> ProcessPoolExecutor:
+    """Return this process's task pool, starting it on first use.
+
+    New workers are pre-warmed with the most recently used envs, so only an
+    env a worker hasn't seen yet is parsed on that worker's first task.
+    """
+    global _pool
+    with _pool_lock:
+        if env is not None:
+            key = (env, str(interface))
+            _recent_envs.pop(key, None)
+            _recent_envs[key] = None
+            while len(_recent_envs) > max(1, WARM_ENVS):
+                del _recent_envs[next(iter(_recent_envs))]
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=DEFAULT_WORKERS,
+                mp_context=multiprocessing.get_context(START_METHOD),
+                initializer=_warm_worker,
+                initargs=(list(_recent_envs),),
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_task(task, profile: bool = False):
+    """Queue one task document on the pool; returns a Future of the record."""
+    return get_pool(task["env"], task["interface_num"]).submit(
+        _run_in_worker, task["env"], str(task["interface_num"]),
+        str(task["_id"]), task.get("actions", []), profile,
+    )
+
+
+def run_tasks_in_processes(tasks, max_workers: int = None):
+    """Fan tasks out to the process pool.
+
+    At most `max_workers` tasks (default: the pool size) are in flight at
+    once. Yields `(task_id, outcomes, success, error, profile_blob)` as
+    tasks complete.
+    """
+    window = max(1, min(max_workers or DEFAULT_WORKERS, DEFAULT_WORKERS))
+    pending = iter(tasks)
+    futures = {}
+
+    def _fill():
+        for t in pending:
+            try:
+                futures[submit_task(t)] = str(t["_id"])
+            except Exception as e:
+                return str(t["_id"]), {"error": str(e), "trace": traceback.format_exc()}
+            if len(futures) >= window:
+                break
+        return None
+
+    while True:
+        failed = _fill()
+        if failed:
+            yield failed[0], [], False, failed[1], None
+            continue
+        if not futures:
+            return
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for fut in done:
+            task_id = futures.pop(fut)
+            try:
+                yield fut.result()
+            except Exception as e:
+                # BrokenProcessPool etc.: drop the pool so the next submit starts fresh
+                with _pool_lock:
+                    pool = _pool
+                if pool is not None:
+                    _discard_pool(pool)
+                yield task_id, [], False, {"error": str(e), "trace": traceback.format_exc()}, None
+
+
+@atexit.register
+def shutdown_pools():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+import json
+import zlib
+import hashlib
+from typing import Any, Dict, List, Tuple
+
+# Field-level differences kept per changed action
+MAX_DIFFS_PER_ACTION = 20
+
+
+def canonical_json(value: Any) -> bytes:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _digest(payload: bytes) -> str:
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def outcome_digest(status: int, result: Any) -> str:
+    """Hash of what an action returned; timings are deliberately left out."""
+    return _digest(canonical_json([status, result]))
+
+
+def actions_digest(actions: list) -> str:
+    """Hash of a task's action list, so a golden is dropped when the task is edited."""
+    return _digest(canonical_json([[a.get("name"), a.get("arguments", {})] for a in actions]))
+
+
+def make_golden(actions: list, outcomes: list) -> Dict[str, Any]:
+    """Hashes plus a compressed copy of every action's output (read only on mismatch)."""
+    payloads = [[status, result] for status, result, _ in outcomes]
+    return {
+        "actions_hash": actions_digest(actions),
+        "hashes": [outcome_digest(status, result) for status, result in payloads],
+        "payload": zlib.compress(canonical_json(payloads), 6),
+    }
+
+
+def diff_values(golden: Any, actual: Any, path: str = "$", out: List[Dict] = None,
+                limit: int = MAX_DIFFS_PER_ACTION) -> List[Dict]:
+    """Field-level differences between two JSON-shaped values (first `limit`)."""
+    out = [] if out is None else out
+    if len(out) >= limit:
+        return out
+    if isinstance(golden, dict) and isinstance(actual, dict):
+        for key in sorted(set(golden) | set(actual), key=str):
+            sub = f"{path}.{key}"
+            if key not in actual:
+                out.append({"path": sub, "golden": golden[key], "missing": True})
+            elif key not in golden:
+                out.append({"path": sub, "actual": actual[key], "added": True})
+            else:
+                diff_values(golden[key], actual[key], sub, out, limit)
+            if len(out) >= limit:
+                break
+    elif isinstance(golden, list) and isinstance(actual, list):
+        if len(golden) != len(actual):
+            out.append({"path": f"{path}.length", "golden": len(golden), "actual": len(actual)})
+        for i, (g, a) in enumerate(zip(golden, actual)):
+            diff_values(g, a, f"{path}[{i}]", out, limit)
+            if len(out) >= limit:
+                break
+    elif golden != actual:
+        out.append({"path": path, "golden": golden, "actual": actual})
+    return out
+
+
+def compare(golden: Dict[str, Any], outcomes: list) -> Tuple[List[int], Dict[str, Any]]:
+    """Indices whose output hash differs from the golden, and a diff for each.
+
+    The stored payloads are only decompressed when something changed.
+    """
+    hashes = golden["hashes"]
+    changed = [
+        i for i, (status, result, _) in enumerate(outcomes)
+        if i >= len(hashes) or hashes[i] != outcome_digest(status, result)
+    ]
+    changed.extend(range(len(outcomes), len(hashes)))
+    if not changed:
+        return [], {}
+
+    payloads = json.loads(zlib.decompress(golden["payload"]))
+    diffs = {}
+    for i in changed:
+        expected = payloads[i] if i < len(payloads) else None
+        actual = [outcomes[i][0], outcomes[i][1]] if i < len(outcomes) else None
+        if expected is None or actual is None:
+            diffs[str(i)] = {"golden": expected, "actual": actual}
+        else:
+            # canonical round trip so tuples/ObjectIds compare like the stored copy
+            actual = json.loads(canonical_json(actual))
+            diffs[str(i)] = {
+                "status": {"golden": expected[0], "actual": actual[0]},
+                "changes": diff_values(expected[1], actual[1]),
+            }
+    return changed, diffs
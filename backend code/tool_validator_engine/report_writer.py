@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import threading
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "200"))
+REPORT_FLUSH_INTERVAL = float(os.getenv("REPORT_FLUSH_INTERVAL", "1.0"))
+
+
+class ReportWriter:
+    """Buffers report documents and stores them with unordered insert_many.
+
+    `_id`s are assigned client-side so callers get the report id straight
+    away. A batch is written once it reaches `max_batch` documents or its
+    oldest document is `max_delay` seconds old, and on shutdown.
+    `on_stored(docs)` is called with the documents of each confirmed insert.
+    """
+
+    def __init__(self, collection, max_batch=REPORT_BATCH_SIZE, max_delay=REPORT_FLUSH_INTERVAL,
+                 on_stored=None):
+        self.collection = collection
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max_delay
+        self.on_stored = on_stored
+        self._buffer = []
+        self._oldest = None
+        # _id -> outcome (True, or the exception) for flush=True writers waiting on their doc
+        self._waiting = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, name="report-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, doc, flush=False):
+        """Queue `doc` for insertion and return its ObjectId.
+
+        With flush=True the buffer is written before returning, and if `doc`
+        itself wasn't stored this raises with `doc` taken back out of the
+        buffer, so the caller never hands out the id of a report that
+        doesn't exist. Other documents' failures don't affect the caller.
+        """
+        doc.setdefault("_id", ObjectId())
+        with self._cond:
+            if flush:
+                self._waiting[doc["_id"]] = None
+            self._buffer.append(doc)
+            if self._oldest is None:
+                # the flusher sleeps untimed while the buffer is empty: start its clock
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            elif len(self._buffer) >= self.max_batch:
+                self._cond.notify()
+        if flush:
+            # a concurrent flush may already hold the doc; the lock waits it out
+            self._flush(raise_errors=False)
+            with self._cond:
+                outcome = self._waiting.pop(doc["_id"], None)
+            if outcome is not True:
+                self._discard(doc)  # still buffered after a transient failure
+                raise outcome if isinstance(outcome, Exception) else RuntimeError("report was not stored")
+        elif self._closed:
+            self._flush(raise_errors=False)
+        return doc["_id"]
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of documents stored.
+
+        Raises if any document could not be stored; documents that failed
+        for a transient reason stay buffered for the background retry.
+        """
+        return self._flush(raise_errors=True)
+
+    def _flush(self, raise_errors):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer, self._oldest = self._buffer, [], None
+            if not batch:
+                return 0
+            stored, error = batch, None
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # unordered: everything except the failed documents was inserted;
+                # duplicate keys are documents an earlier, interrupted attempt stored
+                errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+                if errors:
+                    logger.error("Report bulk insert had %d errors: %s", len(errors), errors[:3])
+                    failed = {err.get("index") for err in errors}
+                    stored = [d for i, d in enumerate(batch) if i not in failed]
+                    self._settle([batch[i] for i in failed if i is not None and i < len(batch)], e)
+                    error = e
+            except Exception as e:
+                # connection/server trouble: nothing is lost, the next flush retries
+                self._requeue(batch)
+                self._settle(batch, e)
+                if not raise_errors:
+                    logger.exception("Report bulk insert failed; retrying %d reports", len(batch))
+                stored, error = [], e
+            self._settle(stored, True)
+        if stored and self.on_stored is not None:
+            try:
+                self.on_stored(stored)
+            except Exception:
+                logger.exception("on_stored failed for %d reports", len(stored))
+        if error is not None and raise_errors:
+            raise error
+        return len(stored)
+
+    def _settle(self, docs, outcome):
+        with self._cond:
+            for doc in docs:
+                if doc["_id"] in self._waiting:
+                    self._waiting[doc["_id"]] = outcome
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._buffer[:0] = batch
+            self._oldest = time.monotonic()  # retry after max_delay, not in a tight loop
+            self._cond.notify()
+
+    def _discard(self, doc):
+        with self._cond:
+            self._buffer = [d for d in self._buffer if d is not doc]
+            if not self._buffer:
+                self._oldest = None
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._buffer) >= self.max_batch:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.max_delay - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                closed = self._closed
+            self._flush(raise_errors=False)
+            if closed:
+                return
+
+    def close(self):
+        """Stop the background flusher and write any remaining reports."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self._flush(raise_errors=False)
@@ -0,0 +1,78 @@
+import os
+import json
+import threading
+from typing import Any, Dict, FrozenSet, Optional, Set, Tuple
+
+from cachetools import LRUCache
+
+from .snapshot import clone_table
+
+# Max memoized GET results per process (0 disables memoization)
+RESULT_CACHE_SIZE = int(os.getenv("TASK_RESULT_CACHE_SIZE", "4096"))
+
+MISS = object()
+
+
+def canonical_arguments(arguments: Dict[str, Any]) -> Optional[str]:
+    """Order-independent string form of a call's arguments (None if not JSON-shaped)."""
+    try:
+        return json.dumps(arguments, sort_keys=True, separators=(",", ":"), allow_nan=False)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultCache:
+    """Bounded LRU of read-only (GET) tool results.
+
+    Keys are (data_version, tools_hash, tool, canonical args), so a changed
+    env file simply stops matching. Each entry remembers the tables the
+    tool read; a run whose SET actions have written any of those tables
+    bypasses the entry (and doesn't store) for the rest of that run, since
+    the cached value was computed against the untouched env data.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: LRUCache = LRUCache(maxsize=max(1, maxsize))
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def key(env_data: Dict[str, Any], tool: str, arguments: Dict[str, Any]) -> Optional[Tuple]:
+        args = canonical_arguments(arguments)
+        version = (env_data.get("data_version"), env_data.get("tools_hash"))
+        if args is None or None in version:
+            return None
+        return version + (tool, args)
+
+    def get(self, key: Tuple, dirty: Set[str]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return MISS
+            result, reads = entry
+            if reads & dirty:
+                self._stats["bypassed"] += 1
+                return MISS
+            self._stats["hits"] += 1
+        # callers get their own copy; the cached value is never handed out
+        return clone_table(result)
+
+    def put(self, key: Tuple, result: Any, reads: FrozenSet[str]):
+        value = (clone_table(result), frozenset(reads))
+        with self._lock:
+            self._entries[key] = value
+            self._stats["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), maxsize=self.maxsize)
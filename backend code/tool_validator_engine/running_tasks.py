@@ -2,11 +2,46 @@ import json
 import ast
 import os
 import re
-import functools
-from typing import Dict, Any, Tuple
-
-# In-memory cache for parsed environments (safe to reuse)
-_env_cache: Dict[str, Dict[str, Any]] = {}
+import time
+import random
+import logging
+import marshal
+import cProfile
+import textwrap
+import threading
+import contextlib
+import tracemalloc
+from typing import Dict, Any, Optional, Tuple
+
+from .snapshot import DataSnapshot, clone_table
+from .env_registry import EnvRegistry
+from .result_cache import MISS, ResultCache
+
+# Compiled Tools classes keyed by (env_dir, interface, tools_hash)
+_tools_cache: Dict[Tuple[str, str, str], type] = {}
+_tools_cache_stats = {"hits": 0, "misses": 0, "compiles": 0}
+_tools_cache_lock = threading.Lock()
+
+# Per-action peak memory via tracemalloc. Off by default: tracing slows every
+# allocation in the process, and the peak is process-wide, so it is only
+# approximate (flagged peak_kb_approx) when runs overlap.
+TRACE_MEMORY = os.getenv("TASK_TRACE_MEMORY", "0") == "1"
+_tracing_runs = 0
+_tracing_owned = False
+_tracing_lock = threading.Lock()
+
+# Memoized results of GET tools (per process)
+result_cache = ResultCache()
+
+# GET tools (per get_set_APIs.yaml) get private table copies like any other
+# tool unless TASK_READ_ONLY_GETS=1; then they read the shared tables and a
+# sample of calls (TASK_GET_VERIFY_RATE) still runs copy-on-write to check
+# the label: a GET found editing rows in place loses the fast path
+READ_ONLY_GETS = os.getenv("TASK_READ_ONLY_GETS", "0") == "1"
+GET_VERIFY_RATE = float(os.getenv("TASK_GET_VERIFY_RATE", "0.01"))
+_mutating_gets: set = set()
+
+logger = logging.getLogger(__name__)
 
 
 ########################## AST UTILITIES #######################################
@@ -71,65 +106,83 @@ def extract_file_info(file_path: str) -> Tuple[Dict, str, list]:
 
 ########################## ENVIRONMENT LOADING #################################
 
-@functools.lru_cache(maxsize=20)
-def load_environment(env_dir: str, interface: str) -> Dict[str, Any]:
-    """Load environment & cache parsed tools for performance."""
-    if not os.path.exists(env_dir):
-        raise FileNotFoundError(f"Environment not found: {env_dir}")
-
-    data_dir = os.path.join(env_dir, "data")
-    tools_dir = os.path.join(env_dir, "tools", f"interface_{interface}")
-
-    data = {}
-    if os.path.exists(data_dir):
-        for f in os.listdir(data_dir):
-            if f.endswith(".json"):
-                with open(os.path.join(data_dir, f), "r") as jf:
-                    data[f.split(".")[0]] = json.load(jf)
-
-    invoke_methods, functions_info, imports_set = [], [], set()
-
-    if not os.path.exists(tools_dir):
-        raise FileNotFoundError(f"Tools directory not found: {tools_dir}")
-
-    for file in os.listdir(tools_dir):
-        if not file.endswith(".py") or file.startswith("__"):
-            continue
-        info, invoke, imports = extract_file_info(os.path.join(tools_dir, file))
-        if info and invoke:
-            imports_set.update(imports)
-            invoke_methods.append(invoke.replace("invoke", info["name"] + "_invoke"))
-            functions_info.append(info)
-
-    return {
-        "data": data,
-        "imports": list(imports_set),
-        "invoke_methods": invoke_methods,
-        "functions_info": functions_info
-    }
+# Tracks data/tool files per env by mtime + content hash
+env_registry = EnvRegistry(extract_file_info)
 
 
-def env_interface(environment: str, interface: str, envs_path="envs") -> Dict[str, Any]:
-    """Normalize environment path and load environment."""
-    env_dir = environment if os.path.isabs(environment) or environment.startswith(envs_path) \
+def normalize_env_dir(environment: str, envs_path="envs") -> str:
+    return environment if os.path.isabs(environment) or environment.startswith(envs_path) \
         else os.path.join(envs_path, environment)
 
-    cache_key = f"{env_dir}::{interface}"
-    if cache_key in _env_cache:
-        return _env_cache[cache_key]
 
+def load_environment(env_dir: str, interface: str) -> Dict[str, Any]:
+    """Load environment through the registry (only changed files are re-parsed)."""
+    return env_registry.get(env_dir, str(interface))
+
+
+def env_interface(environment: str, interface: str, envs_path="envs") -> Dict[str, Any]:
+    """Normalize environment path and load environment with its compiled Tools class."""
+    env_dir = normalize_env_dir(environment, envs_path)
     env_data = load_environment(env_dir, interface)
-    _env_cache[cache_key] = env_data
-    return env_data
+
+    tools_class = get_compiled_tools(
+        env_dir, interface, env_data["tools_hash"], env_data["imports"], env_data["invoke_methods"]
+    )
+    return dict(env_data, tools=tools_class)
+
+
+def reload_environment(environment: str, interface: str = None, force: bool = False,
+                       envs_path="envs"):
+    """Rescan an env now instead of waiting for the next access."""
+    return env_registry.reload(normalize_env_dir(environment, envs_path), interface, force=force)
+
+
+def environment_stats():
+    """Per env/interface load timings and file counters for this process."""
+    return env_registry.stats()
+
+
+def snapshot_env(env_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Give a run its own copy-on-write view of the shared env tables."""
+    return dict(env_data, data=DataSnapshot(env_data["data"]))
 
 
 ########################## EXECUTION ###########################################
 
+def get_compiled_tools(env_dir, interface, tools_hash, imports_set, invoke_methods):
+    """Return the Tools class for an env/interface, compiling it only on a cache miss."""
+    key = (env_dir, str(interface), tools_hash)
+    with _tools_cache_lock:
+        tools_class = _tools_cache.get(key)
+        if tools_class is not None:
+            _tools_cache_stats["hits"] += 1
+            return tools_class
+        _tools_cache_stats["misses"] += 1
+
+    tools_class = create_tools_class(imports_set, invoke_methods)
+
+    with _tools_cache_lock:
+        # drop classes compiled from older versions of the same tools folder
+        for stale in [k for k in _tools_cache if k[:2] == key[:2] and k != key]:
+            del _tools_cache[stale]
+        _tools_cache[key] = tools_class
+        _tools_cache_stats["compiles"] += 1
+    return tools_class
+
+
+def compiled_tools_stats() -> Dict[str, int]:
+    """Snapshot of compiled-tools cache counters."""
+    with _tools_cache_lock:
+        return dict(_tools_cache_stats, entries=len(_tools_cache))
+
+
 def create_tools_class(imports_set, invoke_methods):
     imports_code = "\n".join(imports_set)
     class_code = f"{imports_code}\n\nclass Tools:\n"
     for method in invoke_methods:
-        class_code += f"    @staticmethod\n    {method}\n\n"
+        # methods keep their original class indentation; normalize it
+        method = textwrap.indent(textwrap.dedent(method), "    ")
+        class_code += f"    @staticmethod\n{method}\n\n"
 
     ns = {}
     exec(class_code, ns)
@@ -137,9 +190,52 @@ def create_tools_class(imports_set, invoke_methods):
 
 
 def execute_api(api_name: str, arguments: Dict[str, Any], env_data: Dict[str, Any]):
-    """Execute API safely inside its environment."""
+    """Execute API safely inside its environment.
+
+    On a run snapshot, tools get private copies of the tables they look
+    up; SET (and unclassified) tools mark them dirty for the run. GET
+    tools (per get_set_APIs.yaml) are memoized, and with TASK_READ_ONLY_GETS=1
+    read the shared tables without copying them.
+    """
+    data = env_data["data"]
+    if not isinstance(data, DataSnapshot):
+        return _invoke_api(api_name, arguments, env_data)
+
+    if (env_data.get("tool_kinds") or {}).get(api_name) != "get":
+        # SET (or unclassified): any table it looked at may have been edited in place
+        with data.recording_reads() as reads:
+            outcome = _invoke_api(api_name, arguments, env_data)
+        data.mark_dirty(reads)
+        return outcome
+
+    key = result_cache.key(env_data, api_name, arguments) if result_cache.enabled else None
+    if key is not None:
+        cached = result_cache.get(key, data.dirty)
+        if cached is not MISS:
+            return cached, 200
+    shared = READ_ONLY_GETS and api_name not in _mutating_gets and random.random() >= GET_VERIFY_RATE
+    with data.recording_reads() as reads, (data.read_only() if shared else contextlib.nullcontext()):
+        result, status = _invoke_api(api_name, arguments, env_data)
+    if READ_ONLY_GETS and not shared and api_name not in _mutating_gets:
+        # a sampled call: its copies kept the shared tables intact, check the label
+        changed = data.changed_from_base(reads)
+        if changed:
+            data.mark_dirty(changed)
+            _mutating_gets.add(api_name)
+            logger.warning("GET tool %r edited %s in place; running it copy-on-write from now on",
+                           api_name, sorted(changed))
+    if result is not None and not isinstance(result, (str, int, float, bool)):
+        result = clone_table(result)  # may hold shared rows; outcomes and the cache must not alias them
+    if key is not None and status == 200 and not reads & data.dirty:
+        result_cache.put(key, result, reads)
+    return result, status
+
+
+def _invoke_api(api_name: str, arguments: Dict[str, Any], env_data: Dict[str, Any]):
     api_name = api_name + "_invoke"
-    tools_class = create_tools_class(env_data["imports"], env_data["invoke_methods"])
+    tools_class = env_data.get("tools") or create_tools_class(
+        env_data["imports"], env_data["invoke_methods"]
+    )
 
     if not hasattr(tools_class, api_name):
         return {"error": f"API '{api_name}' not found"}, 404
@@ -149,3 +245,78 @@ def execute_api(api_name: str, arguments: Dict[str, Any], env_data: Dict[str, An
         return result if isinstance(result, dict) else json.loads(result), 200
     except Exception as e:
         return {"error": str(e)}, 500
+
+
+def result_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters for memoized GET tool results."""
+    return result_cache.stats()
+
+
+@contextlib.contextmanager
+def _memory_tracing():
+    """Keep tracemalloc running while at least one run needs it."""
+    global _tracing_runs, _tracing_owned
+    if not TRACE_MEMORY:
+        yield False
+        return
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing_runs += 1
+    try:
+        yield True
+    finally:
+        with _tracing_lock:
+            _tracing_runs -= 1
+            if _tracing_runs == 0 and _tracing_owned:
+                tracemalloc.stop()
+                _tracing_owned = False
+
+
+def run_actions(env_data: Dict[str, Any], actions: list,
+                profile: bool = False) -> Tuple[list, bool, Optional[bytes]]:
+    """Execute a task's actions in order.
+
+    Returns compact (status, result, timing) records, the overall success
+    flag and, with `profile=True`, a marshalled pstats blob for the run.
+    Peak memory (TASK_TRACE_MEMORY=1 only) is process-wide; actions that
+    overlapped another traced run are flagged `peak_kb_approx`.
+    """
+    outcomes, success = [], True
+    profiler = cProfile.Profile() if profile else None
+
+    with _memory_tracing() as tracing:
+        for act in actions:
+            if tracing:
+                tracemalloc.reset_peak()
+                mem_before = tracemalloc.get_traced_memory()[0]
+                overlapping = _tracing_runs > 1
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            if profiler:
+                profiler.enable()
+            try:
+                result, status = execute_api(act.get("name"), act.get("arguments", {}), env_data)
+            finally:
+                if profiler:
+                    profiler.disable()
+            timing = {
+                "wall_ms": round((time.perf_counter() - wall_start) * 1000, 3),
+                "cpu_ms": round((time.thread_time() - cpu_start) * 1000, 3),
+            }
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                timing["peak_kb"] = round(max(0, peak - mem_before) / 1024, 1)
+                if overlapping or _tracing_runs > 1:
+                    # other runs' allocations (and peak resets) landed in this window
+                    timing["peak_kb_approx"] = True
+
+            outcomes.append((status, result, timing))
+            if status != 200:
+                success = False
+
+    profile_blob = None
+    if profiler:
+        profiler.create_stats()
+        profile_blob = marshal.dumps(profiler.stats)  # same format as pstats dump_stats
+    return outcomes, success, profile_blob
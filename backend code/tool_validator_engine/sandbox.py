@@ -0,0 +1,337 @@
+import os
+import math
+import queue
+import signal
+import atexit
+import resource
+import threading
+import time
+import traceback
+import multiprocessing
+from typing import Dict, Tuple
+
+from .running_tasks import env_interface, run_actions, snapshot_env
+from .process_pool import START_METHOD
+
+# Per-action limits; a worker that blows through them is killed and replaced
+SANDBOX_CPU_SECONDS = float(os.getenv("SANDBOX_CPU_SECONDS", "10"))
+SANDBOX_WALL_SECONDS = float(os.getenv("SANDBOX_WALL_SECONDS", "30"))
+# Interpreter start + env parse of a fresh worker, kept out of the per-action budget
+SANDBOX_START_SECONDS = float(os.getenv("SANDBOX_START_SECONDS", "120"))
+SANDBOX_MAX_MEM_MB = int(os.getenv("SANDBOX_MAX_MEM_MB", "1024"))
+SANDBOX_MAX_RSS_MB = int(os.getenv("SANDBOX_MAX_RSS_MB", "2048"))
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_MAX_TASKS_PER_WORKER = int(os.getenv("SANDBOX_MAX_TASKS_PER_WORKER", "500"))
+# Env pools kept per app process; the least recently used one is shut down beyond this
+SANDBOX_MAX_POOLS = int(os.getenv("SANDBOX_MAX_POOLS", "4"))
+
+
+class ActionCpuLimitExceeded(BaseException):
+    """BaseException so a tool's own `except Exception` can't swallow it."""
+
+
+########################## WORKER SIDE #########################################
+
+def _rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _vm_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _on_sigxcpu(signum, frame):
+    raise ActionCpuLimitExceeded(f"Action exceeded CPU limit of {SANDBOX_CPU_SECONDS}s")
+
+
+def _set_cpu_soft_limit(soft):
+    # only the soft limit moves: an unprivileged process can't raise its hard limit back
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY and soft != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _arm_cpu_limit(seconds):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = usage.ru_utime + usage.ru_stime
+    # SIGXCPU fires once the budget is spent and raises inside the tool;
+    # loops stuck in C code are caught by the parent's wall-time limit
+    _set_cpu_soft_limit(math.ceil(used + seconds))
+
+
+def _worker_main(conn, env, interface, cpu_seconds, max_mem_mb):
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # allocation budget on top of what the worker maps once started
+    vm = _vm_bytes()
+    if vm is not None and max_mem_mb > 0:
+        limit = vm + max_mem_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, resource.RLIM_INFINITY))
+        except (ValueError, OSError):
+            pass
+
+    try:
+        env_interface(env, interface)  # warm: parse env + compile Tools once
+    except Exception:
+        pass  # the first reset reports the error
+    conn.send(("ready", None))
+
+    env_data = None
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        kind = msg[0]
+        try:
+            if kind == "reset":
+                env_data = snapshot_env(env_interface(env, interface))
+                conn.send(("ok", None))
+            elif kind == "action":
+                _arm_cpu_limit(cpu_seconds)
+                try:
+                    outcomes, _, _ = run_actions(env_data, [msg[1]])
+                finally:
+                    _set_cpu_soft_limit(resource.RLIM_INFINITY)
+                conn.send(("ok", outcomes[0]))
+            elif kind == "stop":
+                return
+        except ActionCpuLimitExceeded as e:
+            conn.send(("ok", (500, {"error": str(e)}, None)))
+        except MemoryError:
+            conn.send(("ok", (500, {"error": f"Action exceeded memory limit of {max_mem_mb}MB"}, None)))
+        except Exception as e:
+            conn.send(("error", {"error": str(e), "trace": traceback.format_exc()}))
+
+
+########################## PARENT SIDE #########################################
+
+class SandboxWorkerLost(Exception):
+    pass
+
+
+class _SandboxWorker:
+    def __init__(self, ctx, env, interface):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, env, interface, SANDBOX_CPU_SECONDS, SANDBOX_MAX_MEM_MB),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks_run = 0
+        self.ready = False
+        # taken after the first reset, so the parsed env counts as baseline, not growth
+        self.rss_baseline = None
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def _wait_ready(self):
+        """Wait out the worker's start-up before any per-request clock starts."""
+        try:
+            if self.conn.poll(SANDBOX_START_SECONDS):
+                self.conn.recv()
+                self.ready = True
+                return
+        except (EOFError, OSError):
+            raise SandboxWorkerLost("sandbox worker died while starting")
+        self.kill()
+        raise SandboxWorkerLost(f"sandbox worker did not start within {SANDBOX_START_SECONDS:g}s")
+
+    def request(self, message, timeout):
+        """Send a message and wait for the reply, enforcing wall time and RSS."""
+        if not self.ready:
+            self._wait_ready()
+        self.conn.send(message)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.conn.poll(min(0.05, remaining)):
+                try:
+                    return self.conn.recv()
+                except EOFError:
+                    raise SandboxWorkerLost("sandbox worker died")
+            if not self.alive():
+                raise SandboxWorkerLost("sandbox worker died (CPU or memory limit)")
+            if self.rss_baseline is not None and SANDBOX_MAX_RSS_MB:
+                if _rss_mb(self.process.pid) - self.rss_baseline > SANDBOX_MAX_RSS_MB:
+                    self.kill()
+                    raise SandboxWorkerLost(f"Action exceeded RSS limit of {SANDBOX_MAX_RSS_MB}MB")
+        self.kill()
+        raise SandboxWorkerLost(f"Action exceeded wall-time limit of {timeout}s")
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=1)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+            self.process.join(timeout=1)
+        except Exception:
+            pass
+        if self.alive():
+            self.kill()
+
+
+class SandboxPool:
+    """Warm, env-preloaded worker processes that run tool actions under limits.
+
+    This isolates resource usage (a runaway loop or allocation only takes
+    down its own worker, which is recycled); it is not a security boundary.
+    """
+
+    def __init__(self, env, interface, size=SANDBOX_WORKERS):
+        self.env = env
+        self.interface = str(interface)
+        self.size = max(1, size)
+        self._ctx = multiprocessing.get_context(START_METHOD)
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self.stats = {"spawned": 0, "recycled": 0, "killed": 0}
+        self._stats_lock = threading.Lock()
+        self._closed = False
+
+    def _spawn(self):
+        with self._stats_lock:
+            self.stats["spawned"] += 1
+        return _SandboxWorker(self._ctx, self.env, self.interface)
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            worker = self._idle.get_nowait()
+            if not worker.alive():
+                worker.kill()
+                worker = self._spawn()
+            return worker
+        except queue.Empty:
+            return self._spawn()
+
+    def _release(self, worker):
+        try:
+            if worker is None:
+                return
+            if self._closed:
+                worker.stop()  # pool was evicted while this worker was busy
+            elif worker.alive() and worker.tasks_run < SANDBOX_MAX_TASKS_PER_WORKER:
+                self._idle.put(worker)
+            else:
+                with self._stats_lock:
+                    self.stats["recycled"] += 1
+                worker.stop()
+        finally:
+            self._slots.release()
+
+    def _worker_lost(self, error, outcomes, unfinished):
+        """Fail the action the worker died on and skip the rest of `unfinished`."""
+        with self._stats_lock:
+            self.stats["killed"] += 1
+        for i, _ in enumerate(unfinished):
+            # the run's data snapshot died with the worker
+            outcomes.append((500, {"error": str(error) if i == 0 else "Skipped: sandbox worker was recycled"}, None))
+        return outcomes, False, None
+
+    def run_task_actions(self, actions):
+        """Run one task's actions on a single warm worker; same shape as run_actions."""
+        worker = self._acquire()
+        outcomes, success = [], True
+        try:
+            try:
+                status, payload = worker.request(("reset",), SANDBOX_WALL_SECONDS)
+            except SandboxWorkerLost as e:
+                worker = None
+                return self._worker_lost(e, outcomes, actions)
+            if status == "error":
+                raise RuntimeError(payload["error"])
+            if worker.rss_baseline is None:
+                worker.rss_baseline = _rss_mb(worker.process.pid)
+
+            for i, act in enumerate(actions):
+                try:
+                    status, payload = worker.request(("action", act), SANDBOX_WALL_SECONDS)
+                except SandboxWorkerLost as e:
+                    worker = None
+                    return self._worker_lost(e, outcomes, actions[i:])
+                if status == "error":
+                    outcomes.append((500, {"error": payload["error"]}, None))
+                    success = False
+                    continue
+                outcomes.append(payload)
+                if payload[0] != 200:
+                    success = False
+            worker.tasks_run += 1
+            return outcomes, success, None
+        finally:
+            self._release(worker)
+
+    def shutdown(self):
+        """Stop idle workers now; busy ones stop when their task finishes."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+# Insertion order doubles as recency: a used pool is moved to the end
+_pools: Dict[Tuple[str, str], SandboxPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_sandbox_pool(env, interface) -> SandboxPool:
+    key = (env, str(interface))
+    evicted = []
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+        if pool is None:
+            pool = SandboxPool(env, interface)
+            while len(_pools) >= max(1, SANDBOX_MAX_POOLS):
+                evicted.append(_pools.pop(next(iter(_pools))))
+        _pools[key] = pool
+    for old in evicted:
+        old.shutdown()
+    return pool
+
+
+def run_in_sandbox(task):
+    """Run a task document's actions in its env's sandbox pool."""
+    pool = get_sandbox_pool(task["env"], task["interface_num"])
+    return pool.run_task_actions(task.get("actions", []))
+
+
+def sandbox_stats():
+    with _pools_lock:
+        return [dict(p.stats, env=p.env, interface=p.interface, size=p.size) for p in _pools.values()]
+
+
+@atexit.register
+def shutdown_sandboxes():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
@@ -0,0 +1,95 @@
+import ast
+import textwrap
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+
+class TaskValidationError(ValueError):
+    """A task's actions don't match the env's tool signatures."""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("Invalid task: " + "; ".join(errors))
+        self.errors = errors
+
+
+def _literal_names(value: Any, container) -> Optional[FrozenSet[str]]:
+    """Names from a get_info() literal, or None when it wasn't written as one.
+
+    ast_to_python_value turns anything it can't evaluate (a variable, a
+    call, a ** spread) into a "<...>" placeholder string.
+    """
+    if not isinstance(value, container):
+        return None
+    names = list(value)
+    if any(not isinstance(n, str) or (n.startswith("<") and n.endswith(">")) for n in names):
+        return None
+    return frozenset(names)
+
+
+def _takes_kwargs(invoke_source: Optional[str]) -> bool:
+    """True if the tool's invoke() accepts **kwargs (so any argument name is fine)."""
+    if not invoke_source:
+        return False
+    try:
+        tree = ast.parse(textwrap.dedent(invoke_source))
+    except SyntaxError:
+        return False
+    func = next((n for n in tree.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))), None)
+    return func is not None and func.args.kwarg is not None
+
+
+class SignatureIndex:
+    """Tool name -> (accepted params, required params), from get_info().
+
+    Built once per env version by the registry, so checking a task is a
+    handful of set operations per action and never touches env data.
+    Either set is None when it can't be known statically (non-literal
+    get_info() parameters, or an invoke() taking **kwargs); that check is
+    then skipped rather than reporting false errors.
+    """
+
+    def __init__(self, functions_info: List[Dict[str, Any]], invoke_methods: Optional[List[str]] = None):
+        invoke_methods = invoke_methods or [None] * len(functions_info)
+        self._tools: Dict[str, Tuple[Optional[FrozenSet[str]], Optional[FrozenSet[str]]]] = {}
+        for f, invoke in zip(functions_info, invoke_methods):
+            if not f.get("name"):
+                continue
+            params = None if _takes_kwargs(invoke) else _literal_names(f.get("parameters") or {}, dict)
+            required = _literal_names(f.get("required") or [], (list, tuple))
+            self._tools[f["name"]] = (params, required)
+
+    def __contains__(self, name):
+        return name in self._tools
+
+    def __len__(self):
+        return len(self._tools)
+
+    def errors(self, actions: Any) -> List[str]:
+        """Every problem with `actions`; empty when the task can run."""
+        if not isinstance(actions, list):
+            return ["'actions' must be a list"]
+        errors = []
+        for i, act in enumerate(actions):
+            if not isinstance(act, dict) or not isinstance(act.get("name"), str):
+                errors.append(f"action {i}: must be an object with a 'name'")
+                continue
+            sig = self._tools.get(act["name"])
+            if sig is None:
+                errors.append(f"action {i}: unknown tool '{act['name']}'")
+                continue
+            args = act.get("arguments", {})
+            if not isinstance(args, dict):
+                errors.append(f"action {i} ({act['name']}): 'arguments' must be an object")
+                continue
+            params, required = sig
+            unknown = args.keys() - params if params is not None else ()
+            missing = required - args.keys() if required is not None else ()
+            if unknown:
+                errors.append(f"action {i} ({act['name']}): unknown arguments {sorted(unknown)}")
+            if missing:
+                errors.append(f"action {i} ({act['name']}): missing required arguments {sorted(missing)}")
+        return errors
+
+    def validate(self, actions: Any):
+        errors = self.errors(actions)
+        if errors:
+            raise TaskValidationError(errors)
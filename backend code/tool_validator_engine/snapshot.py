@@ -0,0 +1,127 @@
+import pickle
+import contextlib
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, Optional, Set
+
+from .indexed_table import IndexedTable
+
+
+def clone_table(table: Any) -> Any:
+    """Fast deep copy for JSON-shaped tables (much cheaper than copy.deepcopy)."""
+    return pickle.loads(pickle.dumps(table, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class DataSnapshot(MutableMapping):
+    """Copy-on-write view over an environment's loaded tables.
+
+    Inside `read_only()` (opted-in GET tools) lookups return the shared
+    table itself, or the run's own copy if it already has one, so reads
+    copy nothing.
+    Anywhere else a table is cloned into a private overlay the first time
+    it is looked up, since the caller may edit rows in place. The cached
+    env data is never mutated and tables only ever read cost nothing. Dict
+    tables come back as IndexedTable.
+
+    It also tracks which tables a tool call reads (`recording_reads`) and
+    which tables the run may have changed (`dirty`), for result memoization.
+    """
+
+    def __init__(self, base: Dict[str, Any]):
+        self._base = base
+        self._overlay: Dict[str, Any] = {}
+        self._deleted: Set[str] = set()
+        self._dirty: Set[str] = set()
+        self._reads: Optional[Set[str]] = None
+        self._read_only = False
+
+    def __getitem__(self, name):
+        if self._reads is not None:
+            self._reads.add(name)
+        if name in self._overlay:
+            return self._overlay[name]
+        if name in self._deleted or name not in self._base:
+            raise KeyError(name)
+        if self._read_only:
+            return self._base[name]
+        table = clone_table(self._base[name])
+        if type(table) is dict:
+            # dict-compatible, plus opt-in secondary indexes for tools
+            table = IndexedTable(table)
+        self._overlay[name] = table
+        return table
+
+    def __setitem__(self, name, table):
+        self._dirty.add(name)
+        self._deleted.discard(name)
+        self._overlay[name] = table
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._overlay.pop(name, None)
+        self._deleted.add(name)
+        self._dirty.add(name)
+
+    def __contains__(self, name):
+        if name in self._overlay:
+            return True
+        return name not in self._deleted and name in self._base
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self._overlay:
+            yield name
+        for name in self._base:
+            if name not in self._overlay and name not in self._deleted:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @property
+    def touched(self) -> Set[str]:
+        """Names of tables this snapshot has copied or replaced."""
+        return set(self._overlay) | self._deleted
+
+    @contextlib.contextmanager
+    def recording_reads(self):
+        """Collect the names of tables looked up inside the block."""
+        previous, self._reads = self._reads, set()
+        reads = self._reads
+        try:
+            yield reads
+        finally:
+            self._reads = previous
+            if previous is not None:
+                previous.update(reads)
+
+    @contextlib.contextmanager
+    def read_only(self):
+        """Hand out shared tables without copying inside the block.
+
+        Only for code that never mutates what it reads: an in-place edit
+        here changes the env data every later run sees.
+        """
+        previous, self._read_only = self._read_only, True
+        try:
+            yield self
+        finally:
+            self._read_only = previous
+
+    def changed_from_base(self, names) -> Set[str]:
+        """Of `names`, the tables whose private copy no longer equals the shared one."""
+        return {
+            n for n in names
+            if n in self._overlay and n not in self._dirty and n in self._base
+            and self._overlay[n] != self._base[n]
+        }
+
+    def mark_dirty(self, names):
+        """Flag tables as possibly modified (rows can be edited in place)."""
+        self._dirty.update(names)
+
+    @property
+    def dirty(self) -> Set[str]:
+        return self._dirty
+
+    def __repr__(self):
+        return f"DataSnapshot(tables={len(self)}, touched={sorted(self.touched)})"
@@ -0,0 +1,113 @@
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from .running_tasks import env_interface
+from .task_runner import db, oid, build_task_doc
+
+# Tasks per insert_many during an import
+IMPORT_BATCH_SIZE = 500
+# Per-line errors returned in full; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class _ImportBatch:
+    def __init__(self):
+        self.docs: List[Dict[str, Any]] = []
+        self.lines: List[int] = []
+
+
+def import_tasks_jsonl(user_id, lines: Iterable, batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, Any]:
+    """Create tasks from JSONL (one task per line), bulk-inserting valid lines.
+
+    Each line is `{"env", "interface_num", "actions", "title"?}`. A bad
+    line is reported with its 1-based number and skipped; it never aborts
+    the rest of the import.
+    """
+    result = {"lines": 0, "inserted": 0, "failed": 0, "errors": []}
+    signatures: Dict[tuple, Any] = {}  # (env, interface) -> SignatureIndex or load error
+    batch = _ImportBatch()
+
+    def fail(line_no, error):
+        result["failed"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line_no, "error": error})
+
+    def flush():
+        if not batch.docs:
+            return
+        try:
+            res = db.tasks.insert_many(batch.docs, ordered=False)
+            result["inserted"] += len(res.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details or {}
+            result["inserted"] += details.get("nInserted", 0)
+            for err in details.get("writeErrors", []):
+                fail(batch.lines[err["index"]], err.get("errmsg", "insert failed"))
+        batch.docs, batch.lines = [], []
+
+    for line_no, raw in enumerate(lines, start=1):
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", errors="replace")
+        if not raw.strip():
+            continue
+        result["lines"] += 1
+        try:
+            item = json.loads(raw)
+        except ValueError as e:
+            fail(line_no, f"invalid JSON: {e}")
+            continue
+        if not isinstance(item, dict):
+            fail(line_no, "line must be a JSON object")
+            continue
+
+        env = str(item.get("env") or "").strip()
+        interface_num = str(item.get("interface_num", "1"))
+        if not env:
+            fail(line_no, "Environment name is required")
+            continue
+
+        key = (env, interface_num)
+        if key not in signatures:
+            try:
+                signatures[key] = env_interface(env, interface_num)["signatures"]
+            except Exception as e:
+                signatures[key] = e
+        if isinstance(signatures[key], Exception):
+            fail(line_no, str(signatures[key]))
+            continue
+
+        errors = signatures[key].errors(item.get("actions", []))
+        if errors:
+            fail(line_no, "; ".join(errors))
+            continue
+
+        batch.docs.append(build_task_doc(user_id, env, interface_num, item.get("actions", []), item.get("title")))
+        batch.lines.append(line_no)
+        if len(batch.docs) >= batch_size:
+            flush()
+    flush()
+    return result
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def export_tasks_jsonl(user_id, env: str = None) -> Iterator[str]:
+    """Yield a user's tasks as JSONL lines in the shape `import_tasks_jsonl` reads."""
+    query = {"user_id": oid(user_id)}
+    if env:
+        query["env"] = env
+    projection = {"_id": 1, "env": 1, "interface_num": 1, "title": 1, "actions": 1, "created_at": 1}
+    cursor = db.tasks.find(query, projection).sort("created_at", 1).batch_size(IMPORT_BATCH_SIZE)
+    for task in cursor:
+        task["id"] = task.pop("_id")
+        yield json.dumps(task, default=_json_default) + "\n"
@@ -1,13 +1,27 @@
+import math
+import atexit
 import traceback
 from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from dotenv import load_dotenv
 import os
 
-from .running_tasks import env_interface, execute_api
+from .running_tasks import env_interface, run_actions, snapshot_env
+from .process_pool import run_tasks_in_processes, submit_task
+from .report_writer import ReportWriter
+from .sandbox import run_in_sandbox
+from .task_stats import TaskStats, rolling_histogram
+from . import replay as replay_mode
+from .signatures import TaskValidationError
+
+# "sandbox" (default) runs tool code in warm worker processes under CPU, memory
+# and wall-time limits; "process" sidesteps the GIL without limits; "thread"
+# runs tools in the app process itself with no limits at all
+DEFAULT_BACKEND = os.getenv("TASK_RUN_BACKEND", "sandbox")
 
 load_dotenv()
 mongo = MongoClient(os.getenv("MONGO_URI"))
@@ -17,15 +31,41 @@ db = mongo["docdiff"]
 db.tasks.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
 db.reports.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
 db.reports.create_index([("task_id", ASCENDING), ("created_at", DESCENDING)])
+# latest-run / per-task counters for the dashboard summaries
+db.reports.create_index([
+    ("user_id", ASCENDING), ("report_type", ASCENDING),
+    ("task_id", ASCENDING), ("created_at", DESCENDING),
+])
+db.task_goldens.create_index([("user_id", ASCENDING), ("task_id", ASCENDING)], unique=True)
 
 def oid(x): return ObjectId(str(x))
 def now(): return datetime.now(timezone.utc)
 
+# Latest status / counters per task, updated as each run is stored
+task_stats = TaskStats(db.task_stats, db.reports, db.task_stats_backfills)
+
+
+def _count_stored_runs(docs):
+    """ReportWriter callback: fold runs into task_stats once their insert is confirmed."""
+    for doc in docs:
+        if doc.get("report_type") == "task_run":
+            task_stats.record_run(doc)
+
+
+# Task run reports are buffered and bulk-inserted; flushed on shutdown
+report_writer = ReportWriter(db.reports, on_stored=_count_stored_runs)
+atexit.register(report_writer.close)
+
+
+def flush_reports():
+    """Force buffered task run reports into Mongo (e.g. before reading them back)."""
+    return report_writer.flush()
+
 
 # ----------------------------- CRUD ----------------------------- #
 
-def create_task(user_id, env, interface_num, actions, title=None):
-    task = {
+def build_task_doc(user_id, env, interface_num, actions, title=None):
+    return {
         "user_id": oid(user_id),
         "env": env,
         "interface_num": str(interface_num),
@@ -33,6 +73,16 @@ def create_task(user_id, env, interface_num, actions, title=None):
         "title": title or f"Task - {datetime.utcnow().isoformat()}",
         "created_at": now(),
     }
+
+
+def validate_task(env, interface_num, actions):
+    """Reject actions naming unknown tools or wrong kwargs (raises TaskValidationError)."""
+    env_interface(env, str(interface_num))["signatures"].validate(actions)
+
+
+def create_task(user_id, env, interface_num, actions, title=None):
+    validate_task(env, interface_num, actions or [])
+    task = build_task_doc(user_id, env, interface_num, actions, title)
     res = db.tasks.insert_one(task)
     task["_id"] = str(res.inserted_id)
     task["user_id"] = str(user_id)
@@ -72,13 +122,16 @@ def get_task(user_id, task_id):
 def delete_task(user_id, task_id):
     get_task(user_id, task_id)  # raises on error
     db.tasks.delete_one({"_id": oid(task_id)})
+    task_stats.forget_task(oid(user_id), oid(task_id))
+    db.task_goldens.delete_one({"user_id": oid(user_id), "task_id": oid(task_id)})
     return True
 
 
 # ----------------------------- EXECUTION ----------------------------- #
 
-def _write_report(user_id, task_id, title, results, status):
+def _write_report(user_id, task_id, title, results, status, flush=True, profile_blob=None):
     doc = {
+        "_id": ObjectId(),
         "user_id": oid(user_id),
         "task_id": oid(task_id),
         "title": title,
@@ -87,7 +140,17 @@ def _write_report(user_id, task_id, title, results, status):
         "report_type": "task_run",
         "created_at": now(),
     }
-    db.reports.insert_one(doc)
+    if profile_blob:
+        # pstats blobs are kept out of the report so report JSON stays serializable
+        profile = db.task_profiles.insert_one({
+            "report_id": doc["_id"],
+            "user_id": doc["user_id"],
+            "task_id": doc["task_id"],
+            "pstats": profile_blob,
+            "created_at": doc["created_at"],
+        })
+        doc["profile_id"] = profile.inserted_id
+    report_writer.write(doc, flush=flush)  # task_stats counts it once stored
     doc["_id"] = str(doc["_id"])
     # normalize for client convenience (taskdetails.jsx expects top-level actions)
     return _normalize_report_for_client(doc)
@@ -103,6 +166,8 @@ def _normalize_report_for_client(report_doc):
         "task_id": str(report_doc.get("task_id")) if report_doc.get("task_id") else None,
         "actions": [],
     }
+    if report_doc.get("profile_id"):
+        doc["profile_id"] = str(report_doc["profile_id"])
     results = (report_doc.get("results") or {})
     actions = results.get("actions") or []
     # pass-through if error payload exists
@@ -116,65 +181,201 @@ def _normalize_report_for_client(report_doc):
             "name": a.get("api_name"),
             "arguments": a.get("args"),
             "output": a.get("result") if a.get("status") == 200 else None,
-            "error": None if a.get("status") == 200 else (a.get("result") or {}).get("error"),
+            "error": None if a.get("status") == 200 else (a.get("error") or (a.get("result") or {}).get("error")),
             "traceback": None,  # we only store in report-level trace on fatal
             "success": bool(a.get("success")),
+            "timing": a.get("timing"),
         })
+    if results.get("timing"):
+        doc["timing"] = results["timing"]
+    if results.get("mode") == "replay":
+        doc["replay"] = {
+            "golden_id": str(results["golden_id"]) if results.get("golden_id") else None,
+            "golden_created": results.get("golden_created", False),
+            "action_count": results.get("action_count"),
+            "changed": results.get("changed", []),
+            "diffs": results.get("diffs", {}),
+        }
     return doc
 
 
-def run_task(user_id, task_id):
-    """Run a single task."""
+def _actions_result(actions, outcomes, with_results=True):
+    """Expand compact (status, result, timing) records into the stored action shape.
+
+    Replay reports pass with_results=False: outputs are replaced by the
+    golden diffs, and failed actions keep only their error message.
+    """
+    actions_result = []
+    for i, (act, (status, result, timing)) in enumerate(zip(actions, outcomes)):
+        row = {
+            "index": i,
+            "api_name": act.get("name"),
+            "args": act.get("arguments", {}),
+            "status": status,
+            "success": status == 200,
+            "timing": timing,
+        }
+        if with_results:
+            row["result"] = result
+        elif status != 200 and isinstance(result, dict):
+            row["error"] = result.get("error")
+        actions_result.append(row)
+    return actions_result
+
+
+def _run_timing(outcomes):
+    # actions killed in the sandbox have no timing
+    timings = [t for _, _, t in outcomes if t]
+    run_timing = {
+        "wall_ms": round(sum(t["wall_ms"] for t in timings), 3),
+        "cpu_ms": round(sum(t["cpu_ms"] for t in timings), 3),
+    }
+    if any("peak_kb" in t for t in timings):  # memory tracing is opt-in
+        run_timing["peak_kb"] = max(t.get("peak_kb", 0) for t in timings)
+        if any(t.get("peak_kb_approx") for t in timings):
+            run_timing["peak_kb_approx"] = True
+    return run_timing
+
+
+def _write_run_report(user_id, task, outcomes, success, flush=True, profile_blob=None, replay=False):
+    actions = task.get("actions", [])
+    if replay:
+        results, success = _replay_results(user_id, task, outcomes, success)
+    else:
+        results = {"actions": _actions_result(actions, outcomes), "timing": _run_timing(outcomes)}
+    return _write_report(
+        user_id,
+        str(task["_id"]),
+        f"Run - {task.get('title')}",
+        results,
+        "passed" if success else "failed",
+        flush=flush,
+        profile_blob=profile_blob,
+    )
+
+
+# ----------------------------- REPLAY ----------------------------- #
+
+def _replay_results(user_id, task, outcomes, success):
+    """Compare a run against the task's golden outputs (recording one if needed).
+
+    Goldens are only recorded from successful runs. Per-action names,
+    statuses and timings are kept; outputs are replaced by the changed
+    action indices and their diffs. The run passes when it succeeds and
+    every action's output hash matches the golden.
+    """
+    key = {"user_id": oid(user_id), "task_id": oid(task["_id"])}
+    actions = task.get("actions", [])
+    digest = replay_mode.actions_digest(actions)
+
+    def usable(golden):
+        # goldens from before the success flag may have been recorded from failing runs
+        return golden is not None and golden.get("success") is True and golden.get("actions_hash") == digest
+
+    golden = db.task_goldens.find_one(key)
+    created = False
+    if not usable(golden) and success:
+        # first replay (or the task was edited): this successful run becomes the golden
+        candidate = dict(key, **replay_mode.make_golden(actions, outcomes), success=True, created_at=now())
+        try:
+            candidate["_id"] = db.task_goldens.find_one_and_replace(
+                key, candidate, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 1},
+            )["_id"]
+            golden, created = candidate, True
+        except DuplicateKeyError:
+            # a concurrent first replay inserted its golden first: compare against that
+            golden = db.task_goldens.find_one(key)
+
+    if created:
+        changed, diffs = [], {}
+    elif usable(golden):
+        changed, diffs = replay_mode.compare(golden, outcomes)
+        success = success and not changed
+    else:
+        # nothing trustworthy to compare against, and a failing run can't become one
+        golden, changed, diffs = None, [], {}
+
+    return {
+        "mode": "replay",
+        "golden_id": golden["_id"] if golden else None,
+        "golden_created": created,
+        "action_count": len(outcomes),
+        "actions": _actions_result(actions, outcomes, with_results=False),
+        "changed": changed,
+        "diffs": diffs,
+        "timing": _run_timing(outcomes),
+    }, success
+
+
+def reset_golden(user_id, task_id):
+    """Forget a task's golden outputs; the next replay run records new ones."""
+    get_task(user_id, task_id)  # raises on error
+    res = db.task_goldens.delete_one({"user_id": oid(user_id), "task_id": oid(task_id)})
+    return res.deleted_count > 0
+
+
+def _write_error_report(user_id, task_id, error, trace, flush=True):
+    return _write_report(
+        user_id,
+        task_id,
+        f"Run - (Error)",
+        {"error": error, "trace": trace},
+        "failed",
+        flush=flush,
+    )
+
+
+def run_task(user_id, task_id, backend=None, flush=True, profile=False, replay=False):
+    """Run a single task.
+
+    With flush=False the report is left in the write buffer (batch runs);
+    profile=True also stores a cProfile pstats blob for the run and
+    replay=True stores only the differences from the task's golden outputs.
+    """
+    # cProfile needs the tools in this process: an unspecified backend profiles on a thread
+    backend = backend or ("thread" if profile else DEFAULT_BACKEND)
     try:
         task = get_task(user_id, task_id)
-        env_data = env_interface(task["env"], task["interface_num"])
-        actions_result, success = [], True
-
-        for i, act in enumerate(task.get("actions", [])):
-            api_name, args = act.get("name"), act.get("arguments", {})
-            result, status = execute_api(api_name, args, env_data)
-            actions_result.append({
-                "index": i,
-                "api_name": api_name,
-                "args": args,
-                "result": result,
-                "status": status,
-                "success": status == 200,
-            })
-            if status != 200:
-                success = False
-
-        title = f"Run - {task.get('title')}"
-        return _write_report(
-            user_id,
-            task_id,
-            title,
-            {"actions": actions_result},
-            "passed" if success else "failed",
-        )
-
+        # fail before any action has touched data
+        validate_task(task["env"], task["interface_num"], task.get("actions", []))
+        if backend == "process":
+            _, outcomes, success, error, profile_blob = submit_task(task, profile=profile).result()
+            if error:
+                return _write_error_report(user_id, task_id, error["error"], error["trace"], flush=flush)
+            return _write_run_report(user_id, task, outcomes, success, flush=flush,
+                                     profile_blob=profile_blob, replay=replay)
+
+        if backend == "sandbox":
+            # per-action CPU/memory/wall limits; profiling isn't available here
+            outcomes, success, _ = run_in_sandbox(task)
+            return _write_run_report(user_id, task, outcomes, success, flush=flush, replay=replay)
+
+        # isolated overlay: writes never leak into the cached env or other runs
+        env_data = snapshot_env(env_interface(task["env"], task["interface_num"]))
+        outcomes, success, profile_blob = run_actions(env_data, task.get("actions", []), profile=profile)
+        return _write_run_report(user_id, task, outcomes, success, flush=flush,
+                                 profile_blob=profile_blob, replay=replay)
+
+    except TaskValidationError as e:
+        return _write_error_report(user_id, task_id, str(e), "", flush=flush)
     except Exception as e:
-        trace = traceback.format_exc()
-        return _write_report(
-            user_id,
-            task_id,
-            f"Run - (Error)",
-            {"error": str(e), "trace": trace},
-            "failed",
-        )
-
-
-def run_all_tasks(user_id, max_workers=4):
-    """Run all tasks for a user in parallel (thread pool)."""
+        return _write_error_report(user_id, task_id, str(e), traceback.format_exc(), flush=flush)
+
+
+def run_all_tasks(user_id, max_workers=None, backend=None, replay=False):
+    """Run all tasks for a user in parallel (thread, process or sandbox pool)."""
     tasks = list(db.tasks.find({"user_id": oid(user_id)}))
     if not tasks:
         return []
 
+    if (backend or DEFAULT_BACKEND) == "process":
+        return _run_all_in_processes(user_id, tasks, max_workers, replay=replay)
+
     workers = max(1, min(int(max_workers or 4), 16, len(tasks)))
     reports = []
 
     with ThreadPoolExecutor(max_workers=workers) as ex:
-        futures = {ex.submit(run_task, user_id, str(t["_id"])): str(t["_id"]) for t in tasks}
+        futures = {ex.submit(run_task, user_id, str(t["_id"]), backend=backend, flush=False, replay=replay): str(t["_id"]) for t in tasks}
         for fut in as_completed(futures):
             try:
                 reports.append(fut.result())
@@ -182,6 +383,31 @@ def run_all_tasks(user_id, max_workers=4):
                 # unlikely thanks to run_task wrapping, but keep a guard
                 reports.append({"status": "failed", "error": str(e)})
 
+    flush_reports()
+    return reports
+
+
+def _run_all_in_processes(user_id, tasks, max_workers=None, replay=False):
+    """Execute tasks in the shared worker process pool; reports are written here."""
+    reports, runnable = [], []
+    for t in tasks:
+        try:
+            validate_task(t["env"], t["interface_num"], t.get("actions", []))
+            runnable.append(t)
+        except Exception as e:
+            reports.append(_write_error_report(user_id, str(t["_id"]), str(e), "", flush=False))
+    tasks = runnable
+    by_id = {str(t["_id"]): t for t in tasks}
+    for task_id, outcomes, success, error, _ in run_tasks_in_processes(tasks, max_workers):
+        try:
+            if error:
+                reports.append(_write_error_report(user_id, task_id, error["error"], error["trace"], flush=False))
+            else:
+                reports.append(_write_run_report(user_id, by_id[task_id], outcomes, success,
+                                                 flush=False, replay=replay))
+        except Exception as e:
+            reports.append({"status": "failed", "error": str(e)})
+    flush_reports()
     return reports
 
 
@@ -194,6 +420,14 @@ def get_report(user_id, report_id):
     return _normalize_report_for_client(r)
 
 
+def get_profile(user_id, report_id):
+    """Return the raw pstats blob stored for a profiled run."""
+    p = db.task_profiles.find_one({"report_id": oid(report_id), "user_id": oid(user_id)})
+    if not p:
+        raise FileNotFoundError("Profile not found")
+    return bytes(p["pstats"])
+
+
 def delete_report(user_id, report_id):
     r = db.reports.find_one({"_id": oid(report_id)})
     if not r:
@@ -201,22 +435,34 @@ def delete_report(user_id, report_id):
     if str(r["user_id"]) != str(user_id):
         raise PermissionError("Forbidden")
     db.reports.delete_one({"_id": oid(report_id)})
+    forget_task_run(r)
     return True
 
 
 # ----------------------------- SUMMARY ----------------------------- #
 
 def summary_for_user(user_id, limit=50):
-    total_tasks = db.tasks.count_documents({"user_id": oid(user_id)})
+    """Pass/fail counters over the user's latest `limit` runs, plus the 10 most recent."""
+    uid = oid(user_id)
+    total_tasks = db.tasks.count_documents({"user_id": uid})
 
     pipeline = [
-        {"$match": {"user_id": oid(user_id), "report_type": "task_run"}},
+        {"$match": {"user_id": uid, "report_type": "task_run"}},
         {"$sort": {"created_at": -1}},
         {"$limit": int(limit or 50)},
+        {"$project": {"title": 1, "status": 1, "created_at": 1, "task_id": 1}},
+        {"$facet": {
+            "counts": [{"$group": {
+                "_id": None,
+                "passed": _status_count("passed"),
+                "failed": _status_count("failed"),
+            }}],
+            "recent": [{"$limit": 10}],
+        }},
     ]
-    reports = list(db.reports.aggregate(pipeline))
-    passed = sum(1 for r in reports if r.get("status") == "passed")
-    failed = sum(1 for r in reports if r.get("status") == "failed")
+    result = next(db.reports.aggregate(pipeline), {"counts": [], "recent": []})
+    counts = result["counts"][0] if result["counts"] else {"passed": 0, "failed": 0}
+    passed, failed = counts["passed"], counts["failed"]
     total_runs = passed + failed
     pass_rate = round((passed / total_runs * 100), 1) if total_runs else 0.0
 
@@ -232,5 +478,198 @@ def summary_for_user(user_id, limit=50):
             "status": r.get("status"),
             "created_at": r.get("created_at"),
             "task_id": str(r.get("task_id")) if r.get("task_id") else None,
-        } for r in reports[:10]],
+        } for r in result["recent"]],
+    }
+
+
+def _status_count(status):
+    return {"$sum": {"$cond": [{"$eq": ["$status", status]}, 1, 0]}}
+
+
+def _pass_rate(passed, failed):
+    """Percentage rounded to 0.1, computed in the pipeline."""
+    total = {"$add": [passed, failed]}
+    return {"$cond": [
+        {"$gt": [total, 0]},
+        {"$round": [{"$multiply": [{"$divide": [passed, total]}, 100]}, 1]},
+        0.0,
+    ]}
+
+
+def task_summary(user_id):
+    """Every task with its latest run status and run counters, from task_stats.
+
+    Tasks that were never run show up as "not_run". The cost depends on
+    the number of tasks only, never on how many runs they have.
+    """
+    uid = oid(user_id)
+    task_stats.ensure_user(uid)
+    pipeline = [
+        {"$match": {"user_id": uid}},
+        {"$project": {"title": 1, "created_at": 1}},
+        {"$lookup": {
+            "from": "task_stats",
+            "localField": "_id",
+            "foreignField": "task_id",
+            "pipeline": [
+                {"$match": {"user_id": uid}},
+                {"$project": {"recent_ms": 0}},
+            ],
+            "as": "stats",
+        }},
+        {"$set": {"stats": {"$first": "$stats"}}},
+        {"$project": {
+            "_id": 0,
+            "id": {"$toString": "$_id"},
+            "task_id": {"$toString": "$_id"},
+            "title": {"$ifNull": ["$title", {"$concat": [
+                "Task ", {"$substrCP": [{"$toString": "$_id"}, 0, 6]},
+            ]}]},
+            "status": {"$cond": [
+                {"$ifNull": ["$stats.latest_at", False]},
+                {"$toLower": {"$ifNull": ["$stats.latest_status", "unknown"]}},
+                "not_run",
+            ]},
+            "created_at": {"$ifNull": ["$stats.latest_at", "$created_at"]},
+            "error": {"$ifNull": ["$stats.latest_error", ""]},
+            "runs": {"$ifNull": ["$stats.runs", 0]},
+            "passed": {"$ifNull": ["$stats.passed", 0]},
+            "failed": {"$ifNull": ["$stats.failed", 0]},
+            "duration_hist": {"$ifNull": ["$stats.duration_hist", {}]},
+            "avg_ms": {"$cond": [
+                {"$gt": [{"$ifNull": ["$stats.timed_runs", 0]}, 0]},
+                {"$round": [{"$divide": ["$stats.total_ms", "$stats.timed_runs"]}, 3]},
+                None,
+            ]},
+        }},
+        {"$set": {"pass_rate": _pass_rate("$passed", "$failed")}},
+        {"$facet": {
+            "recent_runs": [{"$sort": {"created_at": -1}}],
+            "totals": [{"$group": {
+                "_id": None,
+                "total_tasks": {"$sum": 1},
+                "passed": _status_count("passed"),
+                "failed": _status_count("failed"),
+            }}],
+        }},
+    ]
+    result = next(db.tasks.aggregate(pipeline), {"recent_runs": [], "totals": []})
+    totals = result["totals"][0] if result["totals"] else {"total_tasks": 0, "passed": 0, "failed": 0}
+    decided = totals["passed"] + totals["failed"]
+    pass_rate = round(totals["passed"] / decided * 100, 1) if decided else 0.0
+
+    return {
+        "total_tasks": totals["total_tasks"],
+        "passed": totals["passed"],
+        "failed": totals["failed"],
+        # anything without a passed/failed latest run
+        "not_run": totals["total_tasks"] - decided,
+        "pass_rate": f"{pass_rate}%",
+        "recent_runs": result["recent_runs"],
     }
+
+
+def task_stats_for(user_id, task_id):
+    """Counters, latest run and rolling duration histogram for one task."""
+    uid = oid(user_id)
+    task_stats.ensure_user(uid)
+    stats = db.task_stats.find_one({"user_id": uid, "task_id": oid(task_id)}, {"_id": 0})
+    if not stats:
+        return None
+    stats["rolling_duration_hist"] = rolling_histogram(stats.pop("recent_ms", []))
+    return stats
+
+
+def forget_task_run(report):
+    """Keep task_stats in line when a task_run report is deleted elsewhere."""
+    if report.get("report_type") == "task_run" and report.get("task_id"):
+        task_stats.forget_run(report)
+
+
+def rebuild_task_stats(user_id):
+    """Recount a user's task_stats from their stored runs; returns the number of tasks."""
+    flush_reports()
+    return task_stats.rebuild(oid(user_id))
+
+
+def task_results(user_id, task_id, limit=50):
+    """The task's latest `limit` reports with pass/fail counters over them.
+
+    Counters over every run, from task_stats, are under summary["all_runs"].
+    The per-action payload stays in Mongo (fetch a single report for it);
+    each listed run carries its action count instead.
+    """
+    pipeline = [
+        {"$match": {"user_id": oid(user_id), "report_type": "task_run", "task_id": oid(task_id)}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": int(limit or 50)},
+        {"$set": {"action_count": {"$size": {"$ifNull": ["$results.actions", []]}}}},
+        {"$project": {"results.actions": 0}},
+    ]
+    results = list(db.reports.aggregate(pipeline))
+    passed = sum(1 for r in results if r.get("status") == "passed")
+    failed = sum(1 for r in results if r.get("status") == "failed")
+
+    stats = task_stats_for(user_id, task_id) or {}
+    all_passed, all_failed = stats.get("passed", 0), stats.get("failed", 0)
+    summary = dict(_run_counts(passed, failed), all_runs=dict(
+        _run_counts(all_passed, all_failed),
+        duration_hist=stats.get("duration_hist", {}),
+        rolling_duration_hist=stats.get("rolling_duration_hist", {}),
+    ))
+    return {"summary": summary, "results": results}
+
+
+def _run_counts(passed, failed):
+    total_runs = passed + failed
+    return {
+        "total_runs": total_runs,
+        "passed": passed,
+        "failed": failed,
+        "pass_rate": f"{round(passed / total_runs * 100, 1) if total_runs else 0.0}%",
+    }
+
+
+def _percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def tool_timing_stats(user_id, task_id=None, limit=200):
+    """p50/p95 wall and CPU time per tool over the latest `limit` runs."""
+    match = {"user_id": oid(user_id), "report_type": "task_run"}
+    if task_id:
+        match["task_id"] = oid(task_id)
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": -1}},
+        {"$limit": int(limit or 200)},
+        {"$project": {"actions": "$results.actions"}},
+        {"$unwind": "$actions"},
+        {"$match": {"actions.timing": {"$type": "object"}}},
+        {"$group": {
+            "_id": "$actions.api_name",
+            "wall": {"$push": "$actions.timing.wall_ms"},
+            "cpu": {"$push": "$actions.timing.cpu_ms"},
+            "peak_kb": {"$max": "$actions.timing.peak_kb"},
+            "peak_kb_approx": {"$max": "$actions.timing.peak_kb_approx"},
+            "failures": {"$sum": {"$cond": [{"$eq": ["$actions.success", True]}, 0, 1]}},
+        }},
+    ]
+    stats = {}
+    for row in db.reports.aggregate(pipeline):
+        wall, cpu = sorted(row["wall"]), sorted(row["cpu"])
+        stats[row["_id"]] = {
+            "calls": len(wall),
+            "failures": row["failures"],
+            "wall_p50_ms": _percentile(wall, 50),
+            "wall_p95_ms": _percentile(wall, 95),
+            "cpu_p50_ms": _percentile(cpu, 50),
+            "cpu_p95_ms": _percentile(cpu, 95),
+            "peak_kb_max": row.get("peak_kb"),
+            "peak_kb_approx": bool(row.get("peak_kb_approx")),
+        }
+    return stats
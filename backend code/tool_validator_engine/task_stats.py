@@ -0,0 +1,258 @@
+import os
+import time
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from .report_writer import REPORT_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the run duration histogram buckets; the last bucket is open
+DURATION_BUCKETS_MS = (10, 50, 100, 500, 1000, 5000, 30000)
+# How many recent run durations each task keeps for the rolling histogram
+DURATION_WINDOW = int(os.getenv("TASK_STATS_DURATION_WINDOW", "50"))
+# How long a run waits for another process's backfill of the same user
+BACKFILL_WAIT_SECONDS = float(os.getenv("TASK_STATS_BACKFILL_WAIT", "30"))
+
+
+def duration_bucket(ms: float) -> str:
+    for bound in DURATION_BUCKETS_MS:
+        if ms <= bound:
+            return f"le_{bound}"
+    return f"gt_{DURATION_BUCKETS_MS[-1]}"
+
+
+def rolling_histogram(recent_ms) -> dict:
+    hist = {}
+    for ms in recent_ms or []:
+        label = duration_bucket(ms)
+        hist[label] = hist.get(label, 0) + 1
+    return hist
+
+
+def _utc(dt):
+    # Mongo hands datetimes back naive (in UTC)
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+
+def _stored_time(dt=None):
+    """A UTC datetime at the millisecond precision Mongo stores, so cutoffs compare exactly."""
+    dt = _utc(dt) if dt is not None else datetime.now(timezone.utc)
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
+
+
+def _run_fields(report):
+    """Status, duration and error of one stored task_run report."""
+    results = report.get("results") or {}
+    return (
+        report.get("status"),
+        (results.get("timing") or {}).get("wall_ms"),
+        results.get("error") or "",
+    )
+
+
+class TaskStats:
+    """Per-task run counters kept next to the reports they summarize.
+
+    One document per (user_id, task_id) holds the latest run's status,
+    running pass/fail counters, a cumulative duration histogram and the
+    last DURATION_WINDOW durations (for a rolling histogram). Every stored
+    run folds in with one atomic update; reading a summary never touches
+    the run history.
+
+    Each user is backfilled from their stored reports once, before their
+    first run is counted. The `backfills` marker records a cutoff: runs
+    created before it are counted by the backfill, later ones by
+    record_run, so no run is counted twice or missed.
+
+    Ordering: record_run is called once the ReportWriter has confirmed a
+    report's insert, so counters never include runs that weren't stored
+    and lag the buffer by up to REPORT_FLUSH_INTERVAL; the backfill waits
+    that long before counting so buffered runs from before its cutoff
+    have landed.
+    """
+
+    def __init__(self, collection, reports, backfills):
+        self.collection = collection
+        self.reports = reports
+        self.backfills = backfills
+        self.collection.create_index(
+            [("user_id", ASCENDING), ("task_id", ASCENDING)], unique=True
+        )
+        self.backfills.create_index([("user_id", ASCENDING)], unique=True)
+        # user_id -> cutoff of a finished backfill (this process)
+        self._cutoffs = {}
+
+    def record_run(self, report):
+        """Fold a task_run report (as written) into its task's counters."""
+        try:
+            cutoff = self.ensure_user(report["user_id"])
+            if cutoff is not None and _stored_time(report["created_at"]) < cutoff:
+                return  # the backfill counted it
+            self.collection.update_one(
+                {"user_id": report["user_id"], "task_id": report["task_id"]},
+                self._fold(report), upsert=True,
+            )
+        except Exception:
+            # the report itself is still stored; POST /tasks/stats/rebuild
+            # (rebuild()) recounts the user's counters from the reports
+            logger.exception("Failed to update task_stats for task %s of user %s; "
+                             "counters are behind until rebuilt", report["task_id"], report["user_id"])
+
+    @staticmethod
+    def _fold(report):
+        """Update pipeline adding one run: counters and latest in a single write."""
+        status, duration, error = _run_fields(report)
+        created = report["created_at"]
+
+        def plus(field, n):
+            return {"$add": [{"$ifNull": [f"${field}", 0]}, n]}
+
+        fields = {
+            "runs": plus("runs", 1),
+            "passed": plus("passed", int(status == "passed")),
+            "failed": plus("failed", int(status == "failed")),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        if duration is not None:
+            label = f"duration_hist.{duration_bucket(duration)}"
+            fields.update({
+                label: plus(label, 1),
+                "timed_runs": plus("timed_runs", 1),
+                "total_ms": plus("total_ms", duration),
+                "recent_ms": {"$slice": [
+                    {"$concatArrays": [{"$ifNull": ["$recent_ms", []]}, [duration]]},
+                    -DURATION_WINDOW,
+                ]},
+            })
+        # runs finishing out of order never replace a newer latest
+        newer = {"$gt": ["$latest_at", created]}
+        for field, value in (("latest_status", status), ("latest_report_id", report["_id"]),
+                             ("latest_at", created), ("latest_error", error)):
+            fields[field] = {"$cond": [newer, f"${field}", {"$literal": value}]}
+        return [{"$set": fields}]
+
+    def forget_run(self, report):
+        """Undo a deleted run's counters (durations are left in the histogram)."""
+        status, _, _ = _run_fields(report)
+        key = {"user_id": report["user_id"], "task_id": report["task_id"]}
+        self.collection.update_one(key, {"$inc": {
+            "runs": -1, "passed": -int(status == "passed"), "failed": -int(status == "failed"),
+        }})
+        current = self.collection.find_one(key, {"latest_report_id": 1})
+        if current and current.get("latest_report_id") == report["_id"]:
+            self._refresh_latest(key)
+
+    def forget_task(self, user_id, task_id):
+        self.collection.delete_one({"user_id": user_id, "task_id": task_id})
+
+    def _refresh_latest(self, key):
+        prev = self.reports.find_one(
+            dict(key, report_type="task_run"),
+            {"status": 1, "created_at": 1, "results.error": 1},
+            sort=[("created_at", -1)],
+        )
+        if prev is None:
+            self.collection.update_one(key, {"$unset": {
+                "latest_status": "", "latest_report_id": "", "latest_at": "", "latest_error": "",
+            }})
+            return
+        status, _, error = _run_fields(prev)
+        self.collection.update_one(key, {"$set": {
+            "latest_status": status,
+            "latest_report_id": prev["_id"],
+            "latest_at": prev["created_at"],
+            "latest_error": error,
+        }})
+
+    def rebuild(self, user_id):
+        """Recompute a user's stats from their stored runs (repair).
+
+        Processes that already finished this user's backfill keep counting
+        runs meanwhile, so repair while none of the user's runs are in flight.
+        """
+        cutoff = _stored_time()
+        self.backfills.update_one(
+            {"user_id": user_id},
+            {"$set": {"state": "running", "cutoff": cutoff, "started_at": cutoff}},
+            upsert=True,
+        )
+        self._cutoffs.pop(user_id, None)
+        return self._backfill(user_id, cutoff)
+
+    def _backfill(self, user_id, cutoff):
+        # runs created before the cutoff may still sit in a ReportWriter buffer
+        time.sleep(REPORT_FLUSH_INTERVAL + 0.5)
+        stats = {}
+        cursor = self.reports.find(
+            {"user_id": user_id, "report_type": "task_run", "created_at": {"$lt": cutoff}},
+            {"task_id": 1, "status": 1, "created_at": 1, "results.error": 1, "results.timing": 1},
+        ).sort("created_at", ASCENDING)
+        for report in cursor:
+            status, duration, error = _run_fields(report)
+            s = stats.setdefault(report["task_id"], {
+                "user_id": user_id, "task_id": report["task_id"],
+                "runs": 0, "passed": 0, "failed": 0,
+                "duration_hist": {}, "timed_runs": 0, "total_ms": 0.0, "recent_ms": [],
+            })
+            s["runs"] += 1
+            s["passed"] += int(status == "passed")
+            s["failed"] += int(status == "failed")
+            if duration is not None:
+                label = duration_bucket(duration)
+                s["duration_hist"][label] = s["duration_hist"].get(label, 0) + 1
+                s["timed_runs"] += 1
+                s["total_ms"] += duration
+                s["recent_ms"] = (s["recent_ms"] + [duration])[-DURATION_WINDOW:]
+            s.update(latest_status=status, latest_report_id=report["_id"],
+                     latest_at=report["created_at"], latest_error=error)
+
+        # nobody folds in runs while the marker says "running", so replacing is safe
+        now = datetime.now(timezone.utc)
+        self.collection.delete_many({"user_id": user_id, "task_id": {"$nin": list(stats)}})
+        if stats:
+            self.collection.bulk_write([
+                ReplaceOne({"user_id": user_id, "task_id": tid}, dict(s, updated_at=now), upsert=True)
+                for tid, s in stats.items()
+            ], ordered=False)
+        self.backfills.update_one({"user_id": user_id}, {"$set": {"state": "done", "finished_at": now}})
+        self._cutoffs[user_id] = cutoff
+        return len(stats)
+
+    def ensure_user(self, user_id):
+        """Backfill the user once (waiting if another process is at it); returns the cutoff."""
+        cutoff = self._cutoffs.get(user_id)
+        if cutoff is not None:
+            return cutoff
+
+        now = _stored_time()
+        try:
+            self.backfills.insert_one({"user_id": user_id, "state": "running", "cutoff": now, "started_at": now})
+        except DuplicateKeyError:
+            pass  # already claimed: wait for it below
+        else:
+            self._backfill(user_id, now)
+            return now
+
+        deadline = time.monotonic() + BACKFILL_WAIT_SECONDS
+        while True:
+            marker = self.backfills.find_one({"user_id": user_id}) or {}
+            if marker.get("state") == "done":
+                self._cutoffs[user_id] = _utc(marker["cutoff"])
+                return self._cutoffs[user_id]
+            if time.monotonic() >= deadline:
+                # its owner most likely died: take the backfill over
+                now = _stored_time()
+                taken = self.backfills.update_one(
+                    {"user_id": user_id, "state": "running", "started_at": marker.get("started_at")},
+                    {"$set": {"cutoff": now, "started_at": now}},
+                )
+                if taken.modified_count:
+                    logger.warning("Taking over stalled task_stats backfill for %s", user_id)
+                    self._backfill(user_id, now)
+                    return now
+                deadline = time.monotonic() + BACKFILL_WAIT_SECONDS
+            time.sleep(0.2)
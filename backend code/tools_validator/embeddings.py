@@ -4,6 +4,8 @@ from openai import OpenAI
 from dotenv import load_dotenv
 import numpy as np
 
+from embedding_cache import embedding_cache
+
 load_dotenv()
 openai_key = os.getenv("OPENAI_API_KEY")
 
@@ -26,11 +28,13 @@ def get_embedding(text):
         h = hashlib.sha256(text.encode("utf-8")).digest()
         return np.frombuffer(h, dtype=np.uint8)[:768] / 255.0
 
-    response = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=text
-    )
-    return response.data[0].embedding
+    model = "text-embedding-3-large"
+
+    def fetch(texts):
+        response = client.embeddings.create(model=model, input=texts[0])
+        return [response.data[0].embedding]
+
+    return embedding_cache.embed(model, [text], fetch)[0]
 
 
 def batch_get_embeddings(items, model="text-embedding-3-large", batch_size=10):
@@ -54,26 +58,36 @@ def batch_get_embeddings(items, model="text-embedding-3-large", batch_size=10):
     print(f"📊 Starting embedding process...")
     print(f"🧾 Total items to embed: {len(items)} | Model: {model} | Batch size: {batch_size}")
 
-    all_embeddings = []
-    total_batches = (len(items) + batch_size - 1) // batch_size
-
-    for i in range(total_batches):
-        start_time = time.time()
-        batch = items[i * batch_size : (i + 1) * batch_size]
-        print(f"⚙️ Processing batch {i+1}/{total_batches} ({len(batch)} items)...", end=" ")
-
-        try:
-            response = client.embeddings.create(
-                model=model,
-                input=batch
-            )
-            batch_embeddings = [d.embedding for d in response.data]
-            all_embeddings.extend(batch_embeddings)
-            duration = round(time.time() - start_time, 2)
-            print(f"✅ Done in {duration}s")
-        except Exception as e:
-            print(f"❌ Failed batch {i+1}: {e}")
-            all_embeddings.extend([[0]*1536 for _ in batch])  # placeholder
+    fetched_count = 0
+
+    def fetch(texts):
+        nonlocal fetched_count
+        fetched_count = len(texts)
+        fetched = []
+        total_batches = (len(texts) + batch_size - 1) // batch_size
+        for i in range(total_batches):
+            start_time = time.time()
+            batch = texts[i * batch_size : (i + 1) * batch_size]
+            print(f"⚙️ Processing batch {i+1}/{total_batches} ({len(batch)} items)...", end=" ")
+
+            try:
+                response = client.embeddings.create(
+                    model=model,
+                    input=batch
+                )
+                fetched.extend(d.embedding for d in response.data)
+                duration = round(time.time() - start_time, 2)
+                print(f"✅ Done in {duration}s")
+            except Exception as e:
+                print(f"❌ Failed batch {i+1}: {e}")
+                fetched.extend(None for _ in batch)  # not cached; placeholder below
+        return fetched
+
+    # Only texts missing from the shared cache are sent to the API
+    all_embeddings = embedding_cache.embed(model, items, fetch)
+    all_embeddings = [[0]*1536 if e is None else e for e in all_embeddings]  # placeholder
+    print(f"💾 Embedding cache: {len(items) - fetched_count}/{len(items)} served from cache "
+          f"(overall hit rate {embedding_cache.stats()['hit_rate']})")
 
     print(f"🎉 All embeddings completed successfully ({len(all_embeddings)} vectors).")
     return all_embeddings